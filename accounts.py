@@ -0,0 +1,197 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import indexes
+from db import admin_col, userinfo_col
+from models import Account
+
+log = logging.getLogger(__name__)
+
+ADMIN = "admin"
+USER = "user"
+NOT_FOUND = "not_found"
+WRONG_PASSWORD = "wrong_password"
+
+REGISTERED = "registered"
+TAKEN = "taken"
+RESERVED = "reserved"
+WEAK_PASSWORD = "weak_password"
+
+#Registering relies on this index to reject taken names
+USERNAME_INDEX = "userinfo.username"
+
+#scrypt work factor as a power of two; 14 costs roughly 50 ms and 16 MB per hash
+PASSWORD_HASH_COST = int(os.getenv("PASSWORD_HASH_COST", "14"))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_PREFIX = "scrypt$"
+
+#Hashing runs here, never on the event loop or the db threads; hashlib releases the GIL while it works
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+
+
+def password_ok(password):
+    return len(password) >= 8 and bool(re.search("[a-zA-Z]", password)) and bool(re.search("[0-9]", password))
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, cost, r, p):
+    n = 1 << cost
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+
+def make_hash(password, cost=None):
+    #scrypt$<cost>$<r>$<p>$<salt>$<hash>, so older hashes still verify after the cost is raised
+    cost = cost or PASSWORD_HASH_COST
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, cost, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_PREFIX}{cost}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def _parse_hash(stored):
+    """(cost, r, p, salt, digest), or None when the value is not one of our hashes."""
+    if not stored.startswith(HASH_PREFIX):
+        return None
+    fields = stored[len(HASH_PREFIX):].split("$")
+    if len(fields) != 5:
+        return None
+    try:
+        return (
+            int(fields[0]), int(fields[1]), int(fields[2]),
+            base64.b64decode(fields[3], validate=True), base64.b64decode(fields[4], validate=True),
+        )
+    except ValueError:
+        return None
+
+
+def verify(stored, password):
+    """(matches, should be rehashed). Records from before hashing hold the plain password."""
+    parsed = _parse_hash(stored)
+    if parsed is None:
+        #Also covers a plain password that merely starts with the prefix
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+    cost, r, p, salt, digest = parsed
+    try:
+        candidate = _scrypt(password, salt, cost, r, p)
+    except (ValueError, OverflowError):
+        return False, False
+    if not hmac.compare_digest(candidate, digest):
+        return False, False
+    return True, int(cost) < PASSWORD_HASH_COST
+
+
+async def hash_password(password):
+    return await asyncio.get_running_loop().run_in_executor(hash_pool, make_hash, password)
+
+
+async def check_password(stored, password):
+    return await asyncio.get_running_loop().run_in_executor(hash_pool, verify, stored, password)
+
+
+async def find_account(username, admins=admin_col, users=userinfo_col):
+    #One round trip for both collections, each matched on its username index; admins first
+    found = await users.aggregate_records(Account, [
+        {"$match": {"username": username, "reserved": {"$exists": False}}},
+        {"$project": {**Account.FIELDS, "role": {"$literal": USER}}},
+        {"$unionWith": {"coll": admins.name, "pipeline": [
+            {"$match": {"username": username}},
+            {"$project": {**Account.FIELDS, "role": {"$literal": ADMIN}}},
+        ]}},
+    ])
+    return sorted(found, key=lambda account: account.role != ADMIN)
+
+
+async def login(username, password, admins=admin_col, users=userinfo_col):
+    #Returns ADMIN or USER on success, otherwise NOT_FOUND or WRONG_PASSWORD
+    accounts = await find_account(username, admins, users)
+    if not accounts:
+        return NOT_FOUND
+    for account in accounts:
+        matches, rehash = await check_password(account.password, password)
+        if not matches:
+            continue
+        if rehash:
+            await _upgrade_hash(account, password, admins if account.role == ADMIN else users)
+        return account.role
+    return WRONG_PASSWORD
+
+
+async def _upgrade_hash(account, password, collection):
+    #Plaintext (or weaker) records are replaced on the first successful login; matching on the
+    #old value keeps a password change made in between from being overwritten
+    try:
+        await collection.update_one(
+            {"_id": account.id, "password": account.password},
+            {"$set": {"password": await hash_password(password)}},
+        )
+    except PyMongoError as ex:
+        log.warning("Could not upgrade the stored password hash: %s", ex)
+
+
+async def register(username, password, users=userinfo_col, admins=admin_col):
+    #One insert; the unique username index rejects taken names and the placeholders held for admins
+    if not password_ok(password):
+        return WEAK_PASSWORD
+    if not indexes.unique_confirmed(USERNAME_INDEX):
+        #Until startup has seen the index (first start, or a build that failed on existing duplicates)
+        #nothing else stops a second account with the same name, so the name is looked up first
+        user, admin = await asyncio.gather(
+            users.find_one({"username": username}, {"reserved": 1}),
+            admins.find_one({"username": username}, {"_id": 1}),
+        )
+        if admin is not None or (user is not None and user.get("reserved")):
+            return RESERVED
+        if user is not None:
+            return TAKEN
+    try:
+        await users.insert_one({"username": username, "password": await hash_password(password)})
+    except DuplicateKeyError:
+        return (await taken_or_reserved([username], users))[username]
+    return REGISTERED
+
+
+async def taken_or_reserved(usernames, users=userinfo_col):
+    """TAKEN or RESERVED for each username that hit the unique index; only runs after a conflict."""
+    reserved = {
+        doc["username"]
+        for doc in await users.find({"username": {"$in": list(usernames)}, "reserved": True}, {"username": 1})
+    }
+    return {username: RESERVED if username in reserved else TAKEN for username in usernames}
+
+
+async def reserve_admin_names(admins=admin_col, users=userinfo_col):
+    #Each admin name gets a password-less placeholder in userinfo, so no patron can register it;
+    #a patron who already had the name keeps the account
+    names = [doc["username"] for doc in await admins.find({}, {"username": 1})]
+    if names:
+        await users.bulk_write(
+            [
+                UpdateOne({"username": name}, {"$setOnInsert": {"username": name, "reserved": True}}, upsert=True)
+                for name in names
+            ],
+            ordered=False,
+        )
+    return len(names)
+
+
+async def create_admins(pending, admins=admin_col, users=userinfo_col):
+    #pending: [{"username", "password"}] from the initial setup screen
+    hashes = await asyncio.gather(*(hash_password(admin["password"]) for admin in pending))
+    await admins.insert_many([
+        {"username": admin["username"], "password": hashed} for admin, hashed in zip(pending, hashes)
+    ])
+    await reserve_admin_names(admins, users)
@@ -0,0 +1,215 @@
+"""Materialized circulation statistics for the admin Analytics panel.
+
+Borrows and returns update small aggregate documents in the ``analytics``
+collection as they happen, so the dashboard reads a handful of indexed
+documents however long the loan history is:
+
+    {"_id": {"kind": "title", ...}, "kind": "title", "name", "author", "borrows", "active"}
+    {"_id": {"kind": "user", ...},  "kind": "user", "username", "borrows", "active"}
+    {"_id": {"kind": "day", ...},   "kind": "day", "day", "borrows", "returns", "late_returns",
+                                    "active", "overdue"}
+    {"_id": "totals", "borrows", "returns", "late_returns", "active", "overdue", "rebuilt_at"}
+
+Active-loan counts can drift (a stats write that failed, a loan removed by
+hand), so a periodic rebuild recounts them from the borrows collection and
+snapshots today's overdue rate. Lifetime borrow and return counts are kept
+here: returned loans leave borrows for ``borrow_history``, which may expire them.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+import search
+from db import analytics_col, borrows_col
+
+log = logging.getLogger(__name__)
+
+#How often active-loan counts are recounted from the borrows collection
+ANALYTICS_REBUILD_HOURS = float(os.getenv("ANALYTICS_REBUILD_HOURS", "6"))
+RETRY_SECONDS = 60
+
+TITLE = "title"
+USER = "user"
+DAY = "day"
+TOTALS = "totals"
+
+
+def _title_id(name, author):
+    return {"kind": TITLE, "name": name, "author": author}
+
+
+def _user_id(username):
+    return {"kind": USER, "username": username}
+
+
+def _day_id(when):
+    return {"kind": DAY, "day": when.strftime("%Y-%m-%d")}
+
+
+def _bump(doc_id, fields, counts):
+    #fields are stored next to the _id so the dashboard queries can use plain indexes
+    update = {"$inc": counts}
+    if fields:
+        update["$setOnInsert"] = fields
+    return UpdateOne({"_id": doc_id}, update, upsert=True)
+
+
+async def _write(requests, stats):
+    try:
+        await stats.bulk_write(requests, ordered=False)
+    except PyMongoError as ex:
+        #Never fails the borrow or return itself; the next rebuild corrects the active counts
+        log.warning("Could not update circulation statistics: %s", ex)
+
+
+async def record_borrow(username, name, author, when, stats=analytics_col):
+    day = _day_id(when)
+    await _write([
+        _bump(_title_id(name, author), {"kind": TITLE, "name": name, "author": author}, {"borrows": 1, "active": 1}),
+        _bump(_user_id(username), {"kind": USER, "username": username}, {"borrows": 1, "active": 1}),
+        _bump(day, {"kind": DAY, "day": day["day"]}, {"borrows": 1}),
+        _bump(TOTALS, {}, {"borrows": 1, "active": 1}),
+    ], stats)
+
+
+async def record_returns(username, loans, when, stats=analytics_col):
+    #loans: the returned loan records; a return after its due_date counts as late
+    if not loans:
+        return
+    per_title = {}
+    late = 0
+    for loan in loans:
+        key = (loan["name"], loan["author"])
+        per_title[key] = per_title.get(key, 0) + 1
+        if loan.get("due_date") is not None and loan["due_date"] < when:
+            late += 1
+    day = _day_id(when)
+    requests = [
+        _bump(_title_id(name, author), {"kind": TITLE, "name": name, "author": author}, {"active": -count})
+        for (name, author), count in per_title.items()
+    ]
+    requests += [
+        _bump(_user_id(username), {"kind": USER, "username": username}, {"active": -len(loans)}),
+        _bump(day, {"kind": DAY, "day": day["day"]}, {"returns": len(loans), "late_returns": late}),
+        _bump(TOTALS, {}, {"returns": len(loans), "late_returns": late, "active": -len(loans)}),
+    ]
+    await _write(requests, stats)
+
+
+async def rebuild(borrows=borrows_col, stats=analytics_col):
+    """Recounts active loans per title and per user and records today's overdue rate."""
+    now = datetime.now()
+    by_title, by_user, overdue = await asyncio.gather(
+        borrows.aggregate([{"$group": {"_id": {"name": "$name", "author": "$author"}, "active": {"$sum": 1}}}]),
+        borrows.aggregate([{"$group": {"_id": "$username", "active": {"$sum": 1}}}]),
+        borrows.count_documents({"due_date": {"$lt": now}}),
+    )
+    active = sum(row["active"] for row in by_user)
+    requests = [
+        UpdateOne(
+            {"_id": _title_id(row["_id"]["name"], row["_id"]["author"])},
+            {
+                "$set": {"active": row["active"], "rebuilt_at": now},
+                #Loans from before statistics were kept count at least once towards the total
+                "$max": {"borrows": row["active"]},
+                "$setOnInsert": {"kind": TITLE, "name": row["_id"]["name"], "author": row["_id"]["author"]},
+            },
+            upsert=True,
+        )
+        for row in by_title
+    ]
+    requests += [
+        UpdateOne(
+            {"_id": _user_id(row["_id"])},
+            {
+                "$set": {"active": row["active"], "rebuilt_at": now},
+                "$max": {"borrows": row["active"]},
+                "$setOnInsert": {"kind": USER, "username": row["_id"]},
+            },
+            upsert=True,
+        )
+        for row in by_user
+    ]
+    day = _day_id(now)
+    requests += [
+        UpdateOne(
+            {"_id": day},
+            {"$set": {"active": active, "overdue": overdue}, "$setOnInsert": {"kind": DAY, "day": day["day"]}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"_id": TOTALS},
+            {"$set": {"active": active, "overdue": overdue, "rebuilt_at": now}, "$max": {"borrows": active}},
+            upsert=True,
+        ),
+    ]
+    await stats.bulk_write(requests, ordered=False)
+    #Titles and users with no loans left were not in the recount
+    await stats.update_many(
+        {"kind": {"$in": [TITLE, USER]}, "active": {"$ne": 0}, "rebuilt_at": {"$ne": now}},
+        {"$set": {"active": 0, "rebuilt_at": now}},
+    )
+    log.info("Circulation statistics rebuilt: %d active loans, %d overdue", active, overdue)
+    return active, overdue
+
+
+async def dashboard(limit=10, days=30, stats=analytics_col):
+    totals, top_titles, busy_titles, top_users, history = await asyncio.gather(
+        stats.find_one({"_id": TOTALS}),
+        stats.find({"kind": TITLE}, {"name": 1, "author": 1, "borrows": 1}, sort=[("borrows", DESCENDING)], limit=limit),
+        #Utilization is ranked among the titles with the most copies out
+        stats.find({"kind": TITLE, "active": {"$gt": 0}}, {"name": 1, "author": 1, "active": 1},
+                   sort=[("active", DESCENDING)], limit=limit * 3),
+        stats.find({"kind": USER, "active": {"$gt": 0}}, {"username": 1, "active": 1},
+                   sort=[("active", DESCENDING)], limit=limit),
+        stats.find({"kind": DAY}, sort=[("day", DESCENDING)], limit=days),
+    )
+    utilization = []
+    for row in busy_titles:
+        in_stock = search.catalog.stock_of(row["name"], row["author"]) or 0
+        owned = row["active"] + max(in_stock, 0)
+        utilization.append({**row, "owned": owned, "rate": row["active"] / owned if owned else 0.0})
+    utilization.sort(key=lambda row: row["rate"], reverse=True)
+    for row in history:
+        row["late_rate"] = row.get("late_returns", 0) / row["returns"] if row.get("returns") else None
+        row["overdue_rate"] = row["overdue"] / row["active"] if row.get("active") else None
+    return {
+        "totals": totals or {},
+        "top_titles": top_titles,
+        "utilization": utilization[:limit],
+        "top_users": top_users,
+        "days": history,
+    }
+
+
+_task = None
+
+
+async def _rebuild_loop(interval):
+    while True:
+        try:
+            totals = await analytics_col.find_one({"_id": TOTALS}, {"rebuilt_at": 1})
+            last = totals.get("rebuilt_at") if totals else None
+            #Shared across restarts and app instances, so a restart does not trigger a recount
+            wait = interval - (datetime.now() - last).total_seconds() if last else 0
+            if wait <= 0:
+                started = time.perf_counter()
+                await rebuild()
+                log.info("Statistics rebuild took %.1fs", time.perf_counter() - started)
+                wait = interval
+        except Exception as ex:
+            log.warning("Statistics rebuild failed: %s", ex)
+            wait = RETRY_SECONDS
+        await asyncio.sleep(wait)
+
+
+def start_rebuilds(interval=ANALYTICS_REBUILD_HOURS * 3600):
+    global _task
+    if _task is None:
+        _task = asyncio.get_running_loop().create_task(_rebuild_loop(interval))
+    return _task
@@ -0,0 +1,121 @@
+"""Login throughput at the real password hash cost.
+
+Seeds users with scrypt-hashed passwords, then runs concurrent logins (a mix
+of right and wrong passwords) through accounts.login and reports logins/sec,
+latency percentiles, database round trips per login, and how long the event
+loop was ever stalled while the hashes were checked.
+
+    python benchmarks/bench_login.py --users 500 --logins 2000 --concurrency 64
+    python benchmarks/bench_login.py --cost 15          # what a stronger work factor costs
+
+Uses a scratch database (default ``library_login``) on BENCH_MONGO_URI
+(default mongodb://localhost:27017), dropped before and after the run.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import accounts  # noqa: E402
+import db  # noqa: E402
+import indexes  # noqa: E402
+import metrics  # noqa: E402
+from db import AsyncCollection  # noqa: E402
+from harness import percentile  # noqa: E402
+
+TICK = 0.005
+
+
+async def watch_loop(stalls, stop):
+    #A UI frame is late by however much longer than TICK this sleep takes
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        stalls.append((time.perf_counter() - start - TICK) * 1000)
+
+
+async def run(args):
+    accounts.PASSWORD_HASH_COST = args.cost
+    started = time.perf_counter()
+    accounts.make_hash("warm up")
+    one_hash = (time.perf_counter() - started) * 1000
+
+    #Before the client is made, so it gets the command listener that counts round trips
+    metrics.set_enabled(True)
+    client = db.make_client(args.uri)
+    client.drop_database(args.database)
+    database = client[args.database]
+    try:
+        passwords = [f"reader{i:06d}pass" for i in range(args.users)]
+        start = time.perf_counter()
+        hashes = list(accounts.hash_pool.map(accounts.make_hash, passwords))
+        database["userinfo"].insert_many([
+            {"username": f"reader{i}", "password": hashed} for i, hashed in enumerate(hashes)
+        ])
+        database["admin"].insert_one({"username": "admin", "password": accounts.make_hash("admin1234")})
+        indexes.ensure_indexes(database, indexes.IndexReport())
+        print(
+            f"cost 2^{args.cost}: one hash {one_hash:.1f}ms; {args.users} users seeded in "
+            f"{time.perf_counter() - start:.1f}s on {accounts.HASH_WORKERS} hash threads"
+        )
+
+        users = AsyncCollection(database["userinfo"])
+        admins = AsyncCollection(database["admin"])
+        rng = random.Random(args.seed)
+        attempts = []
+        for _ in range(args.logins):
+            i = rng.randrange(args.users)
+            attempts.append((f"reader{i}", passwords[i] if rng.random() >= args.wrong else "wrong1234"))
+
+        latencies = []
+        outcomes = {}
+        queue = iter(attempts)
+
+        async def worker():
+            for username, password in queue:
+                start = time.perf_counter()
+                result = await accounts.login(username, password, admins=admins, users=users)
+                latencies.append((time.perf_counter() - start) * 1000)
+                outcomes[result] = outcomes.get(result, 0) + 1
+
+        metrics.reset()
+        stalls = []
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(watch_loop(stalls, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await watcher
+    finally:
+        client.drop_database(args.database)
+
+    trips = metrics.counters.get("db.round_trips", 0)
+    print(
+        f"{len(latencies)} logins in {elapsed:.1f}s = {len(latencies) / elapsed:.1f}/s at concurrency {args.concurrency}; "
+        f"p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms p99={percentile(latencies, 99):.1f}ms"
+    )
+    print(f"  {trips / len(latencies):.2f} db round trips per login; outcomes {outcomes}")
+    print(f"  event loop stalls: p99={percentile(stalls, 99):.1f}ms max={max(stalls):.1f}ms")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--logins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--cost", type=int, default=accounts.PASSWORD_HASH_COST, help="scrypt work factor, log2 N")
+    parser.add_argument("--wrong", type=float, default=0.1, help="share of attempts with a wrong password")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="library_login")
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Memory and decode time: plain dicts versus models records on large result sets.
+
+Encodes synthetic books and loans to BSON, split into batches the way a
+cursor receives them (101 documents, then up to 16 MB), and decodes them two
+ways:
+
+* dicts: every field of every document into a list of dicts, as
+  ``list(collection.find(query))`` did
+* records: only the projected fields (models.*.FIELDS, which the server
+  applies before sending), each document decoded from the raw batch only
+  when its record is built, as AsyncCollection.stream_records does
+
+    python benchmarks/bench_models.py --count 100000
+
+Needs no server: it measures the client side only, which is where the
+memory goes.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Book, Loan  # noqa: E402
+
+FIRST_BATCH = 101
+BATCH_BYTES = 16 * 1024 * 1024
+
+
+def make_books(rng, count):
+    now = datetime.now()
+    return [{
+        "_id": ObjectId(),
+        "name": f"Title {i} of the {rng.choice(['Sea', 'Stars', 'North', 'City'])}",
+        "author": f"Author {rng.randrange(count // 10 + 1)}",
+        "number": rng.randrange(20),
+        "updated_at": now - timedelta(seconds=rng.randrange(10**6)),
+    } for i in range(count)]
+
+
+def make_loans(rng, count):
+    now = datetime.now()
+    loans = []
+    for _ in range(count):
+        date = now - timedelta(days=rng.randrange(60))
+        loans.append({
+            "_id": ObjectId(),
+            "username": f"reader{rng.randrange(count // 20 + 1)}",
+            "name": f"Title {rng.randrange(count)}",
+            "author": f"Author {rng.randrange(count // 10 + 1)}",
+            "book_id": ObjectId(),
+            "date": date,
+            "due_date": date + timedelta(days=14),
+        })
+    return loans
+
+
+def project(doc, fields):
+    return {key: value for key, value in doc.items() if key == "_id" or key in fields}
+
+
+def batches(docs):
+    #Raw BSON as the server sends it: a small first batch, then batches capped by size
+    encoded = [bson.encode(doc) for doc in docs]
+    out = [b"".join(encoded[:FIRST_BATCH])]
+    current, size = [], 0
+    for raw in encoded[FIRST_BATCH:]:
+        if size + len(raw) > BATCH_BYTES and current:
+            out.append(b"".join(current))
+            current, size = [], 0
+        current.append(raw)
+        size += len(raw)
+    if current:
+        out.append(b"".join(current))
+    return out
+
+
+def decode_dicts(raw_batches):
+    result = []
+    for raw in raw_batches:
+        result.extend(bson.decode_all(raw))
+    return result
+
+
+def decode_records(raw_batches, model):
+    return [model.from_doc(doc) for raw in raw_batches for doc in bson.decode_iter(raw)]
+
+
+def measure(label, decode):
+    #Timed on its own first: tracemalloc slows allocation-heavy code down several times
+    gc.collect()
+    start = time.perf_counter()
+    result = decode()
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = decode()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<8} {len(result):>8,} in {elapsed * 1000:8.1f}ms  retained {retained / 2**20:7.1f} MB  peak {peak / 2**20:7.1f} MB")
+    del result
+    return elapsed, retained
+
+
+def compare(kind, docs, model):
+    full = batches(docs)
+    projected = batches([project(doc, model.FIELDS) for doc in docs])
+    print(f"\n{kind}: {len(docs):,} documents, {sum(map(len, full)) / 2**20:.1f} MB full, "
+          f"{sum(map(len, projected)) / 2**20:.1f} MB projected, {len(full)} batches")
+    dict_time, dict_mem = measure("dicts", lambda: decode_dicts(full))
+    record_time, record_mem = measure("records", lambda: decode_records(projected, model))
+    print(f"  records use {record_mem / dict_mem:.0%} of the memory and {record_time / dict_time:.0%} of the time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    compare("books", make_books(rng, args.count), Book)
+    compare("loans", make_loans(rng, args.count), Loan)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Query latency benchmark for the in-memory catalog search index.
+
+Builds a synthetic catalog at each size and times exact, prefix, typo and
+multi-word queries against search.SearchIndex.
+
+    python benchmarks/bench_search.py --sizes 10000 100000 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Book  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+SYLLABLES = [
+    "ka", "lo", "mer", "din", "sa", "tor", "vel", "an", "ri", "mo", "gar", "el",
+    "nu", "bra", "shi", "ten", "qua", "il", "dor", "pe", "fa", "lin", "zu", "or",
+]
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_catalog(rng, count, vocabulary, surnames):
+    #Zipf-like word popularity so some tokens are very common, as in real titles
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    books = []
+    for _ in range(count):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 5))
+        books.append({
+            "name": " ".join(w.capitalize() for w in words),
+            "author": f"{rng.choice(surnames).capitalize()} {rng.choice(surnames).capitalize()}",
+            "number": rng.randint(0, 5),
+        })
+    return books
+
+
+def typo(rng, word):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def make_queries(rng, books, count):
+    queries = {"exact": [], "prefix": [], "typo": [], "multi": []}
+    for book in rng.sample(books, count):
+        words = book["name"].lower().split()
+        word = rng.choice(words)
+        queries["exact"].append(word)
+        queries["prefix"].append(word[:max(2, len(word) // 2)])
+        queries["typo"].append(typo(rng, word))
+        queries["multi"].append(" ".join(words[:2] + [book["author"].split()[-1].lower()]))
+    return queries
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(size, queries_per_kind, seed):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, max(2000, min(50000, size // 20)))
+    surnames = make_vocabulary(rng, 3000)
+    books = make_catalog(rng, size, vocabulary, surnames)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.load([Book.from_doc(book) for book in books])
+    build = time.perf_counter() - start
+    print(f"\n{size:,} titles: built in {build:.2f}s ({len(index._vocab):,} distinct tokens)")
+
+    for kind, queries in make_queries(rng, books, queries_per_kind).items():
+        samples = []
+        hits = 0
+        for query in queries:
+            start = time.perf_counter()
+            results = index.search(query)
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += bool(results)
+        print(
+            f"  {kind:<7} p50={percentile(samples, 50):7.2f}ms p95={percentile(samples, 95):7.2f}ms "
+            f"p99={percentile(samples, 99):7.2f}ms mean={statistics.fmean(samples):7.2f}ms "
+            f"hit rate={hits / len(queries):.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
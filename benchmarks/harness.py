@@ -0,0 +1,416 @@
+"""Headless workload benchmark for the app's business logic.
+
+Seeds a scratch database with synthetic books, users and borrows (skewed
+popularity and loan dates), then drives the code behind login, register,
+borrow, return, search, My Books, the overdue report and the analytics
+dashboard, with no window.
+
+    python benchmarks/harness.py --scales small medium
+    python benchmarks/harness.py --memory               # mongomock stand-in, no server needed
+    python benchmarks/harness.py --compare old.json new.json
+
+Connects to BENCH_MONGO_URI (default mongodb://localhost:27017) and uses a
+scratch database (default ``library_bench``) that is dropped before each scale
+and after the run. Each scale writes ``<out>/<scale>-<commit>.json`` so runs
+can be compared between commits. mongomock timings only show relative
+costs inside this process; compare runs against a real mongod.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient  # noqa: E402
+
+import accounts  # noqa: E402
+import analytics  # noqa: E402
+import circulation  # noqa: E402
+import history  # noqa: E402
+import indexes  # noqa: E402
+import metrics  # noqa: E402
+import outbox  # noqa: E402
+import search  # noqa: E402
+from bench_search import make_catalog, make_queries, make_vocabulary  # noqa: E402
+from catalog_cache import CatalogCache  # noqa: E402
+from models import Book, Loan  # noqa: E402
+import db  # noqa: E402
+from db import AsyncCollection  # noqa: E402
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+#scale -> (books, users, borrows, operations per workload)
+SCALES = {
+    "small": (1_000, 200, 2_000, 200),
+    "medium": (20_000, 2_000, 40_000, 500),
+    "large": (200_000, 20_000, 400_000, 1_000),
+}
+#borrow and return call circulation directly; the *_outbox workloads go through outbox, as every session does
+WORKLOADS = [
+    "login", "register", "search", "borrow", "borrow_outbox", "return", "return_outbox", "history", "my_books",
+    "overdue", "analytics",
+]
+#The account lookup uses $unionWith, which mongomock does not implement
+MONGOMOCK_SKIPS = {"login"}
+INSERT_CHUNK = 5_000
+ADMIN = ("admin", "admin1234")
+
+
+def password_for(i):
+    return f"reader{i:06d}pass"
+
+
+def zipf_weights(count, s=1.0):
+    return list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(count)))
+
+
+def generate(rng, n_books, n_users, n_borrows):
+    vocabulary = make_vocabulary(rng, max(2000, min(50000, n_books // 20)))
+    surnames = make_vocabulary(rng, 3000)
+    books = {}
+    for book in make_catalog(rng, n_books, vocabulary, surnames):
+        books.setdefault((book["name"], book["author"]), book)
+    books = list(books.values())
+    users = [{"username": f"reader{i}", "password": password_for(i)} for i in range(n_users)]
+
+    #A few heavy readers and a few bestsellers account for most loans
+    now = datetime.now()
+    user_weights = zipf_weights(n_users, 0.8)
+    book_weights = zipf_weights(len(books), 1.0)
+    borrows = []
+    for user, book in zip(
+        rng.choices(users, cum_weights=user_weights, k=n_borrows),
+        rng.choices(books, cum_weights=book_weights, k=n_borrows),
+    ):
+        #Most loans are recent, with a long tail of old (overdue) ones
+        date = now - timedelta(days=min(180.0, rng.expovariate(1 / 10)))
+        borrows.append({
+            "username": user["username"],
+            "name": book["name"],
+            "author": book["author"],
+            "date": date,
+            "due_date": circulation.due_date_for(date),
+        })
+    return books, users, borrows, book_weights, user_weights
+
+
+def seed(database, books, users, borrows):
+    #Passwords are stored hashed at the app's real cost, as register does
+    for user, hashed in zip(users, accounts.hash_pool.map(accounts.make_hash, [u["password"] for u in users])):
+        user["password"] = hashed
+    #insert_many fills in each document's _id, which the loans then link to
+    for name, docs in (("books", books), ("userinfo", users)):
+        for start in range(0, len(docs), INSERT_CHUNK):
+            database[name].insert_many(docs[start:start + INSERT_CHUNK], ordered=False)
+    ids = {(b["name"], b["author"]): b["_id"] for b in books}
+    for loan in borrows:
+        loan["book_id"] = ids[(loan["name"], loan["author"])]
+    for start in range(0, len(borrows), INSERT_CHUNK):
+        database["borrows"].insert_many(borrows[start:start + INSERT_CHUNK], ordered=False)
+    database["admin"].insert_one({"username": ADMIN[0], "password": accounts.make_hash(ADMIN[1])})
+    database["userinfo"].insert_one({"username": ADMIN[0], "reserved": True})
+    report = indexes.IndexReport()
+    indexes.ensure_indexes(database, report)
+    #What the app's startup bootstrap records; register skips its fallback name check once it is set
+    indexes.last_report = report
+
+
+def use_app_collections(database):
+    #outbox writes through the app's shared collections, so they are pointed at the scratch database
+    for col in (db.books_col, db.userinfo_col, db.admin_col, db.borrows_col, db.analytics_col, db.history_col):
+        col._collection = database[col.name]
+
+
+def start_outbox(directory):
+    #A fresh queue file per run, so nothing left from an earlier run is replayed into the scratch database
+    outbox.queue.stop()
+    outbox.queue = outbox.Outbox(os.path.join(directory, "outbox.sqlite3"))
+    outbox.queue.start()
+    return outbox.queue
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run_workload(name, ops, concurrency):
+    #ops: zero-argument coroutine factories; each returns an outcome label
+    latencies = []
+    outcomes = Counter()
+    errors = Counter()
+    queue = iter(ops)
+
+    async def worker():
+        for op in queue:
+            start = time.perf_counter()
+            try:
+                with metrics.action(f"bench.{name}"):
+                    outcomes[await op()] += 1
+            except Exception as ex:
+                errors[f"{type(ex).__name__}: {ex}"[:120]] += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) if latencies else 0.0,
+        "p95_ms": percentile(latencies, 95) if latencies else 0.0,
+        "p99_ms": percentile(latencies, 99) if latencies else 0.0,
+        "outcomes": dict(outcomes),
+        "errors": dict(errors.most_common(5)),
+    }
+
+
+def build_workloads(rng, scale, cols, books, users, borrows, book_weights, user_weights, n_ops, cache):
+    books_c, users_c, admins_c, borrows_c, stats_c, history_c = cols
+
+    def pick_user():
+        return rng.choices(range(len(users)), cum_weights=user_weights)[0]
+
+    def pick_book():
+        return rng.choices(books, cum_weights=book_weights)[0]
+
+    def login_op():
+        roll = rng.random()
+        if roll < 0.1:
+            username, password = ADMIN
+        elif roll < 0.2:
+            username, password = f"ghost{rng.randrange(10**6)}", "nobody123"
+        else:
+            i = pick_user()
+            username, password = f"reader{i}", password_for(i) if roll < 0.9 else "wrong1234"
+        return lambda: accounts.login(username, password, admins=admins_c, users=users_c)
+
+    def register_op(i):
+        username = f"new_{scale}_{i}"
+        return lambda: accounts.register(username, password_for(i), users=users_c)
+
+    async def search_op(query):
+        return "hit" if await search.find_books(query, books_c) else "miss"
+
+    async def borrow_op(username, book):
+        return await circulation.borrow_book(
+            username, book["name"], book["author"], books=books_c, borrows=borrows_c, cache=cache, stats=stats_c,
+        )
+
+    async def return_op(loan):
+        returned = await circulation.return_loans(
+            loan["username"], [loan], books=books_c, borrows=borrows_c, cache=cache, stats=stats_c, archive=history_c,
+        )
+        return "returned" if returned else "already_returned"
+
+    async def borrow_outbox_op(username, book):
+        return await outbox.borrow(username, book["name"], book["author"])
+
+    async def return_outbox_op(loan):
+        returned = await outbox.return_loans(loan["username"], [Loan.from_doc(loan)])
+        if returned == outbox.QUEUED:
+            return returned
+        return "returned" if returned else "already_returned"
+
+    async def history_op(username):
+        #What go_borrow_history does on open; runs after the return workload has filled the archive
+        _, (docs, _) = await asyncio.gather(
+            history.count_for_user(username, history=history_c),
+            history.user_page(username, history=history_c),
+        )
+        return "ok" if docs else "empty"
+
+    async def my_books_op(username):
+        #What go_my_books does on open: the count and the first page together
+        await asyncio.gather(
+            circulation.count_loans(username, borrows=borrows_c),
+            circulation.loans_page(username, borrows=borrows_c),
+        )
+        return "ok"
+
+    async def overdue_op():
+        _, (docs, cursor) = await asyncio.gather(
+            circulation.count_overdue(borrows=borrows_c),
+            circulation.overdue_page(borrows=borrows_c),
+        )
+        if cursor is not None:
+            await circulation.overdue_page(cursor, borrows=borrows_c)
+        return "ok" if docs else "empty"
+
+    async def analytics_op():
+        board = await analytics.dashboard(stats=stats_c)
+        return "ok" if board["top_titles"] else "empty"
+
+    queries = [q for kind in make_queries(rng, books, max(1, n_ops // 4)).values() for q in kind]
+    #Each return workload gets its own loans
+    returned_loans = rng.sample(borrows, min(2 * n_ops, len(borrows)))
+    return {
+        "login": [login_op() for _ in range(n_ops)],
+        "register": [register_op(i) for i in range(n_ops)],
+        "search": [lambda q=q: search_op(q) for q in queries[:n_ops]],
+        "borrow": [
+            lambda u=f"reader{pick_user()}", b=pick_book(): borrow_op(u, b) for _ in range(n_ops)
+        ],
+        "borrow_outbox": [
+            lambda u=f"reader{pick_user()}", b=pick_book(): borrow_outbox_op(u, b) for _ in range(n_ops)
+        ],
+        "return": [lambda loan=loan: return_op(loan) for loan in returned_loans[:n_ops]],
+        "return_outbox": [lambda loan=loan: return_outbox_op(loan) for loan in returned_loans[n_ops:]],
+        "history": [lambda u=f"reader{pick_user()}": history_op(u) for _ in range(n_ops)],
+        "my_books": [lambda u=f"reader{pick_user()}": my_books_op(u) for _ in range(n_ops)],
+        "overdue": [overdue_op for _ in range(max(1, n_ops // 10))],
+        "analytics": [analytics_op for _ in range(max(1, n_ops // 10))],
+    }
+
+
+async def run_scale(scale, client, database_name, concurrency, seed_value, backend):
+    n_books, n_users, n_borrows, n_ops = SCALES[scale]
+    rng = random.Random(seed_value)
+    client.drop_database(database_name)
+    database = client[database_name]
+
+    start = time.perf_counter()
+    books, users, borrows, book_weights, user_weights = generate(rng, n_books, n_users, n_borrows)
+    seed(database, books, users, borrows)
+    seeded = time.perf_counter() - start
+    print(f"\n[{scale}] {len(books):,} books, {n_users:,} users, {n_borrows:,} borrows seeded in {seeded:.1f}s")
+
+    cols = tuple(AsyncCollection(database[name]) for name in ("books", "userinfo", "admin", "borrows", "analytics", "borrow_history"))
+    use_app_collections(database)
+    search.catalog.load([Book.from_doc(book) for book in books])
+    search.results_cache.clear()
+    start = time.perf_counter()
+    await analytics.rebuild(borrows=cols[3], stats=cols[4])
+    rebuilt = time.perf_counter() - start
+    print(f"  analytics rebuild over {n_borrows:,} loans took {rebuilt:.2f}s")
+    workloads = build_workloads(
+        rng, scale, cols, books, users, borrows, book_weights, user_weights, n_ops, CatalogCache(),
+    )
+
+    metrics.reset()
+    results = {}
+    for name in WORKLOADS:
+        if backend == "mongomock" and name in MONGOMOCK_SKIPS:
+            print(f"  {name:<13} skipped: not supported by mongomock")
+            continue
+        results[name] = await run_workload(name, workloads[name], concurrency)
+        trips = metrics.counters.get(f"bench.{name}.db.round_trips")
+        if trips is not None:
+            results[name]["db_round_trips_per_op"] = trips / max(1, results[name]["ops"])
+        r = results[name]
+        print(
+            f"  {name:<13} {r['ops']:>5} ops {r['ops_per_sec']:9.1f}/s  p50={r['p50_ms']:7.2f}ms "
+            f"p95={r['p95_ms']:7.2f}ms p99={r['p99_ms']:7.2f}ms  {r['outcomes']}"
+        )
+        for message, count in r["errors"].items():
+            print(f"      {count} x {message}")
+
+    return {
+        "scale": scale,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "backend": backend,
+        "concurrency": concurrency,
+        "seed": seed_value,
+        "data": {"books": len(books), "users": n_users, "borrows": n_borrows},
+        "seed_seconds": seeded,
+        "analytics_rebuild_seconds": rebuilt,
+        "workloads": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']} ({new['scale']}, {new['backend']})")
+    print(f"  {'workload':<9} {'ops/s':>18} {'p95 ms':>20} {'p99 ms':>20}")
+    for name, after in new["workloads"].items():
+        before = old["workloads"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for key in ("ops_per_sec", "p95_ms", "p99_ms"):
+            delta = (after[key] - before[key]) / before[key] if before[key] else 0.0
+            cells.append(f"{after[key]:9.1f} ({delta:+6.1%})")
+        print(f"  {name:<13} " + " ".join(f"{cell:>20}" for cell in cells))
+    return 0
+
+
+async def run(args):
+    if args.memory:
+        client = mongomock.MongoClient()
+        backend = "mongomock"
+        #mongomock is not thread-safe, so its calls are serialised on one db thread
+        db.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    else:
+        metrics.set_enabled(True)
+        client = MongoClient(args.uri, event_listeners=[metrics.CommandMetrics()])
+        backend = "mongod"
+
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        for scale in args.scales:
+            with tempfile.TemporaryDirectory() as queue_dir:
+                queue = start_outbox(queue_dir)
+                try:
+                    report = await run_scale(scale, client, args.database, args.concurrency, args.seed, backend)
+                finally:
+                    queue.stop()
+            path = os.path.join(args.out, f"{scale}-{report['commit']}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"  report: {path}")
+    finally:
+        client.drop_database(args.database)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="library_bench")
+    parser.add_argument("--memory", action="store_true", help="use mongomock instead of a server")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.memory and mongomock is None:
+        parser.error("--memory needs mongomock (pip install mongomock)")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Load test: hundreds of concurrent patron sessions in one server process.
+
+Each simulated session does what a patron at a browser tab does: log in,
+search a few times, borrow a title, open My Books and return the loan, with
+think time between steps. All sessions share one connection pool, db
+executor and write queue, exactly as in web mode (WEB_PORT). Borrows and
+returns go through outbox, as in the app; --direct calls circulation instead,
+to tell the queue's cost apart from the database's.
+
+    python benchmarks/load_sessions.py --sessions 300 --rounds 3 --think 0.5
+
+Seeds a scratch database (default ``library_load``) on BENCH_MONGO_URI
+(default mongodb://localhost:27017) and drops it afterwards. Pool settings come
+from the same DB_* variables as the app.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import accounts  # noqa: E402
+import circulation  # noqa: E402
+import db  # noqa: E402
+import outbox  # noqa: E402
+import search  # noqa: E402
+from catalog_cache import CatalogCache  # noqa: E402
+from db import AsyncCollection  # noqa: E402
+from harness import generate, git_commit, password_for, percentile, seed, start_outbox, use_app_collections  # noqa: E402
+from models import Book, Loan  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.errors = Counter()
+
+    async def step(self, name, coro):
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception as ex:
+            self.errors[f"{name}: {type(ex).__name__}: {ex}"[:120]] += 1
+            result = None
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        return result
+
+    def report(self, elapsed):
+        steps = {}
+        for name, samples in self.latencies.items():
+            steps[name] = {
+                "ops": len(samples),
+                "ops_per_sec": len(samples) / elapsed,
+                "mean_ms": statistics.fmean(samples),
+                "p50_ms": percentile(samples, 50),
+                "p95_ms": percentile(samples, 95),
+                "p99_ms": percentile(samples, 99),
+                "outcomes": dict(self.outcomes[name]),
+            }
+        return steps
+
+
+async def patron(rng, recorder, cols, books, user_index, rounds, think, cache, direct):
+    books_c, users_c, admins_c, borrows_c, stats_c, history_c = cols
+    username = f"reader{user_index}"
+
+    async def pause():
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+    result = await recorder.step("login", accounts.login(username, password_for(user_index), admins=admins_c, users=users_c))
+    recorder.outcomes["login"][result] += 1
+    for _ in range(rounds):
+        await pause()
+        book = rng.choice(books)
+        query = rng.choice(book["name"].split())
+        found = await recorder.step("search", search.find_books(query, books_c))
+        recorder.outcomes["search"]["hit" if found else "miss"] += 1
+
+        await pause()
+        if direct:
+            borrowing = circulation.borrow_book(
+                username, book["name"], book["author"], books=books_c, borrows=borrows_c, cache=cache, stats=stats_c,
+            )
+        else:
+            borrowing = outbox.borrow(username, book["name"], book["author"])
+        result = await recorder.step("borrow", borrowing)
+        recorder.outcomes["borrow"][result] += 1
+
+        await pause()
+        await recorder.step("my_books", asyncio.gather(
+            circulation.count_loans(username, borrows=borrows_c),
+            circulation.loans_page(username, borrows=borrows_c),
+        ))
+
+        if result == circulation.BORROWED:
+            await pause()
+            #Heavy readers have more than one page of loans, so the new one is looked up (untimed)
+            loan = await borrows_c.find_one(
+                {"username": username, "name": book["name"], "author": book["author"]},
+                {"_id": 1, "book_id": 1, "name": 1, "author": 1, "date": 1, "due_date": 1},
+                sort=[("date", -1)],
+            )
+            loans = [loan] if loan else []
+            if direct:
+                returning = circulation.return_loans(
+                    username, loans, books=books_c, borrows=borrows_c, cache=cache, stats=stats_c, archive=history_c,
+                )
+            else:
+                returning = outbox.return_loans(username, [Loan.from_doc(loan) for loan in loans])
+            returned = await recorder.step("return", returning)
+            if returned == outbox.QUEUED:
+                recorder.outcomes["return"][returned] += 1
+            else:
+                recorder.outcomes["return"]["returned" if returned else "missing"] += 1
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = db.make_client(args.uri)
+    client.drop_database(args.database)
+    database = client[args.database]
+    books, users, borrows, _, _ = generate(rng, args.books, max(args.sessions, 100), args.books * 2)
+    seed(database, books, users, borrows)
+    search.catalog.load([Book.from_doc(book) for book in books])
+    cols = tuple(AsyncCollection(database[name]) for name in ("books", "userinfo", "admin", "borrows", "analytics", "borrow_history"))
+    use_app_collections(database)
+    print(f"Seeded {len(books):,} books; {args.sessions} sessions x {args.rounds} rounds, think {args.think}s, "
+          f"pool {db.DB_MAX_POOL_SIZE}, {db.DB_WORKERS} db threads, "
+          f"borrows and returns {'direct' if args.direct else 'through the outbox'}")
+
+    recorder = Recorder()
+    cache = CatalogCache()
+    db.inflight.reset_peak()
+
+    async def start_session(i):
+        #Sessions arrive spread over the ramp-up period rather than all at once
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        session_rng = random.Random(args.seed * 100_003 + i)
+        await patron(session_rng, recorder, cols, books, i % len(users), args.rounds, args.think, cache, args.direct)
+
+    queue_dir = tempfile.TemporaryDirectory()
+    queue = start_outbox(queue_dir.name)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(start_session(i) for i in range(args.sessions)))
+    finally:
+        elapsed = time.perf_counter() - start
+        queue_depth = queue.stats()["depth"]
+        queue.stop()
+        queue_dir.cleanup()
+        client.drop_database(args.database)
+
+    steps = recorder.report(elapsed)
+    total = sum(step["ops"] for step in steps.values())
+    print(f"\n{total} operations in {elapsed:.1f}s = {total / elapsed:.1f} ops/s; "
+          f"peak db calls in flight {db.inflight.snapshot()['peak']}; {queue_depth} operation(s) left queued")
+    for name, step in steps.items():
+        print(
+            f"  {name:<9} {step['ops']:>6} ops {step['ops_per_sec']:8.1f}/s  p50={step['p50_ms']:7.1f}ms "
+            f"p95={step['p95_ms']:7.1f}ms p99={step['p99_ms']:7.1f}ms  {step['outcomes']}"
+        )
+    for message, count in recorder.errors.most_common(10):
+        print(f"      {count} x {message}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "sessions": args.sessions,
+                "rounds": args.rounds,
+                "think_s": args.think,
+                "path": "direct" if args.direct else "outbox",
+                "left_queued": queue_depth,
+                "pool": {"max": db.DB_MAX_POOL_SIZE, "min": db.DB_MIN_POOL_SIZE, "workers": db.DB_WORKERS},
+                "elapsed_s": elapsed,
+                "ops_per_sec": total / elapsed,
+                "steps": steps,
+                "errors": dict(recorder.errors),
+            }, f, indent=2)
+        print(f"  report: {args.out}")
+    return 1 if recorder.errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--think", type=float, default=0.5, help="mean think time between steps, in seconds")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which sessions start")
+    parser.add_argument("--books", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="library_load")
+    parser.add_argument("--out", help="write the report as JSON to this file")
+    parser.add_argument("--direct", action="store_true", help="borrow and return through circulation, skipping the outbox")
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Concurrency stress test for borrowing.
+
+Runs many parallel borrowers against one title with a limited number of
+copies, once with the old find/check/update/insert sequence and once with
+circulation.borrow_book, and reports oversold copies and borrows/sec.
+
+    python benchmarks/stress_borrow.py --copies 50 --borrowers 500
+
+Uses a scratch database (default ``library_stress``) on BENCH_MONGO_URI
+(default mongodb://localhost:27017), never the app's MONGO_URI; it is dropped
+before and after the run.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circulation  # noqa: E402
+import db  # noqa: E402
+from catalog_cache import CatalogCache  # noqa: E402
+from db import AsyncCollection  # noqa: E402
+
+NAME = "Stress Test"
+AUTHOR = "Benchmark"
+
+
+async def legacy_borrow(username, books, borrows):
+    book = await books.find_one({"name": NAME, "author": AUTHOR})
+    if book and book.get("number", 0) > 0:
+        await books.update_one({"_id": book["_id"]}, {"$inc": {"number": -1}})
+        await borrows.insert_one({"username": username, "name": NAME, "author": AUTHOR, "date": datetime.now()})
+        return circulation.BORROWED
+    return circulation.OUT_OF_STOCK
+
+
+async def atomic_borrow(username, books, borrows, cache=CatalogCache()):
+    stats = AsyncCollection(borrows.collection.database["analytics"])
+    return await circulation.borrow_book(username, NAME, AUTHOR, books=books, borrows=borrows, cache=cache, stats=stats)
+
+
+async def run(label, borrow, client, database, copies, borrowers):
+    client.drop_database(database)
+    books = AsyncCollection(client[database]["books"])
+    borrows = AsyncCollection(client[database]["borrows"])
+    books.collection.create_index([("name", 1), ("author", 1)], unique=True)
+    await books.insert_one({"name": NAME, "author": AUTHOR, "number": copies})
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(borrow(f"user{i}", books, borrows) for i in range(borrowers)))
+    elapsed = time.perf_counter() - start
+
+    book = await books.find_one({"name": NAME, "author": AUTHOR})
+    loans = await borrows.count_documents({})
+    granted = results.count(circulation.BORROWED)
+    oversold = max(0, loans - copies)
+    print(
+        f"{label:<8} granted={granted:<5} loans={loans:<5} final_stock={book['number']:<5} "
+        f"oversold={oversold:<5} {borrowers / elapsed:8.1f} attempts/s {granted / elapsed:8.1f} borrows/s"
+    )
+    return book["number"] >= 0 and loans == copies - book["number"]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=50)
+    parser.add_argument("--borrowers", type=int, default=500)
+    parser.add_argument("--uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="library_stress")
+    args = parser.parse_args()
+
+    client = db.make_client(args.uri)
+    try:
+        await run("legacy", legacy_borrow, client, args.database, args.copies, args.borrowers)
+        consistent = await run("atomic", atomic_borrow, client, args.database, args.copies, args.borrowers)
+    finally:
+        client.drop_database(args.database)
+
+    if not consistent:
+        print("FAIL: atomic borrow oversold or lost copies")
+        return 1
+    print("OK: atomic borrow never drove stock below zero")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,257 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import metrics
+import search
+
+log = logging.getLogger(__name__)
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "5000"))
+#Polling fallback for deployments without a replica set (no change streams)
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "5"))
+#Every Nth poll also lists all _ids, because polling on updated_at cannot see deletes
+CATALOG_FULL_SYNC_EVERY = 12
+#Cached stock is trusted for the borrow pre-check only while the feed is this fresh
+MAX_TRUSTED_STALENESS = 30.0
+
+BOOK_FIELDS = {"_id": 1, "name": 1, "author": 1, "number": 1, "updated_at": 1}
+
+
+class CatalogCache:
+    """Bounded LRU of (name, author) -> {"_id", "number"}, read through to the books collection."""
+
+    def __init__(self, maxsize=CATALOG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        #Set by the feed: how it keeps the cache fresh and when it last confirmed it
+        self.mode = "off"
+        self.last_sync = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def peek(self, name, author):
+        with self._lock:
+            entry = self._entries.get((name, author))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((name, author))
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, book):
+        key = (book["name"], book["author"])
+        with self._lock:
+            old_key = self._keys_by_id.get(book["_id"])
+            if old_key is not None and old_key != key:
+                self._entries.pop(old_key, None)
+            self._entries[key] = {"_id": book["_id"], "number": book.get("number", 0)}
+            self._entries.move_to_end(key)
+            self._keys_by_id[book["_id"]] = key
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self._keys_by_id.pop(evicted["_id"], None)
+
+    def update(self, book):
+        #Feed events only refresh entries we already hold; anything else is read through on demand
+        with self._lock:
+            held = book["_id"] in self._keys_by_id
+        if held:
+            self.put(book)
+
+    def invalidate(self, name, author):
+        with self._lock:
+            entry = self._entries.pop((name, author), None)
+            if entry is not None:
+                self._keys_by_id.pop(entry["_id"], None)
+
+    def remove_id(self, oid):
+        with self._lock:
+            key = self._keys_by_id.pop(oid, None)
+            if key is not None:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+    @property
+    def staleness(self):
+        if self.last_sync is None:
+            return None
+        return time.time() - self.last_sync
+
+    @property
+    def trusted(self):
+        staleness = self.staleness
+        return staleness is not None and staleness <= MAX_TRUSTED_STALENESS
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "staleness_s": self.staleness,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    async def get(self, name, author, books):
+        entry = self.peek(name, author)
+        if entry is not None:
+            return entry
+        book = await books.find_one({"name": name, "author": author}, BOOK_FIELDS)
+        if book is None:
+            return None
+        self.put(book)
+        return {"_id": book["_id"], "number": book.get("number", 0)}
+
+
+class CatalogFeed:
+    """Background thread that pushes book changes into the cache and the search index."""
+
+    def __init__(self, collection, cache, loop):
+        self.collection = collection
+        self.cache = cache
+        self.loop = loop
+        self._stop = threading.Event()
+        #Set once the feed is listening: the change stream is open, or the poll watermark is taken
+        self.opened = threading.Event()
+        #Set by the caller once the initial catalog load is done; changes are only applied after it,
+        #so a write made during the load is applied on top of it instead of being wiped by it
+        self.loaded = threading.Event()
+        self._watermark = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="catalog-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self._watch()
+        except OperationFailure as ex:
+            log.info("Change streams unavailable (%s); polling every %ss", ex, CATALOG_POLL_SECONDS)
+            self._poll()
+        except PyMongoError:
+            log.exception("Catalog change stream failed; falling back to polling")
+            self._poll()
+        finally:
+            self.opened.set()
+
+    def _wait_loaded(self):
+        while not self.loaded.wait(1) and not self._stop.is_set():
+            pass
+
+    def _latest_update(self):
+        latest = self.collection.find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+        #updated_at is written by the server in UTC
+        return (latest or {}).get("updated_at") or datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def _watch(self):
+        with self.collection.watch(full_document="updateLookup", max_await_time_ms=1000) as stream:
+            self.cache.mode = "change_stream"
+            #Changes made while the catalog loads wait in the stream
+            self.opened.set()
+            self._wait_loaded()
+            while not self._stop.is_set():
+                change = stream.try_next()
+                #An empty batch still proves nothing changed up to now
+                self.cache.last_sync = time.time()
+                if change is not None:
+                    self._apply_change(change)
+
+    def _apply_change(self, change):
+        op = change["operationType"]
+        if op in ("insert", "update", "replace") and change.get("fullDocument"):
+            self._apply_book(change["fullDocument"])
+        elif op == "delete":
+            self._apply_delete(change["documentKey"]["_id"])
+        elif op in ("drop", "invalidate"):
+            self.loop.call_soon_threadsafe(self.cache.clear)
+
+    def _apply_book(self, book):
+        #The search index is owned by the event loop thread, so changes are handed over to it
+        self.loop.call_soon_threadsafe(_apply_book, self.cache, book)
+
+    def _apply_delete(self, oid):
+        self.loop.call_soon_threadsafe(_apply_delete, self.cache, oid)
+
+    def _poll(self):
+        self.cache.mode = "polling"
+        try:
+            #Taken before the initial catalog load, so writes made during it are picked up by the first poll
+            self._watermark = self._latest_update()
+        except PyMongoError:
+            log.exception("Catalog poll failed")
+        self.opened.set()
+        self._wait_loaded()
+        polls = 0
+        while not self._stop.is_set():
+            try:
+                if self._watermark is None:
+                    self._watermark = self._latest_update()
+                #$gte: a write in the same millisecond as the watermark must not be missed
+                query = {"updated_at": {"$gte": self._watermark}}
+                for book in self.collection.find(query, BOOK_FIELDS, sort=[("updated_at", 1)]):
+                    if book.get("updated_at") is not None:
+                        self._watermark = book["updated_at"]
+                    self._apply_book(book)
+                polls += 1
+                if polls % CATALOG_FULL_SYNC_EVERY == 0:
+                    live = {doc["_id"] for doc in self.collection.find({}, {"_id": 1})}
+                    self.loop.call_soon_threadsafe(_drop_missing, self.cache, live)
+                self.cache.last_sync = time.time()
+            except PyMongoError:
+                log.exception("Catalog poll failed")
+            self._stop.wait(CATALOG_POLL_SECONDS)
+
+
+def _apply_book(cache, book):
+    cache.update(book)
+    key = search.catalog.key_of(book["_id"])
+    if key is not None and key != (book["name"], book["author"]):
+        search.catalog.remove(*key)
+    search.catalog.add(book)
+
+
+def _apply_delete(cache, oid):
+    cache.remove_id(oid)
+    search.catalog.remove_by_id(oid)
+
+
+def _drop_missing(cache, live_ids):
+    for oid in search.catalog.oids() - live_ids:
+        _apply_delete(cache, oid)
+
+
+#Shared by every session in this process
+cache = CatalogCache()
+metrics.gauge("catalog_cache", cache.stats)
+_feed = None
+
+
+def start_feed(collection, loop):
+    global _feed
+    if _feed is None:
+        _feed = CatalogFeed(collection, cache, loop)
+        _feed.start()
+    return _feed
+    return _feed
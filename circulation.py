@@ -0,0 +1,232 @@
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+import analytics
+import catalog_cache
+import history
+import search
+from db import analytics_col, books_col, borrows_col, history_col
+from models import Loan
+
+log = logging.getLogger(__name__)
+
+BORROWED = "borrowed"
+OUT_OF_STOCK = "out_of_stock"
+NOT_FOUND = "not_found"
+
+#Loan policy: how long a patron may keep a book
+LOAN_DAYS = int(os.getenv("LOAN_DAYS", "14"))
+PAGE_SIZE = 25
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+#A return's claim on loans it did not get to delete (the app stopped mid-return) lapses after this long
+RETURN_CLAIM_TIMEOUT = timedelta(minutes=5)
+#What a return reads back from the loans it claimed
+LOAN_FIELDS = {"_id": 1, "book_id": 1, "name": 1, "author": 1, "date": 1, "due_date": 1}
+
+#Oldest loan first
+LOAN_ORDER = [("date", ASCENDING), ("_id", ASCENDING)]
+
+
+def due_date_for(borrowed_at):
+    return borrowed_at + timedelta(days=LOAN_DAYS)
+
+
+def due_date_of(loan):
+    #Records written before due dates were stored fall back to the current policy
+    return loan.due_date or due_date_for(loan.date or datetime.now())
+
+
+async def borrow_book(
+    username, name, author, books=books_col, borrows=borrows_col, cache=catalog_cache.cache,
+    borrowed_at=None, loan_id=None, stats=analytics_col,
+):
+    #borrowed_at and loan_id are set when a borrow queued offline is replayed (see outbox)
+    #Unknown titles, and titles the live cache knows are out of stock, never reach the database
+    entry = await cache.get(name, author, books)
+    if entry is None:
+        return NOT_FOUND
+    if entry["number"] <= 0 and cache.trusted:
+        return OUT_OF_STOCK
+
+    #The stock guard lives in the filter, so two patrons can never take the same last copy
+    book = await books.find_one_and_update(
+        {"_id": entry["_id"], "number": {"$gt": 0}},
+        {"$inc": {"number": -1}, "$currentDate": {"updated_at": True}},
+        projection=catalog_cache.BOOK_FIELDS,
+        return_document=ReturnDocument.AFTER,
+    )
+    if book is None:
+        cache.invalidate(name, author)
+        return OUT_OF_STOCK
+    cache.put(book)
+
+    now = borrowed_at or datetime.now()
+    loan = {
+        "username": username,
+        "name": name,
+        "author": author,
+        "book_id": book["_id"],
+        "date": now,
+        "due_date": due_date_for(now),
+    }
+    if loan_id is not None:
+        loan["_id"] = loan_id
+    try:
+        await borrows.insert_one(loan)
+    except PyMongoError:
+        #Compensate so a failed loan record never leaks a copy
+        await books.update_one({"_id": book["_id"]}, {"$inc": {"number": 1}, "$currentDate": {"updated_at": True}})
+        cache.invalidate(name, author)
+        raise
+    search.catalog.set_stock(name, author, book["number"], book.get("updated_at"))
+    await analytics.record_borrow(username, name, author, now, stats=stats)
+    return BORROWED
+
+
+async def return_loans(
+    username, loans, books=books_col, borrows=borrows_col, cache=catalog_cache.cache, stats=analytics_col,
+    archive=history_col,
+):
+    #loans: dicts with at least _id; only the patron's loans still in borrows are returned
+    if not loans:
+        return []
+    now = datetime.now()
+    ids = [loan["_id"] for loan in loans]
+    token = ObjectId()
+    #A fixed number of round trips however many loans go back. The loans are first claimed with this call's
+    #token, so exactly the loans it removes are known: one that another tab or a replayed queue entry
+    #returned first is never restocked or archived a second time
+    claimable = {"$or": [
+        {"return_token": {"$exists": False}},
+        {"return_token": {"$lt": ObjectId.from_datetime(datetime.now(timezone.utc) - RETURN_CLAIM_TIMEOUT)}},
+    ]}
+    mine = {"_id": {"$in": ids}, "return_token": token}
+    claimed = None
+    try:
+        await borrows.update_many(
+            {"_id": {"$in": ids}, "username": username, **claimable}, {"$set": {"return_token": token}}
+        )
+        claimed = await borrows.find(mine, LOAN_FIELDS)
+        if not claimed:
+            return []
+        #Archived before the delete, so no loan can leave borrows without reaching the history
+        await history.archive(username, claimed, now, history=archive)
+        await borrows.delete_many(mine)
+    except PyMongoError as ex:
+        failed = ex
+    else:
+        failed = None
+    returned = claimed or []
+    if failed is not None:
+        #The loans still holding this call's token were not returned; their history rows are taken back,
+        #while a delete the server applied before the error still counts
+        try:
+            if claimed:
+                still_out = {doc["_id"] for doc in await borrows.find(mine, {"_id": 1})}
+                returned = [loan for loan in claimed if loan["_id"] not in still_out]
+                await history.discard(still_out, history=archive)
+            await borrows.update_many(mine, {"$unset": {"return_token": ""}})
+        except PyMongoError as ex:
+            #The claim lapses after RETURN_CLAIM_TIMEOUT
+            log.warning("Could not release loans after a failed return: %s", ex)
+            raise failed
+        if not returned:
+            raise failed
+
+    copies = Counter((loan.get("book_id"), loan["name"], loan["author"]) for loan in returned)
+    await books.bulk_write(
+        [
+            UpdateOne(
+                {"_id": book_id} if book_id is not None else {"name": name, "author": author},
+                {"$inc": {"number": count}, "$currentDate": {"updated_at": True}},
+            )
+            for (book_id, name, author), count in copies.items()
+        ],
+        ordered=False,
+    )
+    #No new count comes back from the bulk write; the catalog feed brings it to the search index
+    for _, name, author in copies:
+        cache.invalidate(name, author)
+    await analytics.record_returns(username, returned, now, stats=stats)
+    if failed is not None:
+        #The loans that did go are restocked above; the caller still learns the rest failed
+        raise failed
+    return returned
+
+
+async def return_all(
+    username, books=books_col, borrows=borrows_col, cache=catalog_cache.cache, stats=analytics_col, archive=history_col,
+    borrowed_before=None,
+):
+    #borrowed_before is set when a Return All queued offline is replayed, so later loans stay out
+    query = {"username": username}
+    if borrowed_before is not None:
+        query["date"] = {"$lte": borrowed_before}
+    loans = await borrows.find(query, {"_id": 1})
+    return await return_loans(username, loans, books=books, borrows=borrows, cache=cache, stats=stats, archive=archive)
+
+
+async def backfill_due_dates(borrows=borrows_col):
+    #One-off migration for loans recorded before due_date existed; a no-op once they are all stamped
+    return await borrows.update_many(
+        {"due_date": None},
+        [{"$set": {"due_date": {"$add": ["$date", LOAN_DAYS * DAY_MS]}}}],
+    )
+
+
+def _after(cursor, field):
+    #Keyset pagination on (field, _id): each page resumes after the last row of the previous one
+    value, last_id = cursor
+    return {"$or": [
+        {field: {"$gt": value}},
+        {field: value, "_id": {"$gt": last_id}},
+    ]}
+
+
+async def overdue_page(cursor=None, limit=PAGE_SIZE, borrows=borrows_col):
+    #Most overdue first; the database projects the row and works out the days overdue
+    now = datetime.now()
+    match = {"due_date": {"$lt": now}}
+    if cursor is not None:
+        match = {"$and": [match, _after(cursor, "due_date")]}
+    docs = await borrows.aggregate_records(Loan, [
+        {"$match": match},
+        {"$sort": {"due_date": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {
+            "username": 1,
+            "name": 1,
+            "author": 1,
+            "date": 1,
+            "due_date": 1,
+            "overdue_days": {"$floor": {"$divide": [{"$subtract": [now, "$due_date"]}, DAY_MS]}},
+        }},
+    ])
+    next_cursor = (docs[-1].due_date, docs[-1].id) if len(docs) == limit else None
+    return docs, next_cursor
+
+
+async def count_overdue(borrows=borrows_col):
+    return await borrows.count_documents({"due_date": {"$lt": datetime.now()}})
+
+
+async def loans_page(username, cursor=None, limit=PAGE_SIZE, borrows=borrows_col):
+    query = {"username": username}
+    if cursor is not None:
+        query = {"$and": [query, _after(cursor, "date")]}
+    docs = await borrows.find_records(Loan, query, sort=LOAN_ORDER, limit=limit)
+    next_cursor = (docs[-1].date, docs[-1].id) if len(docs) == limit else None
+    return docs, next_cursor
+
+
+async def count_loans(username, borrows=borrows_col):
+    return await borrows.count_documents({"username": username})
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import bson
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+import metrics
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+
+#Threads reserved for blocking pymongo calls, kept apart from asyncio's default executor
+DB_WORKERS = int(os.getenv("DB_WORKERS", "16"))
+#How long a call waits for a reachable server before failing (pymongo's default is 30s)
+DB_SERVER_TIMEOUT_MS = int(os.getenv("DB_SERVER_TIMEOUT_MS", "5000"))
+
+#Connection pool, shared by every session in the process. Each db thread holds at most one
+#connection at a time; the headroom covers the catalog feed and export threads
+DB_MAX_POOL_SIZE = int(os.getenv("DB_MAX_POOL_SIZE", str(DB_WORKERS + 4)))
+#Kept open while idle so the first query after a quiet spell skips the TLS handshake
+DB_MIN_POOL_SIZE = int(os.getenv("DB_MIN_POOL_SIZE", "2"))
+#A call that cannot get a connection this quickly fails instead of queueing behind a stuck pool
+DB_POOL_WAIT_MS = int(os.getenv("DB_POOL_WAIT_MS", "10000"))
+DB_SOCKET_TIMEOUT_MS = int(os.getenv("DB_SOCKET_TIMEOUT_MS", "30000"))
+
+
+class InFlightStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+        self.total = 0
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.total += 1
+            if self.current > self.peak:
+                self.peak = self.current
+
+    def exit(self):
+        with self._lock:
+            self.current -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"in_flight": self.current, "peak": self.peak, "total": self.total}
+
+    def reset_peak(self):
+        with self._lock:
+            self.peak = self.current
+
+
+inflight = InFlightStats()
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def run_sync(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs)
+    if metrics.enabled:
+        #Carry the current action over to the worker thread so its queries are attributed to it
+        call = partial(contextvars.copy_context().run, call)
+    inflight.enter()
+    try:
+        return await loop.run_in_executor(executor, call)
+    finally:
+        inflight.exit()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def make_client(uri):
+    listeners = []
+    if metrics.enabled:
+        #Once any listener is attached pymongo builds an event for every command, so none is while metrics are off
+        listeners.append(metrics.CommandMetrics())
+        metrics.commands_tracked = True
+    return MongoClient(
+        uri,
+        tlsAllowInvalidCertificates=True,
+        appname="library-manager",
+        maxPoolSize=DB_MAX_POOL_SIZE,
+        minPoolSize=DB_MIN_POOL_SIZE,
+        maxIdleTimeMS=300_000,
+        waitQueueTimeoutMS=DB_POOL_WAIT_MS,
+        connectTimeoutMS=DB_SERVER_TIMEOUT_MS,
+        socketTimeoutMS=DB_SOCKET_TIMEOUT_MS,
+        serverSelectionTimeoutMS=DB_SERVER_TIMEOUT_MS,
+        #A primary step-down or a dropped connection is retried once instead of reaching the patron
+        retryWrites=True,
+        retryReads=True,
+        event_listeners=listeners,
+    )
+
+
+def get_client():
+    #Created on first use, from a db thread: resolving an Atlas mongodb+srv URI does DNS lookups
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = make_client(MONGO_URI)
+    return _client
+
+
+def get_db():
+    return get_client()["library"]
+
+
+class AsyncCollection:
+    """Awaitable facade over a pymongo collection; every call runs on the db executor.
+
+    Pass a collection, or just its name to have it looked up in the library
+    database on first use.
+    """
+
+    def __init__(self, collection=None, name=None):
+        self._collection = collection
+        self._name = name
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = get_db()[self._name]
+        return self._collection
+
+    @property
+    def name(self):
+        return self._name or self.collection.name
+
+    async def _run(self, method, *args, **kwargs):
+        #The collection is looked up on the db thread too, so the first call never blocks the UI
+        return await run_sync(lambda: getattr(self.collection, method)(*args, **kwargs))
+
+    async def find(self, filter=None, projection=None, **kwargs):
+        #Cursor iteration also hits the network, so the whole fetch stays on the executor
+        def fetch():
+            return list(self.collection.find(filter or {}, projection, **kwargs))
+        return await run_sync(fetch)
+
+    async def find_records(self, model, filter=None, **kwargs):
+        #Only the model's fields are sent back, and each document becomes a record as the cursor yields it,
+        #so the full list of dicts never exists
+        def fetch():
+            return [model.from_doc(doc) for doc in self.collection.find(filter or {}, model.FIELDS, **kwargs)]
+        return await run_sync(fetch)
+
+    async def stream_records(self, model, filter=None, **kwargs):
+        #For whole-collection reads: batches arrive as raw BSON and each document is decoded only when its
+        #record is built, so at most one document is ever held as a dict
+        def fetch():
+            return [
+                model.from_doc(doc)
+                for batch in self.collection.find_raw_batches(filter or {}, model.FIELDS, **kwargs)
+                for doc in bson.decode_iter(batch)
+            ]
+        return await run_sync(fetch)
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return await self._run("find_one", filter, *args, **kwargs)
+
+    async def insert_one(self, document, **kwargs):
+        return await self._run("insert_one", document, **kwargs)
+
+    async def insert_many(self, documents, **kwargs):
+        return await self._run("insert_many", documents, **kwargs)
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self._run("update_one", filter, update, **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self._run("update_many", filter, update, **kwargs)
+
+    async def delete_one(self, filter, **kwargs):
+        return await self._run("delete_one", filter, **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self._run("delete_many", filter, **kwargs)
+
+    async def count_documents(self, filter, **kwargs):
+        return await self._run("count_documents", filter, **kwargs)
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return await self._run("find_one_and_update", filter, update, **kwargs)
+
+    async def find_one_and_delete(self, filter, **kwargs):
+        return await self._run("find_one_and_delete", filter, **kwargs)
+
+    async def bulk_write(self, requests, **kwargs):
+        return await self._run("bulk_write", requests, **kwargs)
+
+    async def aggregate(self, pipeline, **kwargs):
+        def fetch():
+            return list(self.collection.aggregate(pipeline, **kwargs))
+        return await run_sync(fetch)
+
+    async def aggregate_records(self, model, pipeline, **kwargs):
+        def fetch():
+            return [model.from_doc(doc) for doc in self.collection.aggregate(pipeline, **kwargs)]
+        return await run_sync(fetch)
+
+
+books_col = AsyncCollection(name="books")
+userinfo_col = AsyncCollection(name="userinfo")
+admin_col = AsyncCollection(name="admin")
+borrows_col = AsyncCollection(name="borrows")
+analytics_col = AsyncCollection(name="analytics")
+history_col = AsyncCollection(name="borrow_history")
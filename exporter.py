@@ -0,0 +1,132 @@
+"""Streaming export of borrows, overdue loans and inventory.
+
+    python exporter.py borrows borrows.csv.gz
+    python exporter.py overdue overdue.jsonl
+    python exporter.py inventory books.csv
+
+The format follows the file extension (.csv or .jsonl, optionally .gz).
+Rows are streamed from a server-side cursor and written as they arrive.
+"""
+import argparse
+import csv
+import gzip
+import json
+import sys
+from datetime import datetime
+
+from circulation import DAY_MS
+from db import get_db
+from importer import file_format
+
+BATCH_SIZE = 1000
+
+
+def _borrows_cursor(database, batch_size):
+    return database["borrows"].find(
+        {},
+        {"_id": 0, "username": 1, "name": 1, "author": 1, "date": 1, "due_date": 1},
+        #_id order is insertion order, and the _id index makes it free
+        sort=[("_id", 1)],
+        batch_size=batch_size,
+    )
+
+
+def _overdue_cursor(database, batch_size):
+    now = datetime.now()
+    return database["borrows"].aggregate(
+        [
+            {"$match": {"due_date": {"$lt": now}}},
+            {"$sort": {"due_date": 1, "_id": 1}},
+            {"$project": {
+                "_id": 0,
+                "username": 1,
+                "name": 1,
+                "author": 1,
+                "date": 1,
+                "due_date": 1,
+                "overdue_days": {"$floor": {"$divide": [{"$subtract": [now, "$due_date"]}, DAY_MS]}},
+            }},
+        ],
+        batchSize=batch_size,
+        allowDiskUse=True,
+    )
+
+
+def _inventory_cursor(database, batch_size):
+    return database["books"].find(
+        {},
+        {"_id": 0, "name": 1, "author": 1, "number": 1},
+        sort=[("name", 1), ("author", 1)],
+        batch_size=batch_size,
+    )
+
+
+#report -> (columns, cursor factory)
+REPORTS = {
+    "borrows": (["username", "name", "author", "date", "due_date"], _borrows_cursor),
+    "overdue": (["username", "name", "author", "date", "due_date", "overdue_days"], _overdue_cursor),
+    "inventory": (["name", "author", "number"], _inventory_cursor),
+}
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _open_output(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def export(report, path, database=None, batch_size=BATCH_SIZE, on_progress=None):
+    """Blocking; run it on the db executor from the UI. Returns the number of rows written."""
+    if report not in REPORTS:
+        raise ValueError(f"Unknown report '{report}' (choose from {', '.join(REPORTS)})")
+    columns, cursor_factory = REPORTS[report]
+    database = get_db() if database is None else database
+    fmt = file_format(path)
+    count = 0
+    with _open_output(path) as out:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+        with cursor_factory(database, batch_size) as cursor:
+            for doc in cursor:
+                row = [_cell(doc.get(column)) for column in columns]
+                if writer is not None:
+                    writer.writerow(row)
+                else:
+                    out.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+                count += 1
+                if on_progress and count % batch_size == 0:
+                    on_progress(count)
+    if on_progress:
+        on_progress(count)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    count = export(
+        args.report,
+        args.path,
+        batch_size=args.batch_size,
+        on_progress=lambda n: print(f"\r{n} rows", end="", flush=True),
+    )
+    print(f"\rExported {count} rows to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
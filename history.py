@@ -0,0 +1,96 @@
+"""Returned loans, kept for good in the append-only ``borrow_history`` collection.
+
+A return archives the loan here before deleting it from ``borrows``, so the
+collection that My Books and the overdue report scan only ever holds loans
+that are out. Each history document keeps the loan's ``_id``:
+
+    {"_id", "username", "name", "author", "book_id", "date", "due_date", "returned_at"}
+
+which makes archiving the same loan twice (a retried or replayed return) a
+no-op. History is read newest first, a page at a time, per patron or per
+title. With HISTORY_RETENTION_DAYS set, MongoDB's TTL monitor drops entries
+once they are that old.
+"""
+import logging
+import os
+
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
+
+from db import history_col
+from models import PastLoan
+
+log = logging.getLogger(__name__)
+
+#0 keeps history forever
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+PAGE_SIZE = 25
+DUPLICATE_KEY = 11000
+
+#Most recent return first
+HISTORY_ORDER = [("returned_at", DESCENDING), ("_id", DESCENDING)]
+
+
+async def archive(username, loans, returned_at, history=history_col):
+    """Copies loans (dicts as passed to circulation.return_loans) into history.
+
+    Returns the ids this call wrote; loans archived by an earlier attempt are skipped.
+    """
+    docs = []
+    for loan in loans:
+        doc = {"_id": loan["_id"], "username": username, "name": loan["name"], "author": loan["author"]}
+        for field in ("book_id", "date", "due_date"):
+            if loan.get(field) is not None:
+                doc[field] = loan[field]
+        doc["returned_at"] = returned_at
+        docs.append(doc)
+    if not docs:
+        return set()
+    written = {doc["_id"] for doc in docs}
+    try:
+        await history.insert_many(docs, ordered=False)
+    except BulkWriteError as ex:
+        errors = ex.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        written -= {docs[error["index"]]["_id"] for error in errors}
+    return written
+
+
+async def discard(loan_ids, history=history_col):
+    #Undoes archive() for loans that turned out not to be returned by this call
+    if loan_ids:
+        await history.delete_many({"_id": {"$in": list(loan_ids)}})
+
+
+def _before(cursor):
+    #Keyset pagination on (returned_at, _id), newest first
+    returned_at, last_id = cursor
+    return {"$or": [
+        {"returned_at": {"$lt": returned_at}},
+        {"returned_at": returned_at, "_id": {"$lt": last_id}},
+    ]}
+
+
+async def _page(query, cursor, limit, history):
+    if cursor is not None:
+        query = {"$and": [query, _before(cursor)]}
+    docs = await history.find_records(PastLoan, query, sort=HISTORY_ORDER, limit=limit)
+    next_cursor = (docs[-1].returned_at, docs[-1].id) if len(docs) == limit else None
+    return docs, next_cursor
+
+
+async def user_page(username, cursor=None, limit=PAGE_SIZE, history=history_col):
+    return await _page({"username": username}, cursor, limit, history)
+
+
+async def title_page(name, author, cursor=None, limit=PAGE_SIZE, history=history_col):
+    return await _page({"name": name, "author": author}, cursor, limit, history)
+
+
+async def count_for_user(username, history=history_col):
+    return await history.count_documents({"username": username})
+
+
+async def count_for_title(name, author, history=history_col):
+    return await history.count_documents({"name": name, "author": author})
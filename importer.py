@@ -0,0 +1,191 @@
+"""Bulk catalog import from CSV or JSON Lines.
+
+    python importer.py catalog.csv [--batch-size 1000] [--rejects bad_rows.jsonl]
+
+Rows need ``name``, ``author`` and a copy count (``number`` or ``copies``).
+Rows for a title that already exists add their copies to it.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+
+import inventory
+from db import books_col
+
+BATCH_SIZE = 1000
+#Bad rows kept with their reason; any beyond this are only counted
+MAX_BAD_ROWS = 1000
+
+
+class ImportReport:
+    def __init__(self, total_bytes=None):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows = 0
+        self.inserted = 0
+        self.merged = 0
+        self.bad_count = 0
+        self.bad_rows = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def progress(self):
+        if not self.total_bytes:
+            return None
+        return min(1.0, self.bytes_read / self.total_bytes)
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, line_no, reason, raw):
+        self.bad_count += 1
+        if len(self.bad_rows) < MAX_BAD_ROWS:
+            self.bad_rows.append({"line": line_no, "reason": reason, "row": raw})
+
+    def summary(self):
+        return (
+            f"{self.rows} rows, {self.inserted} new titles, {self.merged} merged, "
+            f"{self.bad_count} rejected in {self.elapsed:.1f}s ({self.rows_per_sec:.0f} rows/s)"
+        )
+
+
+def _open_lines(path, report):
+    #Binary read so progress can be tracked by bytes; gzip sizes are compressed, so no fraction there
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for raw in f:
+            report.bytes_read += len(raw)
+            #Undecodable bytes become U+FFFD and the row is rejected in parse_book
+            yield raw.decode("utf-8-sig", errors="replace")
+
+
+def file_format(path):
+    base = path[:-3] if path.endswith(".gz") else path
+    ext = os.path.splitext(base)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    raise ValueError(f"Unsupported file type '{ext}' (use .csv or .jsonl)")
+
+
+def read_rows(path, report):
+    #Yields (line number, dict or error message) without ever holding more than one row
+    lines = _open_lines(path, report)
+    if file_format(path) == "csv":
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as ex:
+                yield reader.line_num, f"invalid CSV: {ex}"
+                continue
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as ex:
+                yield line_no, f"invalid JSON: {ex.msg}"
+                continue
+            yield line_no, row if isinstance(row, dict) else "expected a JSON object"
+
+
+def parse_book(row):
+    name = str(row.get("name") or "").strip()
+    author = str(row.get("author") or "").strip()
+    copies = row.get("number", row.get("copies"))
+    if not name or not author:
+        raise ValueError("name and author are required")
+    if "\ufffd" in name or "\ufffd" in author:
+        raise ValueError("text is not valid UTF-8")
+    try:
+        copies = int(str(copies).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"copies must be a whole number, got {copies!r}")
+    if copies < 0:
+        raise ValueError("copies cannot be negative")
+    return name, author, copies
+
+
+async def _flush(batch, books, report):
+    #Duplicates inside the batch were already summed, so each title is written once
+    inserted, merged = await inventory.add_copies(batch, books)
+    report.inserted += inserted
+    report.merged += merged
+    batch.clear()
+
+
+async def import_books(path, books=books_col, batch_size=BATCH_SIZE, on_progress=None):
+    report = ImportReport(None if path.endswith(".gz") else os.path.getsize(path))
+    batch = {}
+    rows_in_batch = 0
+    for line_no, row in read_rows(path, report):
+        if isinstance(row, str):
+            report.reject(line_no, row, None)
+            continue
+        try:
+            key = parse_book(row)
+        except ValueError as ex:
+            report.reject(line_no, str(ex), row)
+            continue
+        name, author, copies = key
+        batch[(name, author)] = batch.get((name, author), 0) + copies
+        report.rows += 1
+        rows_in_batch += 1
+        if rows_in_batch >= batch_size:
+            await _flush(batch, books, report)
+            rows_in_batch = 0
+            report.elapsed = time.perf_counter() - report.started
+            if on_progress:
+                on_progress(report)
+    if batch:
+        await _flush(batch, books, report)
+    report.elapsed = time.perf_counter() - report.started
+    if on_progress:
+        on_progress(report)
+    return report
+
+
+async def run_cli(args):
+    def on_progress(report):
+        pct = f"{report.progress:.0%} " if report.progress is not None else ""
+        print(f"\r{pct}{report.summary()}", end="", flush=True)
+
+    report = await import_books(args.path, batch_size=args.batch_size, on_progress=on_progress)
+    print()
+    if report.bad_rows:
+        if args.rejects:
+            with open(args.rejects, "w", encoding="utf-8") as f:
+                for bad in report.bad_rows:
+                    f.write(json.dumps(bad, default=str) + "\n")
+            print(f"{report.bad_count} bad row(s); first {len(report.bad_rows)} written to {args.rejects}")
+        else:
+            for bad in report.bad_rows[:20]:
+                print(f"  line {bad['line']}: {bad['reason']}")
+            if report.bad_count > 20:
+                print(f"  ... {report.bad_count - 20} more (use --rejects to save them)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rejects", help="write rejected rows to this JSONL file")
+    return asyncio.run(run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from history import HISTORY_RETENTION_DAYS
+
+log = logging.getLogger(__name__)
+
+#collection -> [(keys, options)]
+INDEXES = {
+    "books": [
+        ([("name", ASCENDING), ("author", ASCENDING)], {"name": "name_author", "unique": True}),
+        #Catalog cache polling fallback
+        ([("updated_at", ASCENDING)], {"name": "updated_at"}),
+    ],
+    "userinfo": [
+        ([("username", ASCENDING)], {"name": "username", "unique": True}),
+    ],
+    "admin": [
+        ([("username", ASCENDING)], {"name": "username", "unique": True}),
+    ],
+    "borrows": [
+        ([("username", ASCENDING), ("date", ASCENDING), ("_id", ASCENDING)], {"name": "username_date_id"}),
+        ([("due_date", ASCENDING), ("_id", ASCENDING)], {"name": "due_date_id"}),
+        #Refusing to delete titles that are on loan
+        ([("name", ASCENDING), ("author", ASCENDING)], {"name": "name_author"}),
+    ],
+    #Analytics dashboard: top titles and users, and the daily history
+    "analytics": [
+        ([("kind", ASCENDING), ("borrows", DESCENDING)], {"name": "kind_borrows"}),
+        ([("kind", ASCENDING), ("active", DESCENDING)], {"name": "kind_active"}),
+        ([("kind", ASCENDING), ("day", DESCENDING)], {"name": "kind_day"}),
+    ],
+    #Borrow history pages, newest first, per patron and per title
+    "borrow_history": [
+        ([("username", ASCENDING), ("returned_at", DESCENDING), ("_id", DESCENDING)], {"name": "username_returned_id"}),
+        (
+            [("name", ASCENDING), ("author", ASCENDING), ("returned_at", DESCENDING), ("_id", DESCENDING)],
+            {"name": "name_author_returned_id"},
+        ),
+    ],
+}
+if HISTORY_RETENTION_DAYS > 0:
+    INDEXES["borrow_history"].append(
+        ([("returned_at", ASCENDING)], {"name": "returned_at_ttl", "expireAfterSeconds": HISTORY_RETENTION_DAYS * 86400})
+    )
+
+
+def hot_queries():
+    #(collection, label, filter) for every lookup the app runs on a user action
+    return [
+        ("books", "search by title", {"name": ""}),
+        ("books", "borrow lookup", {"name": "", "author": ""}),
+        ("userinfo", "login/register lookup", {"username": ""}),
+        ("admin", "login/register lookup", {"username": ""}),
+        ("borrows", "my borrowed books", {"username": ""}),
+        ("books", "catalog cache poll", {"updated_at": {"$gte": datetime.now()}}),
+        ("borrows", "overdue report", {"due_date": {"$lt": datetime.now()}}),
+        ("borrows", "loans out per title", {"name": {"$in": [""]}}),
+        ("analytics", "analytics dashboard", {"kind": "title"}),
+        ("borrow_history", "borrow history per patron", {"username": ""}),
+        ("borrow_history", "borrow history per title", {"name": "", "author": ""}),
+    ]
+
+
+class IndexReport:
+    def __init__(self):
+        self.created = []
+        self.existing = []
+        #Unique indexes known to be in place and unique
+        self.unique = []
+        self.diagnostics = []
+
+    @property
+    def ok(self):
+        return not self.diagnostics
+
+    def add_diagnostic(self, msg):
+        log.warning(msg)
+        self.diagnostics.append(msg)
+
+
+last_report = None
+
+
+def unique_confirmed(name):
+    """True once startup has seen the unique index, e.g. "userinfo.username", in place."""
+    return last_report is not None and name in last_report.unique
+
+
+def _key_of(keys):
+    return tuple((field, int(direction)) for field, direction in keys)
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+def ensure_indexes(db, report):
+    for col_name, specs in INDEXES.items():
+        col = db[col_name]
+        existing = {
+            _key_of(info["key"]): (name, info)
+            for name, info in col.index_information().items()
+        }
+        for keys, options in specs:
+            found = existing.get(_key_of(keys))
+            if found:
+                name, info = found
+                if options.get("unique") and not info.get("unique"):
+                    report.add_diagnostic(
+                        f"{col_name}.{name} exists but is not unique; drop it to let startup recreate it."
+                    )
+                elif options.get("unique"):
+                    report.unique.append(f"{col_name}.{options['name']}")
+                ttl = options.get("expireAfterSeconds")
+                if ttl is not None and info.get("expireAfterSeconds") != ttl:
+                    #A changed retention period is applied in place
+                    try:
+                        db.command("collMod", col_name, index={"name": name, "expireAfterSeconds": ttl})
+                    except PyMongoError as ex:
+                        report.add_diagnostic(f"Could not change the expiry of {col_name}.{name}: {ex}")
+                report.existing.append(f"{col_name}.{name}")
+                continue
+            try:
+                col.create_index(keys, **options)
+                report.created.append(f"{col_name}.{options['name']}")
+                if options.get("unique"):
+                    report.unique.append(f"{col_name}.{options['name']}")
+            except PyMongoError as ex:
+                report.add_diagnostic(f"Could not create {col_name}.{options['name']}: {ex}")
+
+
+def verify_query_plans(db, report):
+    for col_name, label, query in hot_queries():
+        try:
+            plan = db[col_name].find(query).explain()
+        except PyMongoError as ex:
+            report.add_diagnostic(f"explain() failed for {col_name} ({label}): {ex}")
+            continue
+        winning = plan.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning)):
+            report.add_diagnostic(f"{col_name} ({label}) uses COLLSCAN for {query}")
+
+
+def bootstrap(db):
+    global last_report
+    report = IndexReport()
+    try:
+        ensure_indexes(db, report)
+        verify_query_plans(db, report)
+    except PyMongoError as ex:
+        report.add_diagnostic(f"Index bootstrap failed: {ex}")
+    if report.created:
+        log.info("Created indexes: %s", ", ".join(report.created))
+    last_report = report
+    return report
@@ -0,0 +1,184 @@
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import catalog_cache
+import search
+from db import books_col, borrows_col
+from models import Book
+
+PAGE_SIZE = 50
+TITLE_ORDER = [("name", ASCENDING), ("author", ASCENDING)]
+#Queued adds remembered per title; a replay always comes long before this many newer adds
+APPLIED_OPS_KEPT = 50
+DUPLICATE_KEY = 11000
+
+
+async def add_copies(copies, books=books_col):
+    """copies: {(name, author): count}. Returns (new titles, merged titles).
+
+    One unordered bulk_write of upserts, so adding an existing title adds its
+    copies instead of tripping the unique name/author index.
+    """
+    keys = list(copies)
+    result = await books.bulk_write(
+        [
+            UpdateOne(
+                {"name": name, "author": author},
+                {"$inc": {"number": copies[(name, author)]}, "$currentDate": {"updated_at": True}},
+                upsert=True,
+            )
+            for name, author in keys
+        ],
+        ordered=False,
+    )
+    upserted = result.upserted_ids
+    for i, (name, author) in enumerate(keys):
+        if i in upserted:
+            search.catalog.add({"_id": upserted[i], "name": name, "author": author, "number": copies[(name, author)]})
+        else:
+            #The catalog feed brings the new count to the search index
+            catalog_cache.cache.invalidate(name, author)
+    return len(upserted), len(keys) - len(upserted)
+
+
+async def add_copies_once(adds, books=books_col):
+    """adds: [(token, name, author, count)] replayed from the offline queue. Returns how many were applied.
+
+    The token is recorded on the title in the same update that adds the copies, so an add that
+    already reached the database before a crash or a lost reply is not applied again.
+    """
+    pending = list(adds)
+    applied = 0
+    #A second round only for adds whose upsert lost a race to create the title; it exists now
+    for _ in range(2):
+        requests = [
+            UpdateOne(
+                {"name": name, "author": author, "applied_ops": {"$ne": token}},
+                {
+                    "$inc": {"number": count},
+                    "$push": {"applied_ops": {"$each": [token], "$slice": -APPLIED_OPS_KEPT}},
+                    "$currentDate": {"updated_at": True},
+                },
+                upsert=True,
+            )
+            for token, name, author, count in pending
+        ]
+        try:
+            result = await books.bulk_write(requests, ordered=False)
+            upserted, failed = result.upserted_ids, set()
+        except BulkWriteError as ex:
+            errors = ex.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            upserted = {doc["index"]: doc["_id"] for doc in ex.details.get("upserted", [])}
+            #The title exists but did not match: its token is there already, or it was just created
+            failed = {error["index"] for error in errors}
+        for i, (_, name, author, count) in enumerate(pending):
+            if i in failed:
+                continue
+            applied += 1
+            if i in upserted:
+                search.catalog.add({"_id": upserted[i], "name": name, "author": author, "number": count})
+            else:
+                catalog_cache.cache.invalidate(name, author)
+        pending = [add for i, add in enumerate(pending) if i in failed]
+        if not pending:
+            break
+    return applied
+
+
+async def titles_page(cursor=None, limit=PAGE_SIZE, books=books_col):
+    #Keyset pagination on the name_author index: each page resumes after the last (name, author)
+    query = {}
+    if cursor is not None:
+        name, author = cursor
+        query = {"$or": [{"name": {"$gt": name}}, {"name": name, "author": {"$gt": author}}]}
+    docs = await books.find_records(Book, query, sort=TITLE_ORDER, limit=limit)
+    next_cursor = (docs[-1].name, docs[-1].author) if len(docs) == limit else None
+    return docs, next_cursor
+
+
+async def active_loans(keys, borrows=borrows_col):
+    """{(name, author): loans out} for the given titles, counted on the borrows name_author index."""
+    if not keys:
+        return {}
+    rows = await borrows.aggregate([
+        {"$match": {"name": {"$in": sorted({name for name, _ in keys})}}},
+        {"$group": {"_id": {"name": "$name", "author": "$author"}, "count": {"$sum": 1}}},
+    ])
+    wanted = set(keys)
+    counts = {(row["_id"]["name"], row["_id"]["author"]): row["count"] for row in rows}
+    return {key: count for key, count in counts.items() if key in wanted}
+
+
+async def preview(keys, books=books_col, borrows=borrows_col):
+    """The titles a bulk action would touch, with their stock and loans out; unknown titles are left out."""
+    if not keys:
+        return []
+    wanted = set(keys)
+    #Stock is read before the loans; see delete_titles
+    docs = await books.find({"name": {"$in": sorted({name for name, _ in keys})}}, catalog_cache.BOOK_FIELDS)
+    loans = await active_loans(keys, borrows)
+    rows = []
+    for doc in docs:
+        key = (doc["name"], doc["author"])
+        if key in wanted:
+            rows.append({**doc, "active": loans.get(key, 0)})
+    rows.sort(key=lambda row: (row["name"], row["author"]))
+    return rows
+
+
+async def delete_titles(keys, books=books_col, borrows=borrows_col):
+    """Deletes the titles that have no copies on loan. Returns (deleted rows, refused rows)."""
+    rows = await preview(keys, books, borrows)
+    deletable = [row for row in rows if row["active"] == 0]
+    refused = [row for row in rows if row["active"] > 0]
+    if not deletable:
+        return [], refused
+    #Each delete also matches the stock seen before the loans were counted, so a title
+    #borrowed (or returned) since then is left alone
+    result = await books.bulk_write(
+        [DeleteOne({"_id": row["_id"], "number": row["number"]}) for row in deletable],
+        ordered=False,
+    )
+    if result.deleted_count != len(deletable):
+        remaining = {doc["_id"] for doc in await books.find({"_id": {"$in": [row["_id"] for row in deletable]}}, {"_id": 1})}
+        refused += [row for row in deletable if row["_id"] in remaining]
+        deletable = [row for row in deletable if row["_id"] not in remaining]
+    for row in deletable:
+        catalog_cache.cache.remove_id(row["_id"])
+        search.catalog.remove_by_id(row["_id"])
+    return deletable, refused
+
+
+async def adjust_stock(changes, books=books_col):
+    """changes: {(name, author): copies to add, or remove if negative}. Stock never drops below zero.
+
+    Returns {(name, author): new stock} for the titles that exist.
+    """
+    keys = [key for key, delta in changes.items() if delta]
+    if not keys:
+        return {}
+    await books.bulk_write(
+        [
+            UpdateOne(
+                {"name": name, "author": author},
+                [{"$set": {
+                    "number": {"$max": [0, {"$add": ["$number", changes[(name, author)]]}]},
+                    "updated_at": "$$NOW",
+                }}],
+            )
+            for name, author in keys
+        ],
+        ordered=False,
+    )
+    #Clamping happens in the database, so the new counts are read back rather than worked out here
+    docs = await books.find({"name": {"$in": sorted({name for name, _ in keys})}}, catalog_cache.BOOK_FIELDS)
+    stock = {}
+    for doc in docs:
+        key = (doc["name"], doc["author"])
+        if key in changes:
+            catalog_cache.cache.put(doc)
+            search.catalog.set_stock(key[0], key[1], doc["number"], doc.get("updated_at"))
+            stock[key] = doc["number"]
+    return stock
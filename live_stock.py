@@ -0,0 +1,60 @@
+import asyncio
+import logging
+
+import search
+
+log = logging.getLogger(__name__)
+
+#Changes arriving within this window reach each session as one batch
+FLUSH_DELAY = 0.1
+
+
+class StockBroker:
+    """Process-local pub/sub for stock changes.
+
+    Every change to the in-memory catalog (borrow, return, add, delete, import,
+    or a change made by another app instance and picked up by the catalog feed)
+    is published here. Subscribers get {(name, author): number or None}, with
+    only the latest value per title, at most once per FLUSH_DELAY.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._pending = {}
+        self._scheduled = False
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def publish(self, name, author, number):
+        if not self._subscribers:
+            return
+        self._pending[(name, author)] = number
+        if self._scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            #Outside the event loop (CLI tools) nobody is listening for live updates
+            self._pending.clear()
+            return
+        self._scheduled = True
+        loop.call_later(FLUSH_DELAY, self._flush)
+
+    def _flush(self):
+        batch, self._pending = self._pending, {}
+        self._scheduled = False
+        for callback in list(self._subscribers):
+            try:
+                callback(batch)
+            except Exception:
+                log.exception("Live stock subscriber failed; removing it")
+                self.unsubscribe(callback)
+
+
+broker = StockBroker()
+search.catalog.on_stock_change = broker.publish
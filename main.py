@@ -1,735 +1,1764 @@
-import os
-import re
-from datetime import datetime, timedelta
-
-import flet as ft
-from dotenv import load_dotenv
-from pymongo import MongoClient
-
-load_dotenv()
-
-MONGO_URI = os.getenv("MONGO_URI")
-
-client = MongoClient(MONGO_URI, tlsAllowInvalidCertificates=True)
-db = client["library"]
-books_col = db["books"]
-userinfo_col = db["userinfo"]
-admin_col = db["admin"]
-borrows_col = db["borrows"]
-
-
-#You can easily change colors
-PRIMARY = "#576238"
-PRIMARY_DARK = "#F0EADC"
-SURFACE = "#1E1E2E"
-SURFACE_LIGHT = "#2A2A3C"
-CARD_BG = "#313145"
-TEXT_PRIMARY = "white"
-TEXT_SECONDARY = "#B0B0C0"
-SUCCESS = "#4CAF50"
-ERROR = "#EF5350"
-WARNING = "#FFA726"
-
-#Animation durations
-FADE_DURATION = 400
-SCALE_DURATION = 350
-SLIDE_DURATION = 300
-
-
-async def main(page: ft.Page):
-    page.title = "Library Management System"
-    page.theme_mode = ft.ThemeMode.DARK
-    page.bgcolor = SURFACE
-    page.window.width = 480
-    page.window.height = 700
-    await page.window.center()
-    page.padding = 0
-    page.scroll = ft.ScrollMode.AUTO
-
-    current_user = {"username": "", "is_admin": False}
-
-    def show_snack(msg, color=SUCCESS):
-        snack = ft.SnackBar(
-            content=ft.Text(msg, color="white"),
-            bgcolor=color,
-        )
-        page.overlay.append(snack)
-        snack.open = True
-        page.update()
-
-    def styled_button(text, on_click, bgcolor=PRIMARY, icon=None, width=260):
-        return ft.Button(
-            content=ft.Row(
-                [
-                    ft.Icon(icon, color=TEXT_PRIMARY, size=20) if icon else ft.Container(),
-                    ft.Text(text, color=TEXT_PRIMARY, size=14),
-                ],
-                alignment=ft.MainAxisAlignment.CENTER,
-                spacing=8,
-            ),
-            on_click=on_click,
-            width=width,
-            height=48,
-            style=ft.ButtonStyle(
-                bgcolor=bgcolor,
-                color=TEXT_PRIMARY,
-                shape=ft.RoundedRectangleBorder(radius=12),
-            ),
-        )
-
-    def styled_field(label, password=False, hint=""):
-        return ft.TextField(
-            label=label,
-            hint_text=hint,
-            password=password,
-            can_reveal_password=password,
-            border_radius=12,
-            border_color=PRIMARY,
-            focused_border_color=PRIMARY_DARK,
-            text_size=14,
-            width=300,
-        )
-
-    def page_title(text, subtitle=None):
-        controls = [
-            ft.Text(text, size=26, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
-        ]
-        if subtitle:
-            controls.append(
-                ft.Text(subtitle, size=14, color=TEXT_SECONDARY),
-            )
-        return ft.Column(controls, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
-
-    def card_container(*children, width=380):
-        return ft.Container(
-            content=ft.Column(
-                list(children),
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                spacing=14,
-            ),
-            bgcolor=CARD_BG,
-            border_radius=20,
-            padding=30,
-            width=width,
-            shadow=ft.BoxShadow(
-                spread_radius=1,
-                blur_radius=15,
-                color="#4D000000",
-            ),
-            animate_scale=ft.Animation(SCALE_DURATION, ft.AnimationCurve.EASE_OUT),
-            scale=1,
-        )
-
-    def animated_view(*children):
-        container = ft.Container(
-            content=ft.Column(
-                list(children),
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                spacing=12,
-            ),
-            alignment=ft.Alignment(0, 0),
-            expand=True,
-            opacity=0,
-            offset=ft.Offset(0, 0.03),
-            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN_OUT),
-            animate_offset=ft.Animation(SLIDE_DURATION, ft.AnimationCurve.EASE_OUT),
-        )
-        return container
-
-    def show_view(view_container):
-        page.controls.clear()
-        page.controls.append(view_container)
-        page.update()
-        view_container.opacity = 1
-        view_container.offset = ft.Offset(0, 0)
-        page.update()
-
-    async def do_exit(_):
-        await page.window.close()
-
-    def go_initial_setup(e=None):
-        pending_admins = []
-        admins_list_column = ft.Column(spacing=8)
-
-        username_field = styled_field("Admin Username", hint="Enter admin username")
-        password_field = styled_field("Admin Password", password=True, hint="Min 8 chars, letters & numbers")
-
-        no_admin_text = ft.Text(
-            "No admins added yet.",
-            size=13,
-            color=TEXT_SECONDARY,
-            italic=True,
-        )
-        admins_list_column.controls.append(no_admin_text)
-
-        def refresh_admin_list():
-            admins_list_column.controls.clear()
-            if not pending_admins:
-                admins_list_column.controls.append(
-                    ft.Text("No admins added yet.", size=13, color=TEXT_SECONDARY, italic=True)
-                )
-            else:
-                for i, admin in enumerate(pending_admins):
-                    admins_list_column.controls.append(
-                        ft.Container(
-                            content=ft.Row(
-                                [
-                                    ft.Icon(ft.Icons.ADMIN_PANEL_SETTINGS, color=PRIMARY, size=18),
-                                    ft.Text(
-                                        admin["username"],
-                                        size=14,
-                                        weight=ft.FontWeight.BOLD,
-                                        color=TEXT_PRIMARY,
-                                        expand=True,
-                                    ),
-                                    ft.IconButton(
-                                        icon=ft.Icons.REMOVE_CIRCLE,
-                                        icon_color=ERROR,
-                                        icon_size=20,
-                                        tooltip="Remove",
-                                        on_click=lambda _, idx=i: remove_admin(idx),
-                                    ),
-                                ],
-                            ),
-                            bgcolor=SURFACE_LIGHT,
-                            border_radius=10,
-                            padding=ft.padding.symmetric(horizontal=12, vertical=6),
-                            width=300,
-                        )
-                    )
-            page.update()
-
-        def remove_admin(index):
-            if 0 <= index < len(pending_admins):
-                removed = pending_admins.pop(index)
-                show_snack(f"'{removed['username']}' removed from list.", WARNING)
-                refresh_admin_list()
-
-        def add_admin(_):
-            username = username_field.value.strip() if username_field.value else ""
-            password = password_field.value or ""
-
-            if not username:
-                show_snack("Please enter a username.", WARNING)
-                return
-            if len(password) < 8 or not re.search("[a-zA-Z]", password) or not re.search("[0-9]", password):
-                show_snack("Password must be 8+ chars with letters and numbers!", WARNING)
-                return
-            if any(a["username"] == username for a in pending_admins):
-                show_snack("This username is already in the list!", ERROR)
-                return
-
-            pending_admins.append({"username": username, "password": password})
-            username_field.value = ""
-            password_field.value = ""
-            show_snack(f"Admin '{username}' added to list.")
-            refresh_admin_list()
-
-        def finalize_setup(_):
-            if not pending_admins:
-                show_snack("Add at least one admin before proceeding!", WARNING)
-                return
-
-            try:
-                admin_col.insert_many(pending_admins)
-                show_snack(f"{len(pending_admins)} admin(s) created. Setup complete!")
-                go_main_menu()
-            except Exception as ex:
-                show_snack(f"Database error: {ex}", ERROR)
-
-        view = animated_view(
-            ft.Container(height=20),
-            ft.Icon(ft.Icons.SECURITY_ROUNDED, size=64, color=WARNING),
-            page_title("Initial Setup", "Create admin account(s) — this can only be done once"),
-            ft.Container(height=6),
-            card_container(
-                username_field,
-                password_field,
-                styled_button("Add Admin to List", add_admin, icon=ft.Icons.PERSON_ADD, bgcolor=PRIMARY),
-                ft.Divider(color=SURFACE_LIGHT, thickness=1),
-                ft.Text("Admins to create:", size=14, weight=ft.FontWeight.BOLD, color=TEXT_SECONDARY),
-                admins_list_column,
-                ft.Divider(color=SURFACE_LIGHT, thickness=1),
-                styled_button(
-                    "Complete Setup",
-                    finalize_setup,
-                    icon=ft.Icons.CHECK_CIRCLE,
-                    bgcolor=SUCCESS,
-                ),
-            ),
-        )
-        show_view(view)
-
-    def go_main_menu(e=None):
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.LOCAL_LIBRARY_ROUNDED, size=72, color=PRIMARY),
-            page_title("Library Manager", "Modern Library Management System"),
-            ft.Container(height=20),
-            card_container(
-                styled_button("Create Account", go_register, icon=ft.Icons.PERSON_ADD),
-                styled_button("Login", go_login, icon=ft.Icons.LOGIN),
-                styled_button("Exit", do_exit, bgcolor=ERROR, icon=ft.Icons.EXIT_TO_APP),
-            ),
-        )
-        show_view(view)
-
-    def go_register(e=None):
-        username_field = styled_field("Username", hint="Choose a username")
-        password_field = styled_field("Password", password=True, hint="Min 8 chars, letters & numbers")
-
-        def do_register(_):
-            username = username_field.value.strip() if username_field.value else ""
-            password = password_field.value or ""
-
-            if not username:
-                show_snack("Please enter a username.", WARNING)
-                return
-            if userinfo_col.find_one({"username": username}):
-                show_snack("Username already exists!", ERROR)
-                return
-            if admin_col.find_one({"username": username}):
-                show_snack("This username is reserved!", ERROR)
-                return
-            if len(password) < 8 or not re.search("[a-zA-Z]", password) or not re.search("[0-9]", password):
-                show_snack("Password must be 8+ chars with letters and numbers!", WARNING)
-                return
-
-            try:
-                userinfo_col.insert_one({"username": username, "password": password})
-                show_snack("Account created successfully!")
-                go_main_menu()
-            except Exception as ex:
-                show_snack(f"Database error: {ex}", ERROR)
-
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.PERSON_ADD_ALT_1_ROUNDED, size=56, color=PRIMARY),
-            page_title("Create Account"),
-            ft.Container(height=10),
-            card_container(
-                username_field,
-                password_field,
-                styled_button("Register", do_register, icon=ft.Icons.CHECK_CIRCLE),
-                styled_button("Back", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ),
-        )
-        show_view(view)
-
-    def go_login(e=None):
-        username_field = styled_field("Username")
-        password_field = styled_field("Password", password=True)
-
-        def do_login(_):
-            username = username_field.value.strip() if username_field.value else ""
-            password = password_field.value or ""
-
-            if not username:
-                show_snack("Please enter a username.", WARNING)
-                return
-
-            admin_data = admin_col.find_one({"username": username})
-            user_data = userinfo_col.find_one({"username": username})
-
-            if not admin_data and not user_data:
-                show_snack("User not found!", ERROR)
-                return
-
-            if admin_data and admin_data["password"] == password:
-                current_user["username"] = username
-                current_user["is_admin"] = True
-                show_snack(f"Welcome, admin {username}!")
-                go_admin_panel()
-            elif user_data and user_data["password"] == password:
-                current_user["username"] = username
-                current_user["is_admin"] = False
-                show_snack(f"Welcome, {username}!")
-                go_library_panel()
-            else:
-                show_snack("Incorrect password!", ERROR)
-
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.LOCK_OPEN_ROUNDED, size=56, color=PRIMARY),
-            page_title("Login"),
-            ft.Container(height=10),
-            card_container(
-                username_field,
-                password_field,
-                styled_button("Login", do_login, icon=ft.Icons.LOGIN),
-                styled_button("Back", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ),
-        )
-        show_view(view)
-
-    def go_admin_panel(e=None):
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.ADMIN_PANEL_SETTINGS_ROUNDED, size=56, color=PRIMARY),
-            page_title("Admin Panel", f"Logged in as {current_user['username']}"),
-            ft.Container(height=10),
-            card_container(
-                styled_button("Add Book", go_add_book, icon=ft.Icons.ADD_CIRCLE),
-                styled_button("Delete Book", go_delete_book, icon=ft.Icons.DELETE, bgcolor=ERROR),
-                styled_button("Overdue Returns", go_overdue_list, icon=ft.Icons.WARNING_AMBER_ROUNDED, bgcolor=WARNING),
-                styled_button("Logout", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.LOGOUT),
-            ),
-        )
-        show_view(view)
-
-    def go_add_book(e=None):
-        name_field = styled_field("Book Name")
-        author_field = styled_field("Author")
-        copies_field = styled_field("Number of Copies", hint="e.g. 5")
-
-        def do_add(_):
-            name = name_field.value.strip() if name_field.value else ""
-            author = author_field.value.strip() if author_field.value else ""
-            copies = copies_field.value.strip() if copies_field.value else ""
-
-            if not name or not author or not copies:
-                show_snack("All fields are required.", WARNING)
-                return
-            try:
-                num = int(copies)
-            except ValueError:
-                show_snack("Copies must be a number.", WARNING)
-                return
-
-            books_col.insert_one({"name": name, "author": author, "number": num})
-            show_snack("Book added successfully!")
-            go_admin_panel()
-
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.BOOK_ROUNDED, size=56, color=PRIMARY),
-            page_title("Add a Book"),
-            ft.Container(height=10),
-            card_container(
-                name_field,
-                author_field,
-                copies_field,
-                styled_button("Add Book", do_add, icon=ft.Icons.CHECK),
-                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ),
-        )
-        show_view(view)
-
-    def go_delete_book(e=None):
-        name_field = styled_field("Book Name to Delete")
-
-        def do_delete(_):
-            name = name_field.value.strip() if name_field.value else ""
-            if not name:
-                show_snack("Please enter a book name.", WARNING)
-                return
-            result = books_col.delete_one({"name": name})
-            if result.deleted_count > 0:
-                show_snack("Book deleted!")
-                go_admin_panel()
-            else:
-                show_snack("Book not found!", ERROR)
-
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.DELETE_FOREVER_ROUNDED, size=56, color=ERROR),
-            page_title("Delete a Book"),
-            ft.Container(height=10),
-            card_container(
-                name_field,
-                styled_button("Delete", do_delete, bgcolor=ERROR, icon=ft.Icons.DELETE),
-                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ),
-        )
-        show_view(view)
-
-    def go_overdue_list(e=None):
-        cutoff_date = datetime.now() - timedelta(days=14)
-        overdue_borrows = list(borrows_col.find({"date": {"$lt": cutoff_date}}))
-
-        items_list = ft.Column(spacing=10)
-
-        if overdue_borrows:
-            for item in overdue_borrows:
-                borrow_date = item.get("date", datetime.now())
-                overdue_days = (datetime.now() - (borrow_date + timedelta(days=14))).days
-                username = item.get("username", "Unknown")
-                book_name = item.get("name", "Unknown")
-                book_author = item.get("author", "Unknown")
-
-                items_list.controls.append(
-                    ft.Container(
-                        content=ft.Column(
-                            [
-                                ft.Row(
-                                    [
-                                        ft.Icon(ft.Icons.PERSON, color=ERROR, size=18),
-                                        ft.Text(
-                                            username,
-                                            size=15,
-                                            weight=ft.FontWeight.BOLD,
-                                            color=TEXT_PRIMARY,
-                                        ),
-                                    ],
-                                    spacing=6,
-                                ),
-                                ft.Text(
-                                    f"📖 {book_name} — {book_author}",
-                                    size=13,
-                                    color=TEXT_SECONDARY,
-                                ),
-                                ft.Text(
-                                    f"Borrowed: {borrow_date.strftime('%Y-%m-%d')}",
-                                    size=12,
-                                    color=TEXT_SECONDARY,
-                                ),
-                                ft.Text(
-                                    f"⚠ {overdue_days} days overdue",
-                                    size=13,
-                                    color=ERROR,
-                                    weight=ft.FontWeight.W_700,
-                                ),
-                            ],
-                            spacing=4,
-                        ),
-                        bgcolor=SURFACE_LIGHT,
-                        border_radius=12,
-                        padding=16,
-                        width=340,
-                        animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
-                    )
-                )
-        else:
-            items_list.controls.append(
-                ft.Container(
-                    content=ft.Row(
-                        [
-                            ft.Icon(ft.Icons.CHECK_CIRCLE, color=SUCCESS, size=24),
-                            ft.Text(
-                                "No overdue books! All returns are on time.",
-                                color=SUCCESS,
-                                size=14,
-                            ),
-                        ],
-                        spacing=8,
-                        alignment=ft.MainAxisAlignment.CENTER,
-                    ),
-                    padding=16,
-                )
-            )
-
-        view = animated_view(
-            ft.Container(height=30),
-            ft.Icon(ft.Icons.WARNING_AMBER_ROUNDED, size=56, color=WARNING),
-            page_title("Overdue Returns", f"{len(overdue_borrows)} overdue book(s)"),
-            ft.Container(height=10),
-            card_container(items_list, width=380),
-            ft.Container(height=10),
-            styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ft.Container(height=20),
-        )
-        show_view(view)
-
-    def go_library_panel(e=None):
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.LIBRARY_BOOKS_ROUNDED, size=56, color=PRIMARY),
-            page_title("Library", f"Welcome, {current_user['username']}!"),
-            ft.Container(height=10),
-            card_container(
-                styled_button("Borrow a Book", go_borrow, icon=ft.Icons.BOOKMARK_ADD),
-                styled_button("Search for a Book", go_search, icon=ft.Icons.SEARCH),
-                styled_button("My Borrowed Books", go_my_books, icon=ft.Icons.LIST_ALT),
-                styled_button("Logout", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.LOGOUT),
-            ),
-        )
-        show_view(view)
-
-    def go_search(e=None):
-        query_field = styled_field("Book Name", hint="Enter book name to search")
-        results_column = ft.Column(spacing=10)
-
-        def do_search(_):
-            query = query_field.value.strip() if query_field.value else ""
-            if not query:
-                show_snack("Please enter a book name.", WARNING)
-                return
-
-            found = list(books_col.find({"name": query}))
-            results_column.controls.clear()
-
-            if found:
-                for book in found:
-                    stock = book.get("number", 0)
-                    stock_color = SUCCESS if stock > 0 else ERROR
-                    results_column.controls.append(
-                        ft.Container(
-                            content=ft.Column(
-                                [
-                                    ft.Text(book.get("name", ""), size=16, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
-                                    ft.Text(f"Author: {book.get('author', '')}", size=13, color=TEXT_SECONDARY),
-                                    ft.Text(f"In Stock: {stock}", size=13, color=stock_color, weight=ft.FontWeight.W_600),
-                                ],
-                                spacing=4,
-                            ),
-                            bgcolor=SURFACE_LIGHT,
-                            border_radius=12,
-                            padding=16,
-                            width=300,
-                            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
-                        )
-                    )
-            else:
-                results_column.controls.append(
-                    ft.Text("No books found.", color=TEXT_SECONDARY, size=14),
-                )
-            page.update()
-
-        view = animated_view(
-            ft.Container(height=30),
-            ft.Icon(ft.Icons.SEARCH_ROUNDED, size=56, color=PRIMARY),
-            page_title("Search Books"),
-            ft.Container(height=10),
-            card_container(
-                query_field,
-                styled_button("Search", do_search, icon=ft.Icons.SEARCH),
-            ),
-            results_column,
-            ft.Container(height=10),
-            styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ft.Container(height=20),
-        )
-        show_view(view)
-
-    def go_borrow(e=None):
-        name_field = styled_field("Book Name")
-        author_field = styled_field("Author Name")
-
-        def do_borrow(_):
-            book_name = name_field.value.strip() if name_field.value else ""
-            book_author = author_field.value.strip() if author_field.value else ""
-
-            if not book_name or not book_author:
-                show_snack("Both fields are required.", WARNING)
-                return
-
-            try:
-                book = books_col.find_one({"name": book_name, "author": book_author})
-                if book:
-                    if book.get("number", 0) > 0:
-                        books_col.update_one({"_id": book["_id"]}, {"$inc": {"number": -1}})
-                        borrows_col.insert_one({
-                            "username": current_user["username"],
-                            "name": book_name,
-                            "author": book_author,
-                            "date": datetime.now(),
-                        })
-                        show_snack(f"Borrowed '{book_name}' — return within 14 days.")
-                        go_library_panel()
-                    else:
-                        show_snack("Sorry, this book is out of stock.", WARNING)
-                else:
-                    show_snack("Book/author combination not found.", ERROR)
-            except Exception as ex:
-                show_snack(f"Database error: {ex}", ERROR)
-
-        view = animated_view(
-            ft.Container(height=40),
-            ft.Icon(ft.Icons.BOOKMARK_ADD_ROUNDED, size=56, color=PRIMARY),
-            page_title("Borrow a Book"),
-            ft.Container(height=10),
-            card_container(
-                name_field,
-                author_field,
-                styled_button("Borrow", do_borrow, icon=ft.Icons.CHECK),
-                styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ),
-        )
-        show_view(view)
-
-    def go_my_books(e=None):
-        user_books = list(borrows_col.find({"username": current_user["username"]}))
-        books_list = ft.Column(spacing=10)
-
-        if user_books:
-            for item in user_books:
-                borrow_date = item.get("date", datetime.now())
-                remaining = (borrow_date + timedelta(days=14)) - datetime.now()
-                if remaining.days > 0:
-                    time_text = f"{remaining.days} days left"
-                    time_color = SUCCESS
-                else:
-                    time_text = "EXPIRED"
-                    time_color = ERROR
-
-                b_name = item.get("name", "")
-                b_author = item.get("author", "")
-
-                def make_return(name=b_name, author=b_author):
-                    def do_return(_):
-                        borrows_col.delete_one({
-                            "username": current_user["username"],
-                            "name": name,
-                            "author": author,
-                        })
-                        books_col.update_one(
-                            {"name": name, "author": author},
-                            {"$inc": {"number": 1}},
-                        )
-                        show_snack(f"'{name}' returned successfully!")
-                        go_my_books()
-                    return do_return
-
-                books_list.controls.append(
-                    ft.Container(
-                        content=ft.Row(
-                            [
-                                ft.Column(
-                                    [
-                                        ft.Text(b_name, size=15, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
-                                        ft.Text(f"by {b_author}", size=12, color=TEXT_SECONDARY),
-                                        ft.Text(time_text, size=12, color=time_color, weight=ft.FontWeight.W_600),
-                                    ],
-                                    spacing=2,
-                                    expand=True,
-                                ),
-                                ft.IconButton(
-                                    icon=ft.Icons.KEYBOARD_RETURN_ROUNDED,
-                                    icon_color=SUCCESS,
-                                    tooltip="Return Book",
-                                    on_click=make_return(),
-                                ),
-                            ],
-                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                        ),
-                        bgcolor=SURFACE_LIGHT,
-                        border_radius=12,
-                        padding=ft.padding.symmetric(horizontal=16, vertical=12),
-                        width=340,
-                        animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
-                    )
-                )
-        else:
-            books_list.controls.append(
-                ft.Text("You have no borrowed books.", color=TEXT_SECONDARY, size=14),
-            )
-
-        view = animated_view(
-            ft.Container(height=30),
-            ft.Icon(ft.Icons.LIST_ALT_ROUNDED, size=56, color=PRIMARY),
-            page_title("My Borrowed Books"),
-            ft.Container(height=10),
-            card_container(books_list, width=380),
-            ft.Container(height=10),
-            styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
-            ft.Container(height=20),
-        )
-        show_view(view)
-
-    if admin_col.count_documents({}) == 0:
-        go_initial_setup()
-    else:
-        go_main_menu()
-
-
-ft.run(main)
+import time
+
+#Taken before the other imports so the startup breakdown includes them
+STARTED = time.perf_counter()
+
+import asyncio  # noqa: E402
+import os  # noqa: E402
+from datetime import datetime  # noqa: E402
+
+import flet as ft  # noqa: E402
+
+import accounts  # noqa: E402
+import analytics  # noqa: E402
+import catalog_cache  # noqa: E402
+import circulation  # noqa: E402
+import exporter  # noqa: E402
+import history  # noqa: E402
+import importer  # noqa: E402
+import indexes  # noqa: E402
+import inventory  # noqa: E402
+import live_stock  # noqa: E402
+import metrics  # noqa: E402
+import outbox  # noqa: E402
+import search  # noqa: E402
+import sessions  # noqa: E402
+import soak  # noqa: E402
+import startup  # noqa: E402
+from db import DB_SERVER_TIMEOUT_MS, admin_col, books_col, get_db, inflight, run_sync  # noqa: E402
+from models import Book  # noqa: E402
+
+startup.begin(STARTED)
+startup.mark("import")
+
+
+#You can easily change colors
+PRIMARY = "#576238"
+PRIMARY_DARK = "#F0EADC"
+SURFACE = "#1E1E2E"
+SURFACE_LIGHT = "#2A2A3C"
+CARD_BG = "#313145"
+TEXT_PRIMARY = "white"
+TEXT_SECONDARY = "#B0B0C0"
+SUCCESS = "#4CAF50"
+ERROR = "#EF5350"
+WARNING = "#FFA726"
+
+#Search-as-you-type: wait this long after the last keystroke before querying
+SEARCH_DEBOUNCE = 0.25
+SEARCH_MIN_CHARS = 2
+
+#Set WEB_PORT to serve the app to browsers instead of opening a desktop window
+WEB_PORT = os.getenv("WEB_PORT")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+
+#Animation durations
+FADE_DURATION = 400
+SCALE_DURATION = 350
+SLIDE_DURATION = 300
+
+
+def walk_controls(control):
+    yield control
+    content = getattr(control, "content", None)
+    if isinstance(content, ft.Control):
+        yield from walk_controls(content)
+    for child in getattr(control, "controls", None) or []:
+        yield from walk_controls(child)
+
+
+def dispose(view, keep=frozenset()):
+    #Handlers close over their view's rows and state; dropping them and the children lets a replaced
+    #view be freed even while a late task still holds on to one of its controls. keep: ids of controls
+    #that are still in use elsewhere
+    for control in list(walk_controls(view)):
+        if id(control) in keep:
+            continue
+        for name in [name for name in vars(control) if name.startswith("on_")]:
+            setattr(control, name, None)
+        if isinstance(getattr(control, "controls", None), list):
+            control.controls.clear()
+        if isinstance(getattr(control, "content", None), ft.Control):
+            control.content = None
+
+
+#Process-wide startup work; in web mode each session awaits the one shared run (see startup.once)
+async def bootstrap_database():
+    await run_sync(lambda: indexes.bootstrap(get_db()))
+    await circulation.backfill_due_dates()
+    await accounts.reserve_admin_names()
+
+
+async def load_catalog_once():
+    #Keeps the catalog cache and the search index in step with writes from other processes. It starts listening
+    #before the catalog is read, so a write made during a slow load is applied after it rather than missed
+    loop = asyncio.get_running_loop()
+    feed = await run_sync(lambda: catalog_cache.start_feed(books_col.collection, loop))
+    await run_sync(feed.opened.wait, DB_SERVER_TIMEOUT_MS / 1000)
+    try:
+        search.catalog.load(await books_col.stream_records(Book))
+    finally:
+        feed.loaded.set()
+
+
+async def main(page: ft.Page):
+    page.title = "Library Management System"
+    page.theme_mode = ft.ThemeMode.DARK
+    page.bgcolor = SURFACE
+    if not page.web:
+        page.window.width = 480
+        page.window.height = 700
+        await page.window.center()
+    page.padding = 0
+    page.scroll = ft.ScrollMode.AUTO
+
+    #Per window or browser tab; in web mode many of these run side by side in one process
+    session = sessions.open_session()
+
+    #One snack bar per session, reused for every message, so the overlay never grows
+    snack = ft.SnackBar(content=ft.Text("", color="white"))
+
+    def show_snack(msg, color=SUCCESS):
+        snack.content.value = msg
+        snack.bgcolor = color
+        snack.open = True
+        if snack not in page.overlay:
+            page.overlay.append(snack)
+            refresh()
+        else:
+            refresh(snack)
+
+    def styled_button(text, on_click, bgcolor=PRIMARY, icon=None, width=260):
+        return ft.Button(
+            content=ft.Row(
+                [
+                    ft.Icon(icon, color=TEXT_PRIMARY, size=20) if icon else ft.Container(),
+                    ft.Text(text, color=TEXT_PRIMARY, size=14),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+                spacing=8,
+            ),
+            on_click=on_click,
+            width=width,
+            height=48,
+            style=ft.ButtonStyle(
+                bgcolor=bgcolor,
+                color=TEXT_PRIMARY,
+                shape=ft.RoundedRectangleBorder(radius=12),
+            ),
+        )
+
+    def styled_field(label, password=False, hint=""):
+        return ft.TextField(
+            label=label,
+            hint_text=hint,
+            password=password,
+            can_reveal_password=password,
+            border_radius=12,
+            border_color=PRIMARY,
+            focused_border_color=PRIMARY_DARK,
+            text_size=14,
+            width=300,
+        )
+
+    def page_title(text, subtitle=None):
+        controls = [
+            ft.Text(text, size=26, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
+        ]
+        if subtitle:
+            controls.append(
+                ft.Text(subtitle, size=14, color=TEXT_SECONDARY),
+            )
+        return ft.Column(controls, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
+
+    def card_container(*children, width=380):
+        return ft.Container(
+            content=ft.Column(
+                list(children),
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                spacing=14,
+            ),
+            bgcolor=CARD_BG,
+            border_radius=20,
+            padding=30,
+            width=width,
+            shadow=ft.BoxShadow(
+                spread_radius=1,
+                blur_radius=15,
+                color="#4D000000",
+            ),
+            animate_scale=ft.Animation(SCALE_DURATION, ft.AnimationCurve.EASE_OUT),
+            scale=1,
+        )
+
+    def animated_view(*children):
+        container = ft.Container(
+            content=ft.Column(
+                list(children),
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                spacing=12,
+            ),
+            alignment=ft.Alignment(0, 0),
+            expand=True,
+            opacity=0,
+            offset=ft.Offset(0, 0.03),
+            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN_OUT),
+            animate_offset=ft.Animation(SLIDE_DURATION, ft.AnimationCurve.EASE_OUT),
+        )
+        return container
+
+    def refresh(control=None):
+        #Sending just the changed control keeps the patch small; page.update() diffs the whole tree
+        if control is None:
+            metrics.incr("ui.page_updates")
+            page.update()
+        else:
+            metrics.incr("ui.control_updates")
+            control.update()
+
+    #Stock labels on the current view: (name, author) -> [(label, container)], patched in place on changes
+    live_labels = {}
+    #More changed labels than this in one batch are sent as one update of their containers
+    LIVE_LABEL_UPDATES = 3
+
+    def set_stock_label(label, stock):
+        if stock is None:
+            label.value = "No longer in the catalog"
+            label.color = ERROR
+        else:
+            label.value = f"In Stock: {stock}"
+            label.color = SUCCESS if stock > 0 else ERROR
+
+    def track_stock(name, author, label, container):
+        live_labels.setdefault((name, author), []).append((label, container))
+
+    def on_stock_change(batch):
+        changed = []
+        for key, number in batch.items():
+            for label, container in live_labels.get(key, ()):
+                set_stock_label(label, number)
+                changed.append((label, container))
+        if len(changed) <= LIVE_LABEL_UPDATES:
+            for label, _ in changed:
+                refresh(label)
+            return
+        containers = {id(container): container for _, container in changed}
+        for container in containers.values():
+            refresh(container)
+
+    def is_cached(view):
+        return any(cached is view for _, cached in view_cache.values())
+
+    def release(view):
+        #Controls shared with the current or a cached view (e.g. the sync status line) are left alone
+        live = [*page.controls, *(cached for _, cached in view_cache.values())]
+        dispose(view, {id(control) for root in live for control in walk_controls(root)})
+        metrics.incr("ui.views_disposed")
+
+    def show_view(view_container):
+        live_labels.clear()
+        replaced = [old for old in page.controls if old is not view_container]
+        view_container.opacity = 0
+        view_container.offset = ft.Offset(0, 0.03)
+        page.controls[:] = [view_container]
+        refresh()
+        view_container.opacity = 1
+        view_container.offset = ft.Offset(0, 0)
+        refresh(view_container)
+        #Views built per visit are gone for good; cached ones are shown again later
+        for old in replaced:
+            if not is_cached(old):
+                release(old)
+
+    #Static panels and forms are built once per session and reused on every visit
+    view_cache = {}
+
+    def cached_view(name, build, variant=None):
+        cached = view_cache.get(name)
+        if cached is not None and cached[0] == variant:
+            metrics.incr("ui.view_cache_hits")
+            view = cached[1]
+            for control in walk_controls(view):
+                if isinstance(control, ft.TextField):
+                    control.value = ""
+            return view
+        view = build()
+        view_cache[name] = (variant, view)
+        if cached is not None and not any(cached[1] is shown for shown in page.controls):
+            #A stale variant (e.g. another user's panel) that is not on screen; show_view handles it otherwise
+            release(cached[1])
+        metrics.incr("ui.controls_built", sum(1 for _ in walk_controls(view)))
+        return view
+
+    def timed_view(fn):
+        return metrics.instrument(f"nav.{fn.__name__.removeprefix('go_').removeprefix('build_')}")(fn)
+
+    def showing(name):
+        cached = view_cache.get(name)
+        return cached is not None and bool(page.controls) and page.controls[0] is cached[1]
+
+    def view_route(build, variant=lambda: None):
+        name = build.__name__.removeprefix("build_")
+
+        def go(e=None):
+            show_view(cached_view(name, build, variant()))
+        go.__name__ = f"go_{name}"
+        return timed_view(go)
+
+    async def do_exit(_):
+        await page.window.close()
+
+    def do_logout(_):
+        session.logout()
+        go_main_menu()
+
+    @timed_view
+    def go_initial_setup(e=None):
+        pending_admins = []
+        admins_list_column = ft.Column(spacing=8)
+
+        username_field = styled_field("Admin Username", hint="Enter admin username")
+        password_field = styled_field("Admin Password", password=True, hint="Min 8 chars, letters & numbers")
+
+        no_admin_text = ft.Text(
+            "No admins added yet.",
+            size=13,
+            color=TEXT_SECONDARY,
+            italic=True,
+        )
+        admins_list_column.controls.append(no_admin_text)
+
+        def refresh_admin_list():
+            admins_list_column.controls.clear()
+            if not pending_admins:
+                admins_list_column.controls.append(
+                    ft.Text("No admins added yet.", size=13, color=TEXT_SECONDARY, italic=True)
+                )
+            else:
+                for i, admin in enumerate(pending_admins):
+                    admins_list_column.controls.append(
+                        ft.Container(
+                            content=ft.Row(
+                                [
+                                    ft.Icon(ft.Icons.ADMIN_PANEL_SETTINGS, color=PRIMARY, size=18),
+                                    ft.Text(
+                                        admin["username"],
+                                        size=14,
+                                        weight=ft.FontWeight.BOLD,
+                                        color=TEXT_PRIMARY,
+                                        expand=True,
+                                    ),
+                                    ft.IconButton(
+                                        icon=ft.Icons.REMOVE_CIRCLE,
+                                        icon_color=ERROR,
+                                        icon_size=20,
+                                        tooltip="Remove",
+                                        on_click=lambda _, idx=i: remove_admin(idx),
+                                    ),
+                                ],
+                            ),
+                            bgcolor=SURFACE_LIGHT,
+                            border_radius=10,
+                            padding=ft.padding.symmetric(horizontal=12, vertical=6),
+                            width=300,
+                        )
+                    )
+            refresh(admins_list_column)
+
+        def remove_admin(index):
+            if 0 <= index < len(pending_admins):
+                removed = pending_admins.pop(index)
+                show_snack(f"'{removed['username']}' removed from list.", WARNING)
+                refresh_admin_list()
+
+        def add_admin(_):
+            username = username_field.value.strip() if username_field.value else ""
+            password = password_field.value or ""
+
+            if not username:
+                show_snack("Please enter a username.", WARNING)
+                return
+            if not accounts.password_ok(password):
+                show_snack("Password must be 8+ chars with letters and numbers!", WARNING)
+                return
+            if any(a["username"] == username for a in pending_admins):
+                show_snack("This username is already in the list!", ERROR)
+                return
+
+            pending_admins.append({"username": username, "password": password})
+            username_field.value = ""
+            password_field.value = ""
+            show_snack(f"Admin '{username}' added to list.")
+            refresh_admin_list()
+
+        async def finalize_setup(_):
+            if not pending_admins:
+                show_snack("Add at least one admin before proceeding!", WARNING)
+                return
+
+            try:
+                #This screen may have been opened from a stale cached setup state; the database has the final word
+                if await startup.admin_exists(admin_col):
+                    startup.remember_setup(True)
+                    show_snack("Setup was already completed on this database. Please sign in.", WARNING)
+                    go_main_menu()
+                    return
+                await accounts.create_admins(pending_admins)
+                startup.remember_setup(True)
+                show_snack(f"{len(pending_admins)} admin(s) created. Setup complete!")
+                go_main_menu()
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+
+        view = animated_view(
+            ft.Container(height=20),
+            ft.Icon(ft.Icons.SECURITY_ROUNDED, size=64, color=WARNING),
+            page_title("Initial Setup", "Create admin account(s) — this can only be done once"),
+            ft.Container(height=6),
+            card_container(
+                username_field,
+                password_field,
+                styled_button("Add Admin to List", add_admin, icon=ft.Icons.PERSON_ADD, bgcolor=PRIMARY),
+                ft.Divider(color=SURFACE_LIGHT, thickness=1),
+                ft.Text("Admins to create:", size=14, weight=ft.FontWeight.BOLD, color=TEXT_SECONDARY),
+                admins_list_column,
+                ft.Divider(color=SURFACE_LIGHT, thickness=1),
+                styled_button(
+                    "Complete Setup",
+                    finalize_setup,
+                    icon=ft.Icons.CHECK_CIRCLE,
+                    bgcolor=SUCCESS,
+                ),
+            ),
+        )
+        show_view(view)
+
+    def build_main_menu():
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.LOCAL_LIBRARY_ROUNDED, size=72, color=PRIMARY),
+            page_title("Library Manager", "Modern Library Management System"),
+            ft.Container(height=20),
+            card_container(
+                styled_button("Create Account", go_register, icon=ft.Icons.PERSON_ADD),
+                styled_button("Login", go_login, icon=ft.Icons.LOGIN),
+                *([] if page.web else [styled_button("Exit", do_exit, bgcolor=ERROR, icon=ft.Icons.EXIT_TO_APP)]),
+            ),
+        )
+        return view
+
+    go_main_menu = view_route(build_main_menu)
+
+    def build_register():
+        username_field = styled_field("Username", hint="Choose a username")
+        password_field = styled_field("Password", password=True, hint="Min 8 chars, letters & numbers")
+
+        @metrics.instrument("action.register")
+        async def do_register(_):
+            username = username_field.value.strip() if username_field.value else ""
+            password = password_field.value or ""
+
+            if not username:
+                show_snack("Please enter a username.", WARNING)
+                return
+
+            try:
+                result = await accounts.register(username, password)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            if result == accounts.TAKEN:
+                show_snack("Username already exists!", ERROR)
+            elif result == accounts.RESERVED:
+                show_snack("This username is reserved!", ERROR)
+            elif result == accounts.WEAK_PASSWORD:
+                show_snack("Password must be 8+ chars with letters and numbers!", WARNING)
+            else:
+                show_snack("Account created successfully!")
+                go_main_menu()
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.PERSON_ADD_ALT_1_ROUNDED, size=56, color=PRIMARY),
+            page_title("Create Account"),
+            ft.Container(height=10),
+            card_container(
+                username_field,
+                password_field,
+                styled_button("Register", do_register, icon=ft.Icons.CHECK_CIRCLE),
+                styled_button("Back", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        return view
+
+    go_register = view_route(build_register)
+
+    def build_login():
+        username_field = styled_field("Username")
+        password_field = styled_field("Password", password=True)
+
+        @metrics.instrument("action.login")
+        async def do_login(_):
+            username = username_field.value.strip() if username_field.value else ""
+            password = password_field.value or ""
+
+            if not username:
+                show_snack("Please enter a username.", WARNING)
+                return
+
+            result = await accounts.login(username, password)
+
+            if result == accounts.NOT_FOUND:
+                show_snack("User not found!", ERROR)
+            elif result == accounts.ADMIN:
+                session.login(username, is_admin=True)
+                show_snack(f"Welcome, admin {username}!")
+                go_admin_panel()
+            elif result == accounts.USER:
+                session.login(username, is_admin=False)
+                show_snack(f"Welcome, {username}!")
+                go_library_panel()
+            else:
+                show_snack("Incorrect password!", ERROR)
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.LOCK_OPEN_ROUNDED, size=56, color=PRIMARY),
+            page_title("Login"),
+            ft.Container(height=10),
+            card_container(
+                username_field,
+                password_field,
+                styled_button("Login", do_login, icon=ft.Icons.LOGIN),
+                styled_button("Back", go_main_menu, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        return view
+
+    go_login = view_route(build_login)
+
+    def index_warning():
+        report = indexes.last_report
+        if report is None or report.ok:
+            return ft.Container()
+        return ft.Container(
+            content=ft.Column(
+                [
+                    ft.Text(
+                        f"⚠ {len(report.diagnostics)} index check(s) failed",
+                        size=13,
+                        color=WARNING,
+                        weight=ft.FontWeight.W_700,
+                    ),
+                    *[ft.Text(msg, size=11, color=TEXT_SECONDARY) for msg in report.diagnostics],
+                ],
+                spacing=2,
+            ),
+            width=340,
+        )
+
+    #Offline write queue status; the outbox calls this with its stats when the queue or online state changes
+    sync_status = ft.Text("", size=12, color=TEXT_SECONDARY)
+
+    def update_sync_status(stats=None):
+        stats = stats or outbox.queue.stats()
+        if stats["depth"] == 0 and stats["conflicts"] == 0 and stats["online"]:
+            text, color = "All changes synced", TEXT_SECONDARY
+        else:
+            #A clock time rather than an age: the line is only redrawn when the queue changes
+            text = f"{stats['depth']} change(s) waiting to sync"
+            if stats["oldest"]:
+                text += f", oldest from {datetime.fromtimestamp(stats['oldest']):%H:%M:%S}"
+            if not stats["online"]:
+                text += " (database unreachable)"
+            if stats["conflicts"]:
+                text += f" · {stats['conflicts']} conflict(s), see Diagnostics"
+            color = WARNING
+        if sync_status.value != text:
+            sync_status.value = text
+            sync_status.color = color
+            if showing("admin_panel"):
+                refresh(sync_status)
+
+    def build_admin_panel():
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.ADMIN_PANEL_SETTINGS_ROUNDED, size=56, color=PRIMARY),
+            page_title("Admin Panel", f"Logged in as {session.username}"),
+            index_warning(),
+            sync_status,
+            ft.Container(height=10),
+            card_container(
+                styled_button("Add Book", go_add_book, icon=ft.Icons.ADD_CIRCLE),
+                styled_button("Import Catalog", go_import, icon=ft.Icons.UPLOAD_FILE),
+                styled_button("Inventory", go_inventory, icon=ft.Icons.INVENTORY_2),
+                styled_button("Overdue Returns", go_overdue_list, icon=ft.Icons.WARNING_AMBER_ROUNDED, bgcolor=WARNING),
+                styled_button("Analytics", go_analytics, icon=ft.Icons.BAR_CHART),
+                styled_button("Diagnostics", go_diagnostics, icon=ft.Icons.INSIGHTS),
+                styled_button("Export Reports", go_export, icon=ft.Icons.DOWNLOAD),
+                styled_button("Logout", do_logout, bgcolor=SURFACE_LIGHT, icon=ft.Icons.LOGOUT),
+            ),
+        )
+        return view
+
+    go_admin_panel = view_route(build_admin_panel, lambda: (session.username, indexes.last_report))
+
+    def build_add_book():
+        name_field = styled_field("Book Name")
+        author_field = styled_field("Author")
+        copies_field = styled_field("Number of Copies", hint="e.g. 5")
+
+        @metrics.instrument("action.add_book")
+        async def do_add(_):
+            name = name_field.value.strip() if name_field.value else ""
+            author = author_field.value.strip() if author_field.value else ""
+            copies = copies_field.value.strip() if copies_field.value else ""
+
+            if not name or not author or not copies:
+                show_snack("All fields are required.", WARNING)
+                return
+            try:
+                num = int(copies)
+            except ValueError:
+                show_snack("Copies must be a number.", WARNING)
+                return
+
+            if await outbox.add_copies(name, author, num) == outbox.QUEUED:
+                show_snack("Saved offline — the book will be added once the database is reachable.", WARNING)
+            else:
+                show_snack("Book added successfully!")
+            go_admin_panel()
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.BOOK_ROUNDED, size=56, color=PRIMARY),
+            page_title("Add a Book"),
+            ft.Container(height=10),
+            card_container(
+                name_field,
+                author_field,
+                copies_field,
+                styled_button("Add Book", do_add, icon=ft.Icons.CHECK),
+                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        return view
+
+    go_add_book = view_route(build_add_book)
+
+    @timed_view
+    def go_import(e=None):
+        path_field = styled_field("File Path", hint="e.g. C:/catalog.csv or books.jsonl")
+        progress_bar = ft.ProgressBar(width=300, value=0, color=PRIMARY, bgcolor=SURFACE_LIGHT)
+        status_text = ft.Text("CSV or JSON Lines with name, author and number columns.", size=13, color=TEXT_SECONDARY)
+        bad_rows_column = ft.Column(spacing=4)
+        running = {"value": False}
+
+        def on_progress(report):
+            progress_bar.value = report.progress
+            status_text.value = report.summary()
+            refresh(progress_bar)
+            refresh(status_text)
+
+        @metrics.instrument("action.import")
+        async def do_import(_):
+            path = path_field.value.strip() if path_field.value else ""
+            if not path:
+                show_snack("Please enter a file path.", WARNING)
+                return
+            if running["value"]:
+                return
+
+            running["value"] = True
+            bad_rows_column.controls.clear()
+            try:
+                report = await importer.import_books(path, on_progress=on_progress)
+            except (OSError, ValueError) as ex:
+                show_snack(f"Cannot read file: {ex}", ERROR)
+                return
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            finally:
+                running["value"] = False
+
+            for bad in report.bad_rows[:20]:
+                bad_rows_column.controls.append(
+                    ft.Text(f"Line {bad['line']}: {bad['reason']}", size=12, color=ERROR)
+                )
+            if report.bad_count > 20:
+                bad_rows_column.controls.append(
+                    ft.Text(f"... and {report.bad_count - 20} more", size=12, color=TEXT_SECONDARY)
+                )
+            refresh(bad_rows_column)
+            show_snack("Import finished.", WARNING if report.bad_count else SUCCESS)
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.UPLOAD_FILE_ROUNDED, size=56, color=PRIMARY),
+            page_title("Import Catalog"),
+            ft.Container(height=10),
+            card_container(
+                path_field,
+                styled_button("Import", do_import, icon=ft.Icons.UPLOAD),
+                progress_bar,
+                status_text,
+                bad_rows_column,
+                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        show_view(view)
+
+
+    def paged_list(fetch_page, build_row, empty_row, height=440):
+        #Rows are fetched a page at a time as the user scrolls; ListView only lays out what is visible
+        state = {"cursor": None, "done": False, "loading": False}
+        list_view = ft.ListView(
+            spacing=10,
+            height=height,
+            first_item_prototype=True,
+            on_scroll_interval=100,
+        )
+
+        async def load_more(update=True):
+            if state["loading"] or (state["done"] and list_view.controls):
+                return
+            if not state["done"]:
+                state["loading"] = True
+                try:
+                    rows, state["cursor"] = await fetch_page(state["cursor"])
+                finally:
+                    state["loading"] = False
+                state["done"] = state["cursor"] is None
+                list_view.controls.extend(build_row(row) for row in rows)
+            if not list_view.controls:
+                list_view.height = None
+                list_view.controls.append(empty_row)
+            if update:
+                refresh(list_view)
+
+        async def on_scroll(e):
+            if e.pixels >= e.max_scroll_extent - 200:
+                await load_more()
+
+        list_view.on_scroll = on_scroll
+        return list_view, load_more
+
+    @timed_view
+    async def go_inventory(e=None):
+        filter_field = styled_field("Filter", hint="Title or author; leave empty to list everything")
+        delta_field = styled_field("Change Stock By", hint="e.g. 5 or -2")
+        list_holder = ft.Container()
+        preview_column = ft.Column(spacing=4)
+        preview_card = card_container(preview_column, width=380)
+        preview_card.visible = False
+        #(name, author) -> (checkbox, stock label) for every row currently in the grid
+        rows = {}
+        pending = {"action": None}
+
+        def title_row(item):
+            key = (item.name, item.author)
+            checkbox = ft.Checkbox(value=False, fill_color=PRIMARY, on_change=update_selection)
+            stock_label = ft.Text("", size=12, weight=ft.FontWeight.W_600)
+            set_stock_label(stock_label, item.number)
+            track_stock(key[0], key[1], stock_label, list_holder)
+            rows[key] = (checkbox, stock_label)
+            return ft.Container(
+                content=ft.Row(
+                    [
+                        checkbox,
+                        ft.Column(
+                            [
+                                ft.Text(key[0], size=14, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
+                                ft.Text(f"by {key[1]}", size=12, color=TEXT_SECONDARY),
+                                stock_label,
+                            ],
+                            spacing=2,
+                            expand=True,
+                        ),
+                        ft.IconButton(
+                            icon=ft.Icons.HISTORY,
+                            icon_color=PRIMARY,
+                            tooltip="Borrow History",
+                            on_click=lambda _, key=key: page.run_task(go_title_history, *key),
+                        ),
+                    ],
+                ),
+                bgcolor=SURFACE_LIGHT,
+                border_radius=12,
+                padding=ft.padding.symmetric(horizontal=12, vertical=8),
+                width=340,
+            )
+
+        def selected_keys():
+            return [key for key, (checkbox, _) in rows.items() if checkbox.value]
+
+        def update_selection(_=None):
+            count = len(selected_keys())
+            for button, label in ((delete_button, "Delete Selected"), (adjust_button, "Adjust Selected")):
+                button.disabled = count == 0
+                button.content.controls[1].value = f"{label} ({count})" if count else label
+                refresh(button)
+
+        async def load(update=True):
+            rows.clear()
+            live_labels.clear()
+            query = filter_field.value.strip() if filter_field.value else ""
+            if query:
+                #The in-memory index answers filters instantly, with the same matching as Search
+                async def fetch_page(_cursor):
+                    return search.catalog.search(query, limit=200), None
+            else:
+                fetch_page = inventory.titles_page
+            empty = ft.Text("No books match.", size=13, color=TEXT_SECONDARY)
+            list_holder.content, load_more = paged_list(fetch_page, title_row, empty, height=360)
+            await load_more(update=False)
+            if update:
+                close_preview()
+                update_selection()
+                refresh(list_holder)
+
+        async def do_filter(_):
+            await load()
+
+        def close_preview(_=None):
+            pending["action"] = None
+            preview_card.visible = False
+            refresh(preview_card)
+
+        def show_preview(title, lines, action):
+            pending["action"] = action
+            preview_column.controls[:] = [
+                ft.Text(title, size=14, weight=ft.FontWeight.W_700, color=TEXT_PRIMARY),
+                *[ft.Text(text, size=12, color=color) for text, color in lines],
+                ft.Row(
+                    [
+                        styled_button("Confirm", do_confirm, icon=ft.Icons.CHECK, width=150),
+                        styled_button("Cancel", close_preview, bgcolor=SURFACE_LIGHT, icon=ft.Icons.CLOSE, width=150),
+                    ],
+                    alignment=ft.MainAxisAlignment.CENTER,
+                ),
+            ]
+            preview_card.visible = True
+            refresh(preview_card)
+
+        async def do_preview_delete(_):
+            keys = selected_keys()
+            try:
+                preview = await inventory.preview(keys)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            lines = [
+                (f"{row['name']} — {row['author']}: {row['active']} on loan, will be kept", WARNING)
+                if row["active"] else
+                (f"{row['name']} — {row['author']}: {row['number']} in stock, will be deleted", ERROR)
+                for row in preview
+            ]
+            deletable = sum(1 for row in preview if not row["active"])
+            show_preview(f"Delete {deletable} of {len(keys)} title(s)?", lines, lambda: bulk_delete(keys))
+
+        async def do_preview_adjust(_):
+            keys = selected_keys()
+            try:
+                delta = int(delta_field.value.strip() if delta_field.value else "")
+            except ValueError:
+                show_snack("Enter a whole number of copies, e.g. 5 or -2.", WARNING)
+                return
+            if delta == 0:
+                show_snack("Enter a number other than 0.", WARNING)
+                return
+            try:
+                preview = await inventory.preview(keys)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            lines = [
+                (f"{row['name']} — {row['author']}: {row['number']} → {max(0, row['number'] + delta)}", TEXT_SECONDARY)
+                for row in preview
+            ]
+            show_preview(
+                f"{'Add' if delta > 0 else 'Remove'} {abs(delta)} copies for {len(preview)} title(s)?",
+                lines,
+                lambda: bulk_adjust({key: delta for key in keys}),
+            )
+
+        async def do_confirm(_):
+            action = pending["action"]
+            close_preview()
+            if action is not None:
+                await action()
+
+        @metrics.instrument("action.bulk_delete")
+        async def bulk_delete(keys):
+            try:
+                deleted, refused = await inventory.delete_titles(keys)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            if refused:
+                show_snack(f"Deleted {len(deleted)} title(s); {len(refused)} kept because copies are on loan.", WARNING)
+            else:
+                show_snack(f"Deleted {len(deleted)} title(s).")
+            await load()
+
+        @metrics.instrument("action.bulk_stock")
+        async def bulk_adjust(changes):
+            try:
+                stock = await inventory.adjust_stock(changes)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            #The stock labels follow through the live stock feed
+            show_snack(f"Stock updated for {len(stock)} title(s).")
+
+        delete_button = styled_button("Delete Selected", do_preview_delete, bgcolor=ERROR, icon=ft.Icons.DELETE, width=170)
+        adjust_button = styled_button("Adjust Selected", do_preview_adjust, icon=ft.Icons.EXPOSURE, width=170)
+        delete_button.disabled = adjust_button.disabled = True
+        filter_field.on_submit = do_filter
+        delta_field.on_submit = do_preview_adjust
+        await load(update=False)
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.INVENTORY_2_ROUNDED, size=56, color=PRIMARY),
+            page_title("Inventory", "Select titles to delete them or change their stock"),
+            card_container(
+                filter_field,
+                styled_button("Filter", do_filter, icon=ft.Icons.FILTER_LIST),
+                list_holder,
+                width=380,
+            ),
+            card_container(
+                delta_field,
+                ft.Row([delete_button, adjust_button], alignment=ft.MainAxisAlignment.CENTER),
+            ),
+            preview_card,
+            styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ft.Container(height=20),
+        )
+        show_view(view)
+        #show_view forgets the previous view's stock labels, so the first page is tracked again
+        for key, (_, stock_label) in rows.items():
+            track_stock(key[0], key[1], stock_label, list_holder)
+
+    def overdue_row(item):
+        borrow_date = item.date or datetime.now()
+        overdue_days = int(item.overdue_days or 0)
+        username = item.username or "Unknown"
+        book_name = item.name or "Unknown"
+        book_author = item.author or "Unknown"
+
+        return ft.Container(
+            content=ft.Column(
+                [
+                    ft.Row(
+                        [
+                            ft.Icon(ft.Icons.PERSON, color=ERROR, size=18),
+                            ft.Text(
+                                username,
+                                size=15,
+                                weight=ft.FontWeight.BOLD,
+                                color=TEXT_PRIMARY,
+                            ),
+                        ],
+                        spacing=6,
+                    ),
+                    ft.Text(
+                        f"📖 {book_name} — {book_author}",
+                        size=13,
+                        color=TEXT_SECONDARY,
+                    ),
+                    ft.Text(
+                        f"Borrowed: {borrow_date.strftime('%Y-%m-%d')}",
+                        size=12,
+                        color=TEXT_SECONDARY,
+                    ),
+                    ft.Text(
+                        f"⚠ {overdue_days} days overdue",
+                        size=13,
+                        color=ERROR,
+                        weight=ft.FontWeight.W_700,
+                    ),
+                ],
+                spacing=4,
+            ),
+            bgcolor=SURFACE_LIGHT,
+            border_radius=12,
+            padding=16,
+            width=340,
+            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
+        )
+
+    def history_row(item, show_user):
+        borrowed = item.date.strftime("%Y-%m-%d") if item.date else "?"
+        returned_at = item.returned_at or datetime.now()
+        late = item.due_date is not None and returned_at > item.due_date
+        headline = item.username if show_user else item.name
+        detail = f"📖 {item.name} — {item.author}" if show_user else f"by {item.author}"
+
+        return ft.Container(
+            content=ft.Column(
+                [
+                    ft.Text(headline, size=15, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
+                    ft.Text(detail, size=13, color=TEXT_SECONDARY),
+                    ft.Text(
+                        f"Borrowed {borrowed}, returned {returned_at.strftime('%Y-%m-%d')}",
+                        size=12,
+                        color=TEXT_SECONDARY,
+                    ),
+                    ft.Text(
+                        "Returned late" if late else "Returned on time",
+                        size=12,
+                        color=WARNING if late else SUCCESS,
+                        weight=ft.FontWeight.W_600,
+                    ),
+                ],
+                spacing=2,
+            ),
+            bgcolor=SURFACE_LIGHT,
+            border_radius=12,
+            padding=ft.padding.symmetric(horizontal=16, vertical=12),
+            width=340,
+            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
+        )
+
+    async def show_history(title, fetch_page, count, show_user, back):
+        empty = ft.Text("No returned loans yet.", color=TEXT_SECONDARY, size=14)
+        items_list, load_more = paged_list(fetch_page, lambda item: history_row(item, show_user), empty)
+        total, _ = await asyncio.gather(count, load_more(update=False))
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.HISTORY, size=56, color=PRIMARY),
+            page_title(title, f"{total} returned loan(s)"),
+            ft.Container(height=10),
+            card_container(items_list, width=380),
+            ft.Container(height=10),
+            styled_button("Back", back, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    @timed_view
+    async def go_title_history(name, author):
+        await show_history(
+            name,
+            lambda cursor: history.title_page(name, author, cursor),
+            history.count_for_title(name, author),
+            True,
+            go_inventory,
+        )
+
+    @timed_view
+    async def go_borrow_history(e=None):
+        username = session.username
+        await show_history(
+            "Borrow History",
+            lambda cursor: history.user_page(username, cursor),
+            history.count_for_user(username),
+            False,
+            go_library_panel,
+        )
+
+    @timed_view
+    def go_export(e=None):
+        report_dropdown = ft.Dropdown(
+            label="Report",
+            value="overdue",
+            options=[ft.dropdown.Option(name) for name in exporter.REPORTS],
+            border_radius=12,
+            border_color=PRIMARY,
+            width=300,
+        )
+        path_field = styled_field("Output File", hint="e.g. overdue.csv or borrows.jsonl.gz")
+        status_text = ft.Text("Format follows the extension: .csv or .jsonl, add .gz to compress.", size=13, color=TEXT_SECONDARY)
+        running = {"value": False}
+
+        def show_count(count):
+            status_text.value = f"{count} rows written..."
+            refresh(status_text)
+
+        @metrics.instrument("action.export")
+        async def do_export(_):
+            report = report_dropdown.value
+            path = path_field.value.strip() if path_field.value else ""
+            if not path:
+                path = f"{report}_{datetime.now():%Y%m%d_%H%M}.csv"
+            if running["value"]:
+                return
+
+            running["value"] = True
+            loop = asyncio.get_running_loop()
+            try:
+                #Runs on the db executor; progress is handed back to the event loop thread
+                count = await run_sync(
+                    exporter.export,
+                    report,
+                    path,
+                    on_progress=lambda n: loop.call_soon_threadsafe(show_count, n),
+                )
+            except (OSError, ValueError) as ex:
+                show_snack(f"Cannot write file: {ex}", ERROR)
+                return
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            finally:
+                running["value"] = False
+
+            status_text.value = f"Exported {count} rows to {path}"
+            refresh(status_text)
+            show_snack("Export finished.")
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.DOWNLOAD_ROUNDED, size=56, color=PRIMARY),
+            page_title("Export Reports"),
+            ft.Container(height=10),
+            card_container(
+                report_dropdown,
+                path_field,
+                styled_button("Export", do_export, icon=ft.Icons.SAVE_ALT),
+                status_text,
+                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        show_view(view)
+
+    @timed_view
+    async def go_overdue_list(e=None):
+        no_overdue = ft.Container(
+            content=ft.Row(
+                [
+                    ft.Icon(ft.Icons.CHECK_CIRCLE, color=SUCCESS, size=24),
+                    ft.Text(
+                        "No overdue books! All returns are on time.",
+                        color=SUCCESS,
+                        size=14,
+                    ),
+                ],
+                spacing=8,
+                alignment=ft.MainAxisAlignment.CENTER,
+            ),
+            padding=16,
+        )
+        items_list, load_more = paged_list(circulation.overdue_page, overdue_row, no_overdue)
+        overdue_count, _ = await asyncio.gather(circulation.count_overdue(), load_more(update=False))
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.WARNING_AMBER_ROUNDED, size=56, color=WARNING),
+            page_title("Overdue Returns", f"{overdue_count} overdue book(s)"),
+            ft.Container(height=10),
+            card_container(items_list, width=380),
+            ft.Container(height=10),
+            styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    @timed_view
+    async def go_analytics(e=None):
+        sections = ft.Column(spacing=4)
+
+        def line(text, color=TEXT_PRIMARY):
+            return ft.Text(text, size=12, color=color, font_family="monospace")
+
+        def heading(text):
+            return ft.Text(text, size=14, color=PRIMARY, weight=ft.FontWeight.W_700)
+
+        def percent(rate):
+            return "   -" if rate is None else f"{rate:4.0%}"
+
+        async def render(update=True):
+            try:
+                board = await analytics.dashboard()
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            totals = board["totals"]
+            rebuilt = totals.get("rebuilt_at")
+            sections.controls[:] = [
+                line(
+                    f"{totals.get('borrows', 0)} borrows, {totals.get('returns', 0)} returns, "
+                    f"{totals.get('active', 0)} on loan now",
+                    TEXT_SECONDARY,
+                ),
+                line(f"Recounted {rebuilt:%d %b %H:%M}" if rebuilt else "Not recounted yet", TEXT_SECONDARY),
+                heading("Most borrowed"),
+                *[line(f"{row['borrows']:>6}  {row['name'][:24]} — {row['author'][:16]}") for row in board["top_titles"]],
+                heading("Highest utilization (on loan / owned)"),
+                *[
+                    line(f"{row['rate']:>5.0%}  {row['active']}/{row['owned']}  {row['name'][:24]}")
+                    for row in board["utilization"]
+                ],
+                heading("Most active loans per user"),
+                *[line(f"{row['active']:>6}  {row['username'][:32]}") for row in board["top_users"]],
+                heading("By day (late = returned after due date, overdue = share of loans)"),
+                line(f"{'day':<12}{'borrows':>8}{'returns':>8}{'late':>6}{'overdue':>8}", TEXT_SECONDARY),
+                *[
+                    line(
+                        f"{row['day']:<12}{row.get('borrows', 0):>8}{row.get('returns', 0):>8}"
+                        f"{percent(row['late_rate']):>6}{percent(row['overdue_rate']):>8}"
+                    )
+                    for row in board["days"]
+                ],
+            ]
+            if update:
+                refresh(sections)
+
+        async def do_rebuild(_):
+            try:
+                active, overdue = await analytics.rebuild()
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+            show_snack(f"Recounted {active} active loan(s), {overdue} overdue.")
+            await render()
+
+        await render(update=False)
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.BAR_CHART_ROUNDED, size=56, color=PRIMARY),
+            page_title("Analytics", "Circulation statistics, kept up to date as books are borrowed and returned"),
+            ft.Container(height=10),
+            card_container(sections, width=440),
+            ft.Container(height=10),
+            card_container(
+                styled_button("Refresh", lambda _: page.run_task(render), icon=ft.Icons.REFRESH),
+                styled_button("Recount Now", do_rebuild, bgcolor=SURFACE_LIGHT, icon=ft.Icons.RESTART_ALT),
+                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    @timed_view
+    def go_diagnostics(e=None):
+        enabled_switch = ft.Switch(label="Collect metrics", value=metrics.enabled, active_color=PRIMARY)
+        timings_column = ft.Column(spacing=4)
+        counters_column = ft.Column(spacing=2)
+        queue_column = ft.Column(spacing=2)
+        path_field = styled_field("Export File", hint="e.g. metrics.json or metrics.prom")
+
+        def stat_text(text, color=TEXT_PRIMARY, weight=None):
+            return ft.Text(text, size=12, color=color, weight=weight, font_family="monospace")
+
+        def render(update=True):
+            snap = metrics.snapshot()
+            timings_column.controls[:] = [stat_text(f"{'action':<22}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}", TEXT_SECONDARY)]
+            for name, stats in sorted(snap["timings"].items()):
+                timings_column.controls.append(stat_text(
+                    f"{name[:22]:<22}{stats['count']:>6}{stats['p50_ms']:>8.1f}{stats['p95_ms']:>8.1f}{stats['p99_ms']:>8.1f}"
+                ))
+            counters_column.controls[:] = [
+                stat_text(f"{name[:40]:<40}{value:>10}") for name, value in sorted(snap["counters"].items())
+            ]
+            if not snap["timings"] and not snap["counters"]:
+                message = "Collection is on; use the app and refresh." if metrics.enabled else "Turn collection on to record timings."
+                counters_column.controls.append(ft.Text(message, size=13, color=TEXT_SECONDARY))
+            if metrics.enabled and not metrics.commands_tracked:
+                counters_column.controls.append(ft.Text(
+                    "Database commands are only counted when the app starts with METRICS=1.",
+                    size=12, color=TEXT_SECONDARY,
+                ))
+            queue = outbox.queue.stats()
+            open_sessions = sessions.stats()
+            in_flight = inflight.snapshot()
+            queue_column.controls[:] = [stat_text(
+                f"Sessions: {open_sessions['sessions']} open, {open_sessions['logged_in']} signed in; "
+                f"db calls in flight {in_flight['in_flight']} (peak {in_flight['peak']})",
+                TEXT_SECONDARY,
+            ), stat_text(
+                f"Sync queue: {queue['depth']} pending, lag {queue['lag_s']:.0f}s, "
+                f"{'online' if queue['online'] else 'offline'}",
+                WARNING if queue["depth"] or not queue["online"] else TEXT_SECONDARY,
+            )]
+            for name, cache_stats in snap["gauges"].items():
+                line = (
+                    f"{name.replace('_', ' ').capitalize()}: {cache_stats['size']} entries, "
+                    f"hit rate {cache_stats['hit_rate']:.0%} ({cache_stats['hits']} hits, {cache_stats['misses']} misses)"
+                )
+                if "mode" in cache_stats:
+                    line += f", {cache_stats['mode'].replace('_', ' ')}"
+                if cache_stats.get("staleness_s") is not None:
+                    line += f", synced {cache_stats['staleness_s']:.0f}s ago"
+                queue_column.controls.append(stat_text(line, TEXT_SECONDARY))
+            for conflict in outbox.queue.conflicts():
+                queue_column.controls.append(
+                    ft.Text(f"{conflict['created']:%d %b %H:%M} {conflict['error']}", size=11, color=ERROR)
+                )
+            if queue["conflicts"]:
+                queue_column.controls.append(
+                    ft.TextButton("Dismiss conflicts", on_click=do_dismiss_conflicts)
+                )
+            if update:
+                refresh(timings_column)
+                refresh(counters_column)
+                refresh(queue_column)
+
+        async def do_dismiss_conflicts(_):
+            await outbox.queue.dismiss_conflicts()
+            render()
+
+        def on_toggle(_):
+            metrics.set_enabled(enabled_switch.value)
+            render()
+
+        def do_reset(_):
+            metrics.reset()
+            render()
+
+        def do_save(fmt):
+            path = path_field.value.strip() if path_field.value else ""
+            if not path:
+                path = f"metrics_{datetime.now():%Y%m%d_%H%M}.{'json' if fmt == 'json' else 'prom'}"
+            text = metrics.to_json() if fmt == "json" else metrics.to_prometheus()
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+            except OSError as ex:
+                show_snack(f"Cannot write file: {ex}", ERROR)
+                return
+            show_snack(f"Metrics saved to {path}")
+
+        def do_save_json(_):
+            do_save("json")
+
+        def do_save_prometheus(_):
+            do_save("prometheus")
+
+        async def do_soak(_):
+            path = path_field.value.strip() if path_field.value else ""
+            if not path.endswith(".json"):
+                path = f"soak_{datetime.now():%Y%m%d_%H%M}.json"
+            #What a desk does all day: move between the admin screens, with a notification each time
+            views = [go_admin_panel, go_inventory, go_add_book, go_overdue_list, go_export, go_analytics, go_import]
+
+            def step(i):
+                show_snack(f"Soak test step {i + 1} of {soak.SOAK_ITERATIONS}")
+                return views[i % len(views)]()
+
+            def controls_in_use():
+                roots = [*page.controls, *(cached for _, cached in view_cache.values())]
+                return sum(1 for root in roots for _ in walk_controls(root))
+
+            report = await soak.run([step], lambda: len(page.overlay), controls_in_use)
+            go_diagnostics()
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(report.to_json())
+            except OSError as ex:
+                show_snack(f"Cannot write file: {ex}", ERROR)
+                return
+            show_snack(f"Soak test: {report.summary()}. Saved to {path}", WARNING if report.errors else SUCCESS)
+
+        enabled_switch.on_change = on_toggle
+        render(update=False)
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.INSIGHTS_ROUNDED, size=56, color=PRIMARY),
+            page_title("Diagnostics", "Latency in ms per handler and database command"),
+            ft.Container(height=10),
+            card_container(
+                ft.Text(f"Startup: {startup.summary()}", size=12, color=TEXT_SECONDARY),
+                queue_column,
+                enabled_switch,
+                timings_column,
+                ft.Divider(color=SURFACE_LIGHT),
+                counters_column,
+                width=440,
+            ),
+            ft.Container(height=10),
+            card_container(
+                styled_button("Refresh", lambda _: render(), icon=ft.Icons.REFRESH),
+                styled_button("Reset", do_reset, bgcolor=SURFACE_LIGHT, icon=ft.Icons.RESTART_ALT),
+                path_field,
+                styled_button("Export JSON", do_save_json, icon=ft.Icons.SAVE_ALT),
+                styled_button("Export Prometheus", do_save_prometheus, icon=ft.Icons.SAVE_ALT),
+                styled_button("Soak Test", do_soak, bgcolor=WARNING, icon=ft.Icons.LOOP),
+                styled_button("Back", go_admin_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    def build_library_panel():
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.LIBRARY_BOOKS_ROUNDED, size=56, color=PRIMARY),
+            page_title("Library", f"Welcome, {session.username}!"),
+            ft.Container(height=10),
+            card_container(
+                styled_button("Borrow a Book", go_borrow, icon=ft.Icons.BOOKMARK_ADD),
+                styled_button("Search for a Book", go_search, icon=ft.Icons.SEARCH),
+                styled_button("My Borrowed Books", go_my_books, icon=ft.Icons.LIST_ALT),
+                styled_button("Borrow History", go_borrow_history, icon=ft.Icons.HISTORY),
+                styled_button("Logout", do_logout, bgcolor=SURFACE_LIGHT, icon=ft.Icons.LOGOUT),
+            ),
+        )
+        return view
+
+    go_library_panel = view_route(build_library_panel, lambda: session.username)
+
+    @timed_view
+    def go_search(e=None):
+        query_field = styled_field("Title or Author", hint="Enter a title, author or part of one")
+        results_column = ft.Column(spacing=10)
+        pending = {"task": None}
+
+        def render_results(found):
+            results_column.controls.clear()
+            live_labels.clear()
+
+            if found:
+                for book in found:
+                    stock_label = ft.Text("", size=13, weight=ft.FontWeight.W_600)
+                    set_stock_label(stock_label, book.number)
+                    track_stock(book.name, book.author, stock_label, results_column)
+                    results_column.controls.append(
+                        ft.Container(
+                            content=ft.Column(
+                                [
+                                    ft.Text(book.name, size=16, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
+                                    ft.Text(f"Author: {book.author}", size=13, color=TEXT_SECONDARY),
+                                    stock_label,
+                                ],
+                                spacing=4,
+                            ),
+                            bgcolor=SURFACE_LIGHT,
+                            border_radius=12,
+                            padding=16,
+                            width=300,
+                            animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
+                        )
+                    )
+            else:
+                results_column.controls.append(
+                    ft.Text("No books found.", color=TEXT_SECONDARY, size=14),
+                )
+            refresh(results_column)
+
+        def cancel_pending():
+            if pending["task"] is not None:
+                pending["task"].cancel()
+                pending["task"] = None
+
+        @metrics.instrument("action.live_search")
+        async def live_search(query):
+            #Wait out the debounce window; a newer keystroke cancels this task before it queries
+            await asyncio.sleep(SEARCH_DEBOUNCE)
+            render_results(await search.find_books(query, books_col))
+
+        def on_query_change(_):
+            cancel_pending()
+            query = query_field.value.strip() if query_field.value else ""
+            if len(query) < SEARCH_MIN_CHARS:
+                if results_column.controls:
+                    results_column.controls.clear()
+                    refresh(results_column)
+                return
+            pending["task"] = page.run_task(live_search, query)
+
+        @metrics.instrument("action.search")
+        async def do_search(_):
+            cancel_pending()
+            query = query_field.value.strip() if query_field.value else ""
+            if not query:
+                show_snack("Please enter a title or author.", WARNING)
+                return
+
+            render_results(await search.find_books(query, books_col))
+
+        query_field.on_change = on_query_change
+        query_field.on_submit = do_search
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.SEARCH_ROUNDED, size=56, color=PRIMARY),
+            page_title("Search Books"),
+            ft.Container(height=10),
+            card_container(
+                query_field,
+                styled_button("Search", do_search, icon=ft.Icons.SEARCH),
+            ),
+            results_column,
+            ft.Container(height=10),
+            styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    def build_borrow():
+        name_field = styled_field("Book Name")
+        author_field = styled_field("Author Name")
+
+        @metrics.instrument("action.borrow")
+        async def do_borrow(_):
+            book_name = name_field.value.strip() if name_field.value else ""
+            book_author = author_field.value.strip() if author_field.value else ""
+
+            if not book_name or not book_author:
+                show_snack("Both fields are required.", WARNING)
+                return
+
+            try:
+                result = await outbox.borrow(session.username, book_name, book_author)
+                if result == outbox.QUEUED:
+                    show_snack("Saved offline — the borrow will be recorded once the database is reachable.", WARNING)
+                    go_library_panel()
+                elif result == circulation.BORROWED:
+                    show_snack(f"Borrowed '{book_name}' — return within {circulation.LOAN_DAYS} days.")
+                    go_library_panel()
+                elif result == circulation.OUT_OF_STOCK:
+                    show_snack("Sorry, this book is out of stock.", WARNING)
+                else:
+                    show_snack("Book/author combination not found.", ERROR)
+            except Exception as ex:
+                show_snack(f"Database error: {ex}", ERROR)
+
+        view = animated_view(
+            ft.Container(height=40),
+            ft.Icon(ft.Icons.BOOKMARK_ADD_ROUNDED, size=56, color=PRIMARY),
+            page_title("Borrow a Book"),
+            ft.Container(height=10),
+            card_container(
+                name_field,
+                author_field,
+                styled_button("Borrow", do_borrow, icon=ft.Icons.CHECK),
+                styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ),
+        )
+        return view
+
+    go_borrow = view_route(build_borrow)
+
+    @timed_view
+    async def go_my_books(e=None):
+        #loan _id -> (row, loan, checkbox) for every row currently in the list
+        rows = {}
+
+        def loan_row(item):
+            remaining = circulation.due_date_of(item) - datetime.now()
+            if remaining.days > 0:
+                time_text = f"{remaining.days} days left"
+                time_color = SUCCESS
+            else:
+                time_text = "EXPIRED"
+                time_color = ERROR
+
+            b_name = item.name
+            b_author = item.author
+
+            def make_return(loan_id=item.id):
+                async def do_return(_):
+                    await return_rows([loan_id])
+                return do_return
+
+            checkbox = ft.Checkbox(value=False, fill_color=PRIMARY, on_change=update_selection)
+            row = ft.Container(
+                content=ft.Row(
+                    [
+                        checkbox,
+                        ft.Column(
+                            [
+                                ft.Text(b_name, size=15, weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY),
+                                ft.Text(f"by {b_author}", size=12, color=TEXT_SECONDARY),
+                                ft.Text(time_text, size=12, color=time_color, weight=ft.FontWeight.W_600),
+                            ],
+                            spacing=2,
+                            expand=True,
+                        ),
+                        ft.IconButton(
+                            icon=ft.Icons.KEYBOARD_RETURN_ROUNDED,
+                            icon_color=SUCCESS,
+                            tooltip="Return Book",
+                            on_click=make_return(),
+                        ),
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                ),
+                bgcolor=SURFACE_LIGHT,
+                border_radius=12,
+                padding=ft.padding.symmetric(horizontal=16, vertical=12),
+                width=340,
+                animate_opacity=ft.Animation(FADE_DURATION, ft.AnimationCurve.EASE_IN),
+                data=item,
+            )
+            rows[item.id] = (row, item, checkbox)
+            return row
+
+        def selected_ids():
+            return [loan_id for loan_id, (_, _, checkbox) in rows.items() if checkbox.value]
+
+        def update_selection(_=None):
+            count = len(selected_ids())
+            return_selected_button.disabled = count == 0
+            return_selected_button.content.controls[1].value = f"Return Selected ({count})" if count else "Return Selected"
+            refresh(return_selected_button)
+
+        def set_count(count):
+            state["count"] = max(0, count)
+            header.controls[1].value = f"{state['count']} book(s) on loan"
+            refresh(header)
+
+        @metrics.instrument("action.return")
+        async def return_rows(loan_ids, return_everything=False):
+            entries = [rows.pop(loan_id) for loan_id in loan_ids if loan_id in rows]
+            if not entries and not return_everything:
+                return
+
+            #Optimistic: the rows go away now and come back only if the write fails
+            for row, _, _ in entries:
+                books_list.controls.remove(row)
+            before = state["count"]
+            set_count(0 if return_everything else before - len(entries))
+            refresh(books_list)
+            update_selection()
+
+            try:
+                if return_everything:
+                    returned = await outbox.return_all(session.username)
+                else:
+                    returned = await outbox.return_loans(
+                        session.username, [item for _, item, _ in entries]
+                    )
+            except Exception as ex:
+                for row, item, checkbox in entries:
+                    rows[item.id] = (row, item, checkbox)
+                    books_list.controls.append(row)
+                #The "no books" placeholder has no loan behind it and goes now that rows are back
+                books_list.controls[:] = sorted(
+                    (c for c in books_list.controls if c.data is not None), key=lambda c: (c.data.date, c.data.id)
+                )
+                set_count(before)
+                refresh(books_list)
+                update_selection()
+                show_snack(f"Database error: {ex}", ERROR)
+                return
+
+            if returned == outbox.QUEUED:
+                #Reloading now would bring the rows back until the queue reaches the database
+                show_snack("Saved offline — the return will be recorded once the database is reachable.", WARNING)
+                return
+            if not books_list.controls:
+                await load_more()
+            if not returned:
+                #Another tab or a queued return got there first; the rows were already out of date
+                show_snack("Already returned.", WARNING)
+            elif len(returned) == 1:
+                show_snack(f"'{returned[0]['name']}' returned successfully!")
+            else:
+                show_snack(f"{len(returned)} books returned successfully!")
+
+        async def do_return_selected(_):
+            await return_rows(selected_ids())
+
+        async def do_return_all(_):
+            if state["count"] == 0:
+                show_snack("You have no borrowed books.", WARNING)
+                return
+            await return_rows(list(rows), return_everything=True)
+
+        async def fetch_page(cursor):
+            return await circulation.loans_page(session.username, cursor)
+
+        books_list, load_more = paged_list(
+            fetch_page,
+            loan_row,
+            ft.Text("You have no borrowed books.", color=TEXT_SECONDARY, size=14),
+        )
+        return_selected_button = styled_button(
+            "Return Selected", do_return_selected, icon=ft.Icons.KEYBOARD_RETURN_ROUNDED, width=170
+        )
+        return_selected_button.disabled = True
+        loan_count, _ = await asyncio.gather(
+            circulation.count_loans(session.username),
+            load_more(update=False),
+        )
+        state = {"count": loan_count}
+        header = page_title("My Borrowed Books", f"{loan_count} book(s) on loan")
+
+        view = animated_view(
+            ft.Container(height=30),
+            ft.Icon(ft.Icons.LIST_ALT_ROUNDED, size=56, color=PRIMARY),
+            header,
+            ft.Container(height=10),
+            ft.Row(
+                [
+                    return_selected_button,
+                    styled_button("Return All", do_return_all, bgcolor=WARNING, icon=ft.Icons.DONE_ALL, width=170),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+            ),
+            card_container(books_list, width=380),
+            ft.Container(height=10),
+            styled_button("Back", go_library_panel, bgcolor=SURFACE_LIGHT, icon=ft.Icons.ARROW_BACK),
+            ft.Container(height=20),
+        )
+        show_view(view)
+
+    async def check_setup():
+        connect_started = time.perf_counter()
+        try:
+            exists = await startup.once("admin_exists", lambda: startup.admin_exists(admin_col))
+        except Exception as ex:
+            show_snack(f"Cannot reach the database: {ex}", ERROR)
+            return
+        if not exists:
+            #Checked again by the next session, which may open after setup was finished here
+            startup.forget("admin_exists")
+        startup.mark("connect", since=connect_started)
+        startup.log_summary()
+        if exists == cached_setup:
+            return
+        startup.remember_setup(exists)
+        #The cache was wrong or missing; only correct the screen if nobody has moved on from the first one
+        if page.controls and page.controls[0] is first_view:
+            if exists:
+                go_main_menu()
+            else:
+                go_initial_setup()
+
+    async def bootstrap_indexes():
+        await startup.once("bootstrap", bootstrap_database)
+
+    async def load_catalog():
+        await startup.once("catalog", load_catalog_once)
+
+    #The first screen comes from the setup state this machine saw last time, before any database round
+    #trip; the setup check runs behind it and corrects the screen if the database says otherwise
+    cached_setup = startup.setup_done_cached()
+    if cached_setup is False:
+        go_initial_setup()
+    else:
+        go_main_menu()
+    first_view = page.controls[0]
+    startup.mark("first_paint")
+    outbox.queue.start()
+    analytics.start_rebuilds()
+    outbox.queue.listeners.append(update_sync_status)
+    update_sync_status()
+
+    live_stock.broker.subscribe(on_stock_change)
+
+    def on_session_close(_):
+        sessions.close_session(session)
+        live_stock.broker.unsubscribe(on_stock_change)
+        if update_sync_status in outbox.queue.listeners:
+            outbox.queue.listeners.remove(update_sync_status)
+
+    page.on_close = on_session_close
+    page.run_task(check_setup)
+    page.run_task(bootstrap_indexes)
+    page.run_task(load_catalog)
+
+
+if WEB_PORT:
+    #Server mode: every browser tab gets its own session; all share the db pool and caches
+    ft.run(main, view=ft.AppView.WEB_BROWSER, host=WEB_HOST, port=int(WEB_PORT))
+else:
+    ft.run(main)
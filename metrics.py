@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+#Samples kept per timing for percentiles; older ones are dropped
+MAX_SAMPLES = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+#Off by default: every recording call returns straight away until it is switched on
+enabled = os.getenv("METRICS", "0").lower() in ("1", "true", "yes", "on")
+#pymongo fixes a client's listeners when it is created, so CommandMetrics is only attached to clients made
+#while collection is on; this records whether the app's client has it
+commands_tracked = False
+
+_lock = threading.Lock()
+counters = defaultdict(int)
+timings = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+#name -> [count, total ms] over all samples, including those dropped from the window
+_totals = defaultdict(lambda: [0, 0.0])
+
+#name -> callable returning a dict of current values (cache sizes, hit rates, staleness), read on every snapshot
+_gauges = {}
+
+#The user action being handled; counters recorded inside it are also attributed to it
+_action = contextvars.ContextVar("metrics_action", default=None)
+
+
+def set_enabled(on):
+    global enabled
+    enabled = bool(on)
+
+
+def gauge(name, read):
+    #Reported whether or not collection is on: reading them costs nothing until a snapshot is taken
+    _gauges[name] = read
+
+
+def incr(name, amount=1):
+    if not enabled:
+        return
+    action = _action.get()
+    with _lock:
+        counters[name] += amount
+        if action is not None:
+            counters[f"{action}.{name}"] += amount
+
+
+def observe(name, ms):
+    if not enabled:
+        return
+    with _lock:
+        timings[name].append(ms)
+        total = _totals[name]
+        total[0] += 1
+        total[1] += ms
+
+
+@contextmanager
+def timed(name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+
+
+@contextmanager
+def action(name):
+    if not enabled:
+        yield
+        return
+    token = _action.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+        _action.reset(token)
+
+
+def instrument(name):
+    """Decorator for UI handlers, sync or async: times each call as action `name`."""
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not enabled:
+                    return await fn(*args, **kwargs)
+                with action(name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not enabled:
+                    return fn(*args, **kwargs)
+                with action(name):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Counts database round trips and bytes on the wire, per action when one is active."""
+
+    def started(self, event):
+        if enabled:
+            incr("db.bytes_sent", len(bson.encode(event.command)))
+
+    def succeeded(self, event):
+        if enabled:
+            incr("db.round_trips")
+            incr("db.bytes_received", len(bson.encode(event.reply)))
+            observe(f"db.{event.command_name}", event.duration_micros / 1000)
+
+    def failed(self, event):
+        if enabled:
+            incr("db.round_trips")
+            incr("db.errors")
+
+
+def percentile(sorted_samples, q):
+    #Nearest-rank on an already sorted list
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[max(0, math.ceil(q * len(sorted_samples)) - 1)]
+
+
+def snapshot():
+    with _lock:
+        samples = {name: sorted(window) for name, window in timings.items() if window}
+        totals = {name: list(total) for name, total in _totals.items()}
+        counts = dict(counters)
+    return {
+        "enabled": enabled,
+        "counters": counts,
+        "gauges": {name: read() for name, read in sorted(_gauges.items())},
+        "timings": {
+            name: {
+                "count": totals[name][0],
+                "mean_ms": totals[name][1] / totals[name][0],
+                **{f"p{round(q * 100)}_ms": percentile(window, q) for q in QUANTILES},
+            }
+            for name, window in samples.items()
+        },
+    }
+
+
+def to_json(snap=None):
+    return json.dumps(snap or snapshot(), indent=2, sort_keys=True)
+
+
+def _label(name):
+    return name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(snap=None):
+    snap = snap or snapshot()
+    lines = [
+        "# HELP library_latency_ms Handler and database latency in milliseconds.",
+        "# TYPE library_latency_ms summary",
+    ]
+    for name, stats in sorted(snap["timings"].items()):
+        for q in QUANTILES:
+            lines.append(f'library_latency_ms{{name="{_label(name)}",quantile="{q}"}} {stats[f"p{round(q * 100)}_ms"]:.3f}')
+        lines.append(f'library_latency_ms_sum{{name="{_label(name)}"}} {stats["mean_ms"] * stats["count"]:.3f}')
+        lines.append(f'library_latency_ms_count{{name="{_label(name)}"}} {stats["count"]}')
+    lines += [
+        "# HELP library_events_total Counted events: database round trips, bytes, UI updates.",
+        "# TYPE library_events_total counter",
+    ]
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f'library_events_total{{name="{_label(name)}"}} {value}')
+    lines += [
+        "# HELP library_cache Cache state: size, hits, misses, hit rate and staleness in seconds.",
+        "# TYPE library_cache gauge",
+    ]
+    for name, values in sorted(snap.get("gauges", {}).items()):
+        for stat, value in sorted(values.items()):
+            #Text values such as the feed mode, and staleness before the first sync, have no sample
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'library_cache{{name="{_label(name)}",stat="{_label(stat)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        counters.clear()
+        timings.clear()
+        _totals.clear()
@@ -0,0 +1,74 @@
+"""Compact read-only records for query results.
+
+Each record type names the fields it needs (FIELDS, the projection its
+queries send) and is built straight from the cursor, one document at a time,
+by AsyncCollection.find_records (or stream_records for whole-collection
+reads). A record is a tuple: about a third of the
+memory of the dict it replaces, with attribute access instead of ``.get()``.
+"""
+from collections import namedtuple
+
+
+class Book(namedtuple("Book", "id name author number")):
+    __slots__ = ()
+    FIELDS = {"_id": 1, "name": 1, "author": 1, "number": 1}
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(doc.get("_id"), doc.get("name", ""), doc.get("author", ""), doc.get("number", 0))
+
+
+class Loan(namedtuple("Loan", "id username name author book_id date due_date overdue_days")):
+    __slots__ = ()
+    FIELDS = {"username": 1, "name": 1, "author": 1, "book_id": 1, "date": 1, "due_date": 1}
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(
+            doc.get("_id"),
+            doc.get("username", ""),
+            doc.get("name", ""),
+            doc.get("author", ""),
+            doc.get("book_id"),
+            doc.get("date"),
+            doc.get("due_date"),
+            doc.get("overdue_days"),
+        )
+
+    def to_doc(self):
+        #What return_loans, the offline queue and the history archive need; loans from before
+        #book_id or due_date leave them out
+        doc = {"_id": self.id, "name": self.name, "author": self.author}
+        if self.book_id is not None:
+            doc["book_id"] = self.book_id
+        if self.date is not None:
+            doc["date"] = self.date
+        if self.due_date is not None:
+            doc["due_date"] = self.due_date
+        return doc
+
+
+class PastLoan(namedtuple("PastLoan", "id username name author date due_date returned_at")):
+    __slots__ = ()
+    FIELDS = {"username": 1, "name": 1, "author": 1, "date": 1, "due_date": 1, "returned_at": 1}
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(
+            doc.get("_id"),
+            doc.get("username", ""),
+            doc.get("name", ""),
+            doc.get("author", ""),
+            doc.get("date"),
+            doc.get("due_date"),
+            doc.get("returned_at"),
+        )
+
+
+class Account(namedtuple("Account", "id password role")):
+    __slots__ = ()
+    FIELDS = {"password": 1}
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(doc.get("_id"), doc.get("password", ""), doc.get("role"))
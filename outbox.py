@@ -0,0 +1,409 @@
+"""Durable local queue for borrow, return and add-copies operations.
+
+While the database is reachable and nothing is waiting, an operation is applied
+straight away by the session that made it. If the database is unreachable,
+does not answer within OUTBOX_WAIT, or operations are already waiting, it is
+written to a SQLite file instead and replayed to MongoDB by a background task,
+in order and in batches, and the caller gets QUEUED so the desk keeps working.
+A queued borrow that finds no stock on replay is kept as a conflict for an
+admin to resolve.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from bson import ObjectId, json_util
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+
+import circulation
+import inventory
+from db import borrows_col
+
+log = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(os.path.expanduser("~"), ".library_manager", "outbox.sqlite3"))
+#How long the UI waits for the database before reporting an operation as queued
+OUTBOX_WAIT = float(os.getenv("OUTBOX_WAIT", "1.5"))
+OUTBOX_BATCH = 100
+SYNC_INTERVAL = 2.0
+MAX_BACKOFF = 30.0
+#Attempts before an operation that keeps failing (for reasons other than being offline) is parked
+MAX_ATTEMPTS = 5
+
+BORROW = "borrow"
+RETURN = "return"
+RETURN_ALL = "return_all"
+ADD = "add"
+
+QUEUED = "queued"
+ADDED = "added"
+
+PENDING = "pending"
+CONFLICT = "conflict"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ops_state_id ON ops (state, id);
+"""
+
+
+class Outbox:
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        self.online = True
+        self.last_sync = None
+        self.last_error = None
+        #Called on the event loop with stats() when the queue depth, conflicts or online state change,
+        #e.g. to refresh an admin status line
+        self.listeners = []
+        self._conn = None
+        #The SQLite connection lives on this thread, so no query or commit ever runs on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        #Pending operations, as counted by the last write; None until the file has been read
+        self._pending = None
+        self._oldest = None
+        self._conflicts = []
+        self._conflict_count = 0
+        self._dirty = True
+        self._notified = None
+        self._waiters = {}
+        self._wake = None
+        self._task = None
+
+    def _db(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            #Autocommit; multi-row changes go through _write_many in one transaction
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _sql(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def enqueue(self, kind, payload):
+        op_id, self._pending = await self._sql(self._insert, kind, json_util.dumps(payload))
+        self._dirty = True
+        if self._wake is not None and self.online:
+            self._wake.set()
+        return op_id
+
+    async def submit(self, kind, payload, wait=OUTBOX_WAIT):
+        if self._task is not None and self.online and self._pending == 0:
+            #Nothing queued ahead of it, so it cannot overtake an earlier operation; sessions apply their own
+            #operations concurrently instead of waiting in line behind the replay task
+            applying = asyncio.ensure_future(_apply_one(kind, payload))
+            try:
+                return await asyncio.wait_for(asyncio.shield(applying), wait)
+            except asyncio.TimeoutError:
+                #It may still go through; every kind of operation is safe to apply twice, so it is queued as well
+                applying.add_done_callback(_log_late_failure)
+            except ConnectionFailure as ex:
+                log.warning("Database unreachable, queueing writes locally: %s", ex)
+                self.online = False
+            except Exception as ex:
+                log.warning("Applying %s failed, queueing it for retry: %s", kind, ex)
+            await self.enqueue(kind, payload)
+            await self.refresh()
+            return QUEUED
+        op_id = await self.enqueue(kind, payload)
+        if self._task is None or not self.online:
+            await self.refresh()
+            return QUEUED
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[op_id] = future
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            return QUEUED
+        finally:
+            self._waiters.pop(op_id, None)
+
+    def stats(self):
+        #As of the last refresh; reading it never touches the file
+        return {
+            "depth": self._pending or 0,
+            "oldest": self._oldest,
+            "lag_s": time.time() - self._oldest if self._oldest else 0.0,
+            "conflicts": self._conflict_count,
+            "online": self.online,
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+        }
+
+    def conflicts(self):
+        return list(self._conflicts)
+
+    async def dismiss_conflicts(self):
+        await self._sql(self._delete_conflicts)
+        await self.refresh()
+
+    async def refresh(self):
+        """Rereads the queue's stats and tells the listeners if the depth, conflicts or online state changed."""
+        self._pending, self._oldest, self._conflict_count, self._conflicts = await self._sql(self._read_stats)
+        self._dirty = False
+        state = (self._pending, self._conflict_count, self.online)
+        if state == self._notified:
+            return
+        self._notified = state
+        stats = self.stats()
+        for listener in list(self.listeners):
+            try:
+                listener(stats)
+            except Exception:
+                log.exception("Outbox listener failed; removing it")
+                self.listeners.remove(listener)
+
+    async def _run(self):
+        delay = SYNC_INTERVAL
+        await self.refresh()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            was_online = self.online
+            if self._pending:
+                try:
+                    await self.flush()
+                except ConnectionFailure as ex:
+                    if self.online:
+                        log.warning("Database unreachable, queueing writes locally: %s", ex)
+                    self.online = False
+                    self.last_error = str(ex)
+                    delay = min(delay * 2, MAX_BACKOFF)
+                else:
+                    self.online = True
+                    self.last_error = None
+                    self.last_sync = time.time()
+                    delay = SYNC_INTERVAL
+            if self._dirty or self.online != was_online:
+                await self.refresh()
+
+    async def flush(self):
+        """Replays pending operations until the queue is empty or an operation must be retried later."""
+        while True:
+            batch = await self._sql(self._claim, OUTBOX_BATCH)
+            if not batch:
+                return
+            start = 0
+            while start < len(batch):
+                #Runs of the same kind share one round trip where the operation allows it
+                end = start
+                while end < len(batch) and batch[end][1] == batch[start][1]:
+                    end += 1
+                if not await self._apply(batch[start][1], batch[start:end]):
+                    return
+                start = end
+
+    async def _apply(self, kind, ops):
+        try:
+            if kind == ADD:
+                await self._apply_adds(ops)
+            elif kind == RETURN:
+                await self._apply_returns(ops)
+            elif kind == RETURN_ALL:
+                for op_id, _, payload, _ in ops:
+                    await self._done([op_id], await _apply_one(kind, payload))
+            else:
+                for op in ops:
+                    await self._apply_borrow(op)
+        except ConnectionFailure:
+            raise
+        except Exception as ex:
+            #Anything but being offline: retried a few times, then parked with its error
+            log.warning("Replaying %s failed: %s", kind, ex)
+            self.last_error = str(ex)
+            await self._park([op for op in ops if op[3] >= MAX_ATTEMPTS], str(ex))
+            return False
+        return True
+
+    async def _apply_adds(self, ops):
+        #Adds queued before they carried a token get one now, so they are at worst applied as before
+        await inventory.add_copies_once([
+            (payload.get("token") or ObjectId(), payload["name"], payload["author"], payload["number"])
+            for _, _, payload, _ in ops
+        ])
+        await self._done([op[0] for op in ops], ADDED)
+
+    async def _apply_returns(self, ops):
+        by_user = {}
+        for op in ops:
+            by_user.setdefault(op[2]["username"], []).append(op)
+        for username, user_ops in by_user.items():
+            loans = [loan for op in user_ops for loan in op[2]["loans"]]
+            returned = {loan["_id"] for loan in await circulation.return_loans(username, loans)}
+            for op in user_ops:
+                await self._done([op[0]], [loan for loan in op[2]["loans"] if loan["_id"] in returned])
+
+    async def _apply_borrow(self, op):
+        op_id, _, payload, attempts = op
+        if attempts > 1 and await borrows_col.find_one({"_id": payload["loan_id"]}, {"_id": 1}):
+            #An earlier attempt got through before the app stopped
+            await self._done([op_id], circulation.BORROWED)
+            return
+        result = await _apply_one(BORROW, payload)
+        if result == circulation.BORROWED or self._resolve(op_id, result):
+            #Either it went through, or the patron is still at the desk and sees the answer
+            await self._done([op_id], result)
+        else:
+            reason = "no copies left" if result == circulation.OUT_OF_STOCK else "title not found"
+            await self._park([op], f"{payload['username']} borrowed '{payload['name']}' offline, but {reason}")
+
+    def _resolve(self, op_id, outcome):
+        future = self._waiters.pop(op_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(outcome)
+        return True
+
+    async def _done(self, op_ids, outcome):
+        self._pending = await self._sql(self._write_many, "DELETE FROM ops WHERE id = ?", [(op_id,) for op_id in op_ids])
+        self._dirty = True
+        for op_id in op_ids:
+            self._resolve(op_id, outcome)
+
+    async def _park(self, ops, reason):
+        self._pending = await self._sql(
+            self._write_many,
+            "UPDATE ops SET state = ?, error = ? WHERE id = ?",
+            [(CONFLICT, reason, op[0]) for op in ops],
+        )
+        self._dirty = True
+        for op in ops:
+            self._resolve(op[0], QUEUED)
+
+    #Everything below runs on the outbox thread
+
+    def _count_pending(self):
+        return self._db().execute("SELECT COUNT(*) FROM ops WHERE state = ?", (PENDING,)).fetchone()[0]
+
+    def _insert(self, kind, payload):
+        cursor = self._db().execute(
+            "INSERT INTO ops (kind, payload, created) VALUES (?, ?, ?)",
+            (kind, payload, time.time()),
+        )
+        return cursor.lastrowid, self._count_pending()
+
+    def _write_many(self, sql, rows):
+        #Returns the pending count after the write
+        conn = self._db()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return self._count_pending()
+
+    def _claim(self, limit):
+        rows = self._db().execute(
+            "SELECT id, kind, payload, attempts FROM ops WHERE state = ? ORDER BY id LIMIT ?",
+            (PENDING, limit),
+        ).fetchall()
+        #Counted before replaying, so a crash mid-replay is known to have maybe applied it
+        self._write_many("UPDATE ops SET attempts = attempts + 1 WHERE id = ?", [(row[0],) for row in rows])
+        return [(op_id, kind, json_util.loads(payload), attempts + 1) for op_id, kind, payload, attempts in rows]
+
+    def _read_stats(self, conflicts_shown=20):
+        conn = self._db()
+        pending, oldest = conn.execute("SELECT COUNT(*), MIN(created) FROM ops WHERE state = ?", (PENDING,)).fetchone()
+        conflict_count = conn.execute("SELECT COUNT(*) FROM ops WHERE state = ?", (CONFLICT,)).fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, kind, payload, created, error FROM ops WHERE state = ? ORDER BY id LIMIT ?",
+            (CONFLICT, conflicts_shown),
+        ).fetchall() if conflict_count else []
+        conflicts = [
+            {"id": op_id, "kind": kind, "payload": json_util.loads(payload), "created": datetime.fromtimestamp(created), "error": error}
+            for op_id, kind, payload, created, error in rows
+        ]
+        return pending, oldest, conflict_count, conflicts
+
+    def _delete_conflicts(self):
+        self._db().execute("DELETE FROM ops WHERE state = ?", (CONFLICT,))
+
+
+async def _apply_one(kind, payload):
+    if kind == ADD:
+        await inventory.add_copies_once([(payload["token"], payload["name"], payload["author"], payload["number"])])
+        return ADDED
+    if kind == RETURN:
+        return await circulation.return_loans(payload["username"], payload["loans"])
+    if kind == RETURN_ALL:
+        return await circulation.return_all(payload["username"], borrowed_before=payload["date"])
+    try:
+        return await circulation.borrow_book(
+            payload["username"], payload["name"], payload["author"],
+            borrowed_at=payload["date"], loan_id=payload["loan_id"],
+        )
+    except DuplicateKeyError:
+        #The loan_id is already recorded: an earlier attempt got through
+        return circulation.BORROWED
+
+
+def _log_late_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.warning("An operation that timed out failed; its queued copy will retry it: %s", task.exception())
+
+
+#Shared by every session in this process
+queue = Outbox()
+
+
+async def borrow(username, name, author):
+    """BORROWED, OUT_OF_STOCK, NOT_FOUND, or QUEUED when the database did not answer in time."""
+    return await queue.submit(BORROW, {
+        "username": username,
+        "name": name,
+        "author": author,
+        "date": datetime.now(),
+        "loan_id": ObjectId(),
+    })
+
+
+async def return_loans(username, loans):
+    """loans: models.Loan records. The loans that were returned (as documents), or QUEUED."""
+    return await queue.submit(RETURN, {
+        "username": username,
+        "loans": [loan.to_doc() for loan in loans],
+    })
+
+
+async def return_all(username):
+    """Every loan the patron has out at the time of the call (as documents), or QUEUED."""
+    return await queue.submit(RETURN_ALL, {"username": username, "date": datetime.now()})
+
+
+async def add_copies(name, author, number):
+    """ADDED, or QUEUED."""
+    #The token makes the replay idempotent (see inventory.add_copies_once)
+    return await queue.submit(ADD, {"name": name, "author": author, "number": number, "token": ObjectId()})
@@ -0,0 +1,162 @@
+"""Bulk patron accounts from CSV or JSON Lines, e.g. a whole term's enrolment list.
+
+    python provisioning.py patrons.csv [--batch-size 1000] [--rejects conflicts.jsonl]
+
+Rows need ``username`` and ``password`` (same rules as the register screen).
+Each batch is one unordered insert, so a taken name only rejects its own row;
+rows whose name is taken or reserved for an admin are reported with the line
+they came from.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from pymongo.errors import BulkWriteError
+
+import accounts
+import indexes
+from db import get_db, run_sync, userinfo_col
+from importer import read_rows
+
+BATCH_SIZE = 1000
+#Bad rows kept with their reason; any beyond this are only counted
+MAX_BAD_ROWS = 1000
+DUPLICATE_KEY = 11000
+
+
+class ProvisionReport:
+    def __init__(self, total_bytes=None):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows = 0
+        self.created = 0
+        self.conflicts = 0
+        self.bad_count = 0
+        self.bad_rows = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, line_no, reason, raw):
+        self.bad_count += 1
+        if len(self.bad_rows) < MAX_BAD_ROWS:
+            self.bad_rows.append({"line": line_no, "reason": reason, "row": raw})
+
+    def summary(self):
+        return (
+            f"{self.rows} rows, {self.created} accounts created, {self.conflicts} names taken, "
+            f"{self.bad_count - self.conflicts} invalid in {self.elapsed:.1f}s ({self.rows_per_sec:.0f} rows/s)"
+        )
+
+
+def parse_patron(row):
+    username = str(row.get("username") or "").strip()
+    password = str(row.get("password") or "")
+    if not username:
+        raise ValueError("username is required")
+    if "\ufffd" in username:
+        raise ValueError("text is not valid UTF-8")
+    if not accounts.password_ok(password):
+        raise ValueError("password must be 8+ chars with letters and numbers")
+    return username, password
+
+
+async def _flush(batch, users, report):
+    #batch: [(line number, username, password)]; hashing fans out over the hash pool
+    hashes = await asyncio.gather(*(accounts.hash_password(password) for _, _, password in batch))
+    docs = [{"username": username, "password": hashed} for (_, username, _), hashed in zip(batch, hashes)]
+    failed = {}
+    try:
+        await users.insert_many(docs, ordered=False)
+    except BulkWriteError as ex:
+        errors = ex.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        failed = {error["index"]: batch[error["index"]] for error in errors}
+    if failed:
+        reasons = await accounts.taken_or_reserved({username for _, username, _ in failed.values()}, users)
+        for line_no, username, _ in failed.values():
+            message = "reserved for an admin" if reasons[username] == accounts.RESERVED else "username already exists"
+            report.conflicts += 1
+            report.reject(line_no, message, {"username": username})
+    report.created += len(batch) - len(failed)
+    batch.clear()
+
+
+async def provision(path, users=userinfo_col, batch_size=BATCH_SIZE, on_progress=None):
+    report = ProvisionReport(None if path.endswith(".gz") else os.path.getsize(path))
+    batch = []
+    seen = set()
+    for line_no, row in read_rows(path, report):
+        if isinstance(row, str):
+            report.reject(line_no, row, None)
+            continue
+        try:
+            username, password = parse_patron(row)
+        except ValueError as ex:
+            #Passwords never reach the rejects file
+            report.reject(line_no, str(ex), {"username": row.get("username")})
+            continue
+        report.rows += 1
+        if username in seen:
+            report.reject(line_no, "username appears earlier in the file", {"username": username})
+            continue
+        seen.add(username)
+        batch.append((line_no, username, password))
+        if len(batch) >= batch_size:
+            await _flush(batch, users, report)
+            report.elapsed = time.perf_counter() - report.started
+            if on_progress:
+                on_progress(report)
+    if batch:
+        await _flush(batch, users, report)
+    report.elapsed = time.perf_counter() - report.started
+    if on_progress:
+        on_progress(report)
+    return report
+
+
+async def run_cli(args):
+    def on_progress(report):
+        print(f"\r{report.summary()}", end="", flush=True)
+
+    #Taken names are only caught by the unique username index, so it must be in place first
+    index_report = await run_sync(indexes.bootstrap, get_db())
+    if not indexes.unique_confirmed(accounts.USERNAME_INDEX):
+        for message in index_report.diagnostics:
+            print(message)
+        print(f"The unique {accounts.USERNAME_INDEX} index is missing; no accounts were created.")
+        return 1
+
+    report = await provision(args.path, batch_size=args.batch_size, on_progress=on_progress)
+    print()
+    if report.bad_rows:
+        if args.rejects:
+            with open(args.rejects, "w", encoding="utf-8") as f:
+                for bad in report.bad_rows:
+                    f.write(json.dumps(bad, default=str) + "\n")
+            print(f"{report.bad_count} row(s) not created; first {len(report.bad_rows)} written to {args.rejects}")
+        else:
+            for bad in report.bad_rows[:20]:
+                print(f"  line {bad['line']}: {bad['row'] and bad['row'].get('username')}: {bad['reason']}")
+            if report.bad_count > 20:
+                print(f"  ... {report.bad_count - 20} more (use --rejects to save them)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rejects", help="write rows that were not created to this JSONL file")
+    return asyncio.run(run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+import bisect
+import heapq
+import os
+import re
+import unicodedata
+from operator import itemgetter
+
+import metrics
+from cache import TTLCache
+from models import Book
+
+_TOKEN_RE = re.compile(r"\w+")
+
+#Match weights: a whole token beats a prefix, which beats a one-typo match
+EXACT = 3.0
+PREFIX = 2.0
+FUZZY = 1.0
+#Hits in the title count for more than hits in the author name
+TITLE_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.6
+#Whole query found inside the title
+PHRASE_BONUS = 2.0
+TITLE_EQUAL_BONUS = 3.0
+
+FUZZY_MIN_LEN = 4
+MAX_PREFIX_EXPANSIONS = 256
+MAX_RANKED = 1000
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def within_one_edit(a, b):
+    #Damerau distance <= 1: one substitution, insertion, deletion or adjacent swap
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (
+            len(diff) == 2
+            and diff[1] == diff[0] + 1
+            and a[diff[0]] == b[diff[1]]
+            and a[diff[1]] == b[diff[0]]
+        )
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """In-process inverted index over book titles and authors."""
+
+    def __init__(self):
+        self.ready = False
+        #Bumped on every change so cached results from an older catalog are never served
+        self.version = 0
+        #Called with (name, author, number) after a title's stock changes; number is None once it is removed
+        self.on_stock_change = None
+        self._reset()
+
+    def _reset(self):
+        self._next_id = 0
+        self._ids = {}
+        self._docs = {}
+        self._title = {}
+        self._author = {}
+        self._vocab = []
+        self._variants = {}
+        self._exact_titles = {}
+        #Mongo _id -> doc id, so change events that only carry an _id can be applied
+        self._oids = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def load(self, books):
+        #books: models.Book records
+        self._reset()
+        for book in books:
+            self._index(book.name, book.author, book.number, book.id, new_tokens=None)
+        self._vocab = sorted(set(self._title) | set(self._author))
+        for token in self._vocab:
+            self._add_variants(token)
+        self.ready = True
+        self.version += 1
+
+    def add(self, book):
+        self.version += 1
+        key = (book.get("name", ""), book.get("author", ""))
+        if key in self._ids:
+            self.set_stock(key[0], key[1], book.get("number", 0), book.get("updated_at"))
+            if book.get("_id") is not None:
+                self._oids[book["_id"]] = self._ids[key]
+            return
+        new_tokens = []
+        self._index(key[0], key[1], book.get("number", 0), book.get("_id"), new_tokens, book.get("updated_at"))
+        for token in new_tokens:
+            bisect.insort(self._vocab, token)
+            self._add_variants(token)
+        self._stock_changed(key[0], key[1], book.get("number", 0))
+
+    def remove(self, name, author):
+        self.version += 1
+        doc_id = self._ids.pop((name, author), None)
+        if doc_id is None:
+            return False
+        doc = self._docs.pop(doc_id)
+        if doc[4] is not None:
+            self._oids.pop(doc[4], None)
+        same_title = self._exact_titles.get(doc[3])
+        if same_title is not None:
+            same_title.discard(doc_id)
+            if not same_title:
+                del self._exact_titles[doc[3]]
+        for postings, text in ((self._title, doc[0]), (self._author, doc[1])):
+            for token in set(tokenize(text)):
+                ids = postings.get(token)
+                if ids is None:
+                    continue
+                ids.discard(doc_id)
+                if not ids:
+                    del postings[token]
+                    if token not in self._title and token not in self._author:
+                        self._drop_token(token)
+        self._stock_changed(name, author, None)
+        return True
+
+    def remove_by_id(self, oid):
+        doc_id = self._oids.get(oid)
+        if doc_id is None:
+            return False
+        doc = self._docs[doc_id]
+        return self.remove(doc[0], doc[1])
+
+    def key_of(self, oid):
+        doc_id = self._oids.get(oid)
+        if doc_id is None:
+            return None
+        return self._docs[doc_id][0], self._docs[doc_id][1]
+
+    def oids(self):
+        return set(self._oids)
+
+    def stock_of(self, name, author):
+        doc_id = self._ids.get((name, author))
+        return None if doc_id is None else self._docs[doc_id][2]
+
+    def set_stock(self, name, author, number, as_of=None):
+        #Stock is only ever set to a count read from the database. as_of is that document's updated_at:
+        #a count older than the one held (a write path and the catalog feed racing) is ignored
+        self.version += 1
+        doc_id = self._ids.get((name, author))
+        if doc_id is None:
+            return
+        doc = self._docs[doc_id]
+        if as_of is not None:
+            if doc[5] is not None and as_of < doc[5]:
+                return
+            doc[5] = as_of
+        if doc[2] != number:
+            doc[2] = number
+            self._stock_changed(name, author, number)
+
+    def _stock_changed(self, name, author, number):
+        if self.on_stock_change is not None:
+            self.on_stock_change(name, author, number)
+
+    def _index(self, name, author, number, oid, new_tokens, as_of=None):
+        doc_id = self._next_id
+        self._next_id += 1
+        self._ids[(name, author)] = doc_id
+        title = " ".join(tokenize(name))
+        #[name, author, stock, normalized title, Mongo _id, updated_at of the stock]
+        self._docs[doc_id] = [name, author, number, title, oid, as_of]
+        if oid is not None:
+            self._oids[oid] = doc_id
+        self._exact_titles.setdefault(title, set()).add(doc_id)
+        for postings, text in ((self._title, name), (self._author, author)):
+            for token in set(tokenize(text)):
+                ids = postings.get(token)
+                if ids is None:
+                    if new_tokens is not None and token not in self._title and token not in self._author:
+                        new_tokens.append(token)
+                    ids = postings[token] = set()
+                ids.add(doc_id)
+
+    def _add_variants(self, token):
+        if len(token) < FUZZY_MIN_LEN:
+            return
+        for variant in _deletes(token) | {token}:
+            self._variants.setdefault(variant, set()).add(token)
+
+    def _drop_token(self, token):
+        i = bisect.bisect_left(self._vocab, token)
+        if i < len(self._vocab) and self._vocab[i] == token:
+            del self._vocab[i]
+        if len(token) < FUZZY_MIN_LEN:
+            return
+        for variant in _deletes(token) | {token}:
+            tokens = self._variants.get(variant)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._variants[variant]
+
+    def _expand(self, token):
+        #Yield (vocab token, match weight) for every way the query token can match
+        yield token, EXACT
+        i = bisect.bisect_right(self._vocab, token)
+        for candidate in self._vocab[i:i + MAX_PREFIX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            yield candidate, PREFIX
+        if len(token) >= FUZZY_MIN_LEN:
+            candidates = set()
+            for variant in _deletes(token) | {token}:
+                candidates |= self._variants.get(variant, set())
+            for candidate in candidates:
+                if candidate != token and not candidate.startswith(token) and within_one_edit(token, candidate):
+                    yield candidate, FUZZY
+
+    def _hits(self, token):
+        #(score, doc ids) for every way the token matches, best score first
+        hits = []
+        for candidate, weight in self._expand(token):
+            for postings, field_weight in ((self._title, TITLE_WEIGHT), (self._author, AUTHOR_WEIGHT)):
+                ids = postings.get(candidate)
+                if ids:
+                    hits.append((weight * field_weight, ids))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return hits
+
+    def _top_scores(self, hits):
+        #Single-token query: hits arrive best first, so stop once enough documents are scored
+        scores = {}
+        for score, ids in hits:
+            for doc_id in ids:
+                if doc_id not in scores:
+                    scores[doc_id] = score
+                    if len(scores) >= MAX_RANKED:
+                        return scores
+        return scores
+
+    def _intersect_scores(self, token_hits):
+        #Start from the rarest token and only ever look at documents still in the running
+        candidates = set().union(*(ids for _, ids in token_hits[0]))
+        totals = None
+        for hits in token_hits:
+            scores = {}
+            for score, ids in hits:
+                scores.update(dict.fromkeys((candidates & ids).difference(scores), score))
+            totals = scores if totals is None else {d: totals[d] + s for d, s in scores.items()}
+            candidates = set(totals)
+            if not candidates:
+                break
+        return totals
+
+    def search(self, query, limit=20):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        token_hits = sorted((self._hits(t) for t in tokens), key=lambda h: sum(len(ids) for _, ids in h))
+        if not token_hits[0]:
+            return []
+        if len(token_hits) == 1:
+            totals = self._top_scores(token_hits[0])
+        else:
+            totals = self._intersect_scores(token_hits)
+            #Very common terms: only the best-scoring slice gets the full ranking pass
+            if len(totals) > MAX_RANKED:
+                totals = dict(heapq.nlargest(MAX_RANKED, totals.items(), key=itemgetter(1)))
+
+        #An exact title match always makes the cut, however common its words are
+        phrase = " ".join(tokenize(query))
+        for doc_id in self._exact_titles.get(phrase, ()):
+            totals.setdefault(doc_id, EXACT * TITLE_WEIGHT * len(tokens))
+
+        ranked = []
+        for doc_id, score in totals.items():
+            doc = self._docs[doc_id]
+            if doc[3] == phrase:
+                score += TITLE_EQUAL_BONUS
+            elif phrase in doc[3]:
+                score += PHRASE_BONUS
+            ranked.append((-score, doc[2] <= 0, doc[3], doc_id))
+
+        return [
+            Book(self._docs[d][4], self._docs[d][0], self._docs[d][1], self._docs[d][2])
+            for _, _, _, d in heapq.nsmallest(limit, ranked)
+        ]
+
+
+#Shared by every session in this process
+catalog = SearchIndex()
+results_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+metrics.gauge("search_results_cache", results_cache.stats)
+
+
+async def find_books(query, books):
+    #Serve from the index when it is loaded, otherwise fall back to an exact title query on ``books``
+    key = (catalog.version, normalize(query).strip() if catalog.ready else query)
+    found = results_cache.get(key)
+    if found is None:
+        if catalog.ready:
+            found = catalog.search(query)
+        else:
+            found = await books.find_records(Book, {"name": query})
+        results_cache.put(key, found)
+    return found
@@ -0,0 +1,57 @@
+import threading
+import time
+import uuid
+
+
+class Session:
+    """Who is signed in on one window or browser tab. Never shared between sessions."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.username = ""
+        self.is_admin = False
+        self.started = time.time()
+        self.last_active = self.started
+
+    @property
+    def logged_in(self):
+        return bool(self.username)
+
+    def login(self, username, is_admin):
+        self.username = username
+        self.is_admin = is_admin
+        self.touch()
+
+    def logout(self):
+        self.username = ""
+        self.is_admin = False
+
+    def touch(self):
+        self.last_active = time.time()
+
+
+_lock = threading.Lock()
+active = {}
+
+
+def open_session():
+    session = Session()
+    with _lock:
+        active[session.id] = session
+    return session
+
+
+def close_session(session):
+    session.logout()
+    with _lock:
+        active.pop(session.id, None)
+
+
+def stats():
+    with _lock:
+        sessions = list(active.values())
+    return {
+        "sessions": len(sessions),
+        "logged_in": sum(1 for s in sessions if s.logged_in),
+        "admins": sum(1 for s in sessions if s.is_admin),
+    }
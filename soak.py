@@ -0,0 +1,146 @@
+"""Soak test for a long-running session, such as a front-desk kiosk left open all day.
+
+Drives one session through thousands of navigations and notifications and
+samples, every few hundred steps, the process RSS, the Python heap (through
+tracemalloc), the number of page overlays and live controls, and how long the
+steps took. A session that does not leak shows these levelling off after the
+first samples. The report also lists the source lines whose allocations grew
+most between the first sample and the end.
+
+Started from **Diagnostics** in the admin panel; the report is saved as JSON.
+"""
+import asyncio
+import inspect
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    #Windows
+    resource = None
+
+SOAK_ITERATIONS = int(os.getenv("SOAK_ITERATIONS", "2000"))
+SAMPLE_EVERY = 200
+TOP_GROWTH = 10
+
+
+def rss_bytes():
+    #Current resident set size where /proc has it, otherwise the peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class SoakReport:
+    def __init__(self, iterations):
+        self.iterations = iterations
+        self.done = 0
+        self.samples = []
+        self.top_growth = []
+        self.errors = 0
+        self.last_error = None
+        self.elapsed = 0.0
+
+    def sample(self, step_ms, overlays, controls):
+        current, peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        self.samples.append({
+            "iteration": self.done,
+            "rss_mb": round(rss / 2**20, 1) if rss is not None else None,
+            "heap_mb": round(current / 2**20, 2),
+            "heap_peak_mb": round(peak / 2**20, 2),
+            "overlays": overlays,
+            "controls": controls,
+            "step_p50_ms": round(_percentile(step_ms, 50), 2),
+            "step_p95_ms": round(_percentile(step_ms, 95), 2),
+            "step_max_ms": round(max(step_ms), 2),
+        })
+
+    def growth(self, field):
+        #Last sample against the first, which is taken once every view has been built at least once
+        values = [s[field] for s in self.samples if s[field] is not None]
+        return values[-1] - values[0] if len(values) > 1 else 0
+
+    def summary(self):
+        if not self.samples:
+            return "no samples"
+        last = self.samples[-1]
+        return (
+            f"{self.done} steps in {self.elapsed:.0f}s; heap {self.growth('heap_mb'):+.1f} MB, "
+            f"overlays {last['overlays']}, controls {self.growth('controls'):+d}, "
+            f"step p95 {last['step_p95_ms']:.0f}ms"
+        )
+
+    def to_json(self):
+        return json.dumps({
+            "iterations": self.iterations,
+            "done": self.done,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "elapsed_s": round(self.elapsed, 1),
+            "samples": self.samples,
+            "top_growth": self.top_growth,
+        }, indent=2)
+
+
+async def run(steps, overlay_count, control_count, iterations=SOAK_ITERATIONS, sample_every=SAMPLE_EVERY,
+              on_sample=None):
+    """steps: callables, sync or async, taking the step number; run round-robin.
+
+    overlay_count and control_count read the session's current page overlays and controls.
+    """
+    report = SoakReport(iterations)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    baseline = None
+    step_ms = []
+    started = time.perf_counter()
+    try:
+        for i in range(iterations):
+            start = time.perf_counter()
+            try:
+                result = steps[i % len(steps)](i)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as ex:
+                report.errors += 1
+                report.last_error = f"step {i}: {ex}"
+            step_ms.append((time.perf_counter() - start) * 1000)
+            #Lets the UI send its updates, as it would between real clicks
+            await asyncio.sleep(0)
+            report.done = i + 1
+            if report.done % sample_every == 0 or report.done == iterations:
+                report.sample(step_ms, overlay_count(), control_count())
+                step_ms = []
+                if baseline is None:
+                    baseline = tracemalloc.take_snapshot()
+                if on_sample:
+                    on_sample(report)
+        if baseline is not None:
+            stats = tracemalloc.take_snapshot().compare_to(baseline, "lineno")
+            report.top_growth = [
+                {"where": str(stat.traceback), "kb": round(stat.size_diff / 1024, 1), "blocks": stat.count_diff}
+                for stat in stats[:TOP_GROWTH]
+            ]
+    finally:
+        report.elapsed = time.perf_counter() - started
+        if started_tracing:
+            tracemalloc.stop()
+    return report
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import metrics
+from db import MONGO_URI
+
+log = logging.getLogger(__name__)
+
+#Remembers, per database, that initial setup is done so the first frame never waits on it
+SETUP_CACHE = os.getenv(
+    "SETUP_CACHE",
+    os.path.join(os.path.expanduser("~"), ".library_manager", "setup.json"),
+)
+
+#Startup work shared by every session in the process: name -> task
+_shared = {}
+
+#perf_counter() reading taken by main.py before its imports, so "import" covers all of them
+started = time.perf_counter()
+#Seconds since `started` at the end of each startup phase
+phases = {}
+
+
+def begin(perf_start):
+    global started
+    started = perf_start
+
+
+def mark(phase, since=None):
+    #since: a perf_counter() reading for phases that run in parallel with the others (e.g. connect)
+    phases[phase] = time.perf_counter() - (started if since is None else since)
+    metrics.observe(f"startup.{phase}", phases[phase] * 1000)
+    return phases[phase]
+
+
+def summary():
+    return ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in phases.items())
+
+
+def log_summary():
+    log.info("Startup: %s", summary())
+
+
+def once(name, factory):
+    """The task running factory(), started by the first session that asks and awaited by the rest.
+
+    A task that failed is started again by the next caller.
+    """
+    task = _shared.get(name)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        task = _shared[name] = asyncio.ensure_future(factory())
+    #One session closing its tab must not cancel the work for the others
+    return asyncio.shield(task)
+
+
+def forget(name):
+    _shared.pop(name, None)
+
+
+def _database_key():
+    return hashlib.sha256((MONGO_URI or "").encode()).hexdigest()[:16]
+
+
+def setup_done_cached():
+    """True or False as last seen for this database, or None if this machine has not checked it yet."""
+    try:
+        with open(SETUP_CACHE, encoding="utf-8") as f:
+            state = json.load(f)
+        if _database_key() in state.get("setup_done", []):
+            return True
+        return False if _database_key() in state.get("setup_pending", []) else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def remember_setup(done):
+    try:
+        with open(SETUP_CACHE, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    if not isinstance(state, dict):
+        state = {}
+    done_keys = set(state.get("setup_done", []))
+    pending_keys = set(state.get("setup_pending", []))
+    key = _database_key()
+    (done_keys if done else pending_keys).add(key)
+    (pending_keys if done else done_keys).discard(key)
+    try:
+        os.makedirs(os.path.dirname(SETUP_CACHE), exist_ok=True)
+        with open(SETUP_CACHE, "w", encoding="utf-8") as f:
+            json.dump({"setup_done": sorted(done_keys), "setup_pending": sorted(pending_keys)}, f)
+    except OSError as ex:
+        log.warning("Could not save setup state to %s: %s", SETUP_CACHE, ex)
+
+
+async def admin_exists(admins):
+    #One indexed document is enough to know setup happened; no need to count them all
+    return await admins.find_one({}, {"_id": 1}) is not None
@@ -0,0 +1,31 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog_cache
+import db
+import indexes
+import search
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """A fresh mongomock library database behind the app's shared collections."""
+    database = mongomock.MongoClient()["library"]
+    indexes.ensure_indexes(database, indexes.IndexReport())
+    #mongomock is not thread-safe, so its calls are serialised on one db thread
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    monkeypatch.setattr(db, "executor", executor)
+    monkeypatch.setattr(db, "get_db", lambda: database)
+    for col in (db.books_col, db.userinfo_col, db.admin_col, db.borrows_col, db.analytics_col, db.history_col):
+        monkeypatch.setattr(col, "_collection", None)
+    monkeypatch.setattr(search, "catalog", search.SearchIndex())
+    catalog_cache.cache.clear()
+    yield database
+    catalog_cache.cache.clear()
+    executor.shutdown()
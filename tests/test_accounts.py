@@ -0,0 +1,32 @@
+import pytest
+
+import accounts
+
+
+@pytest.fixture(autouse=True)
+def cheap_hashes(monkeypatch):
+    monkeypatch.setattr(accounts, "PASSWORD_HASH_COST", 4)
+
+
+def test_verify_hashed_password():
+    stored = accounts.make_hash("secret123")
+    assert stored.startswith(accounts.HASH_PREFIX)
+    assert accounts.verify(stored, "secret123") == (True, False)
+    assert accounts.verify(stored, "secret124") == (False, False)
+
+
+def test_verify_asks_for_rehash_after_cost_is_raised(monkeypatch):
+    stored = accounts.make_hash("secret123")
+    monkeypatch.setattr(accounts, "PASSWORD_HASH_COST", 5)
+    assert accounts.verify(stored, "secret123") == (True, True)
+
+
+def test_verify_plain_password_from_before_hashing():
+    assert accounts.verify("secret123", "secret123") == (True, True)
+    assert accounts.verify("secret123", "secret12") == (False, True)
+
+
+@pytest.mark.parametrize("stored", ["scrypt$oops", "scrypt$14$8$1$not base64$x", "scrypt$a$b$c$d$e$f"])
+def test_verify_treats_malformed_hash_as_plain_password(stored):
+    assert accounts.verify(stored, stored) == (True, True)
+    assert accounts.verify(stored, "something else") == (False, True)
@@ -0,0 +1,60 @@
+import metrics
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=4, ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60, clock=FakeClock())
+    cache.put("a", 1)
+    cache.put("b", 2)
+    #Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_put_refreshes_expiry():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 8
+    cache.put("a", 2)
+    clock.now = 15
+    assert cache.get("a") == 2
+    cache.invalidate("a")
+    assert cache.get("a", "gone") == "gone"
+
+
+def test_registered_cache_stats_are_exported(monkeypatch):
+    monkeypatch.setattr(metrics, "_gauges", {})
+    cache = TTLCache(maxsize=4, ttl=10, clock=FakeClock())
+    metrics.gauge("test_cache", cache.stats)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    snap = metrics.snapshot()
+    assert snap["gauges"]["test_cache"]["hit_rate"] == 0.5
+    text = metrics.to_prometheus(snap)
+    assert 'library_cache{name="test_cache",stat="hits"} 1' in text
+    assert 'library_cache{name="test_cache",stat="size"} 1' in text
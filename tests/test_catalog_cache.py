@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure
+
+import catalog_cache
+import search
+from models import Book
+
+
+def no_change_streams(self):
+    raise OperationFailure("The $changeStream stage is only supported on replica sets")
+
+
+def test_write_during_initial_load_reaches_the_index(database, monkeypatch):
+    monkeypatch.setattr(catalog_cache, "CATALOG_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(catalog_cache.CatalogFeed, "_watch", no_change_streams)
+    started = datetime(2026, 1, 1)
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 1, "updated_at": started})
+
+    async def scenario():
+        feed = catalog_cache.CatalogFeed(database.books, catalog_cache.CatalogCache(), asyncio.get_running_loop())
+        feed.start()
+        try:
+            assert await asyncio.to_thread(feed.opened.wait, 5)
+            #The catalog is read, then another process adds a title before the load is applied
+            books = list(database.books.find())
+            database.books.insert_one({
+                "name": "Emma", "author": "Jane Austen", "number": 2, "updated_at": started + timedelta(seconds=1),
+            })
+            search.catalog.load([Book.from_doc(book) for book in books])
+            feed.loaded.set()
+            for _ in range(100):
+                if search.catalog.stock_of("Emma", "Jane Austen") is not None:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            feed.stop()
+        assert search.catalog.stock_of("Emma", "Jane Austen") == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+import circulation
+import db
+from models import Loan
+
+
+def borrow(username):
+    return circulation.borrow_book(username, "Dune", "Frank Herbert")
+
+
+def test_double_return_restocks_once(database):
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 2})
+
+    async def scenario():
+        assert await borrow("ann") == circulation.BORROWED
+        assert await borrow("bob") == circulation.BORROWED
+        ann = Loan.from_doc(database.borrows.find_one({"username": "ann"})).to_doc()
+        bob = Loan.from_doc(database.borrows.find_one({"username": "bob"})).to_doc()
+        #Another patron's loan is never returned
+        assert await circulation.return_loans("ann", [bob]) == []
+        #The same loan returned twice at once, as by a double click, and once more afterwards
+        first, second = await asyncio.gather(
+            circulation.return_loans("ann", [ann]), circulation.return_loans("ann", [ann]),
+        )
+        assert len(first) + len(second) == 1
+        assert await circulation.return_loans("ann", [ann]) == []
+
+    asyncio.run(scenario())
+    assert database.books.find_one()["number"] == 1
+    assert database.borrows.count_documents({}) == 1
+    assert database.borrow_history.count_documents({}) == 1
+
+
+def test_return_all_leaves_loans_made_after_it_was_queued(database):
+    book_id = database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 0}).inserted_id
+    queued_at = datetime(2026, 3, 1, 12)
+    for date in (queued_at - timedelta(days=1), queued_at + timedelta(minutes=5)):
+        database.borrows.insert_one({
+            "username": "ann", "name": "Dune", "author": "Frank Herbert", "book_id": book_id, "date": date,
+        })
+
+    returned = asyncio.run(circulation.return_all("ann", borrowed_before=queued_at))
+
+    assert [loan["date"] for loan in returned] == [queued_at - timedelta(days=1)]
+    assert database.books.find_one()["number"] == 1
+    assert database.borrows.find_one()["date"] == queued_at + timedelta(minutes=5)
+
+
+@pytest.mark.parametrize("applied", [False, True])
+def test_failed_delete_counts_only_if_the_loan_left(database, monkeypatch, applied):
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 1})
+    asyncio.run(borrow("ann"))
+    loan = Loan.from_doc(database.borrows.find_one()).to_doc()
+
+    async def lost_reply(filter, **kwargs):
+        #The connection drops after the server may or may not have applied the delete
+        if applied:
+            database.borrows.delete_one(filter)
+        raise AutoReconnect("connection closed")
+    monkeypatch.setattr(db.borrows_col, "delete_many", lost_reply)
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(circulation.return_loans("ann", [loan]))
+    assert database.borrows.count_documents({}) == (0 if applied else 1)
+    assert database.borrow_history.count_documents({}) == (1 if applied else 0)
+    assert database.books.find_one()["number"] == (1 if applied else 0)
+    #A loan left behind can be returned again straight away
+    assert database.borrows.count_documents({"return_token": {"$exists": True}}) == 0
+
+
+def test_claim_left_by_a_stopped_return_lapses(database):
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 0})
+    stale = ObjectId.from_datetime(datetime.now(timezone.utc) - circulation.RETURN_CLAIM_TIMEOUT - timedelta(seconds=1))
+    fresh = ObjectId()
+    for token in (stale, fresh):
+        database.borrows.insert_one({"username": "ann", "name": "Dune", "author": "Frank Herbert", "return_token": token})
+    loans = [{"_id": doc["_id"]} for doc in database.borrows.find()]
+
+    returned = asyncio.run(circulation.return_loans("ann", loans))
+
+    assert len(returned) == 1
+    assert database.borrows.find_one()["return_token"] == fresh
+
+
+async def walk(fetch):
+    #Every page in order, following next_cursor until it runs out
+    pages, cursor = [], None
+    while True:
+        docs, cursor = await fetch(cursor)
+        pages.append(docs)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("count", [5, 4])
+def test_loan_pages_break_ties_on_id(database, count):
+    base = datetime(2026, 3, 1, 12)
+    #Several loans share a borrow and due date, and are inserted out of _id order
+    ids = sorted(ObjectId() for _ in range(count))
+    for i in reversed(range(count)):
+        date = base + timedelta(days=i // 3)
+        database.borrows.insert_one({
+            "_id": ids[i], "username": "ann", "name": f"Book {i}", "author": "A",
+            "date": date, "due_date": date - timedelta(days=30),
+        })
+    database.borrows.insert_one({
+        "username": "bob", "name": "Other", "author": "A", "date": base, "due_date": base - timedelta(days=30),
+    })
+
+    loans = asyncio.run(walk(lambda cursor: circulation.loans_page("ann", cursor, limit=2)))
+    overdue = asyncio.run(walk(lambda cursor: circulation.overdue_page(cursor, limit=2)))
+
+    assert [loan.id for page in loans for loan in page] == ids
+    assert all(len(page) == 2 for page in loans[:-1])
+    #A full last page needs one more fetch to find there is nothing after it
+    assert [len(page) for page in loans][-1] == (1 if count % 2 else 0)
+    overdue_rows = [loan for page in overdue for loan in page]
+    assert len(overdue_rows) == count + 1
+    assert len({loan.id for loan in overdue_rows}) == count + 1
+    keys = [(loan.due_date, loan.id) for loan in overdue_rows]
+    assert keys == sorted(keys)
+    assert all(loan.overdue_days >= 30 for loan in overdue_rows)
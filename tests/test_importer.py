@@ -0,0 +1,21 @@
+import pytest
+
+from importer import parse_book
+
+
+def test_parse_book_trims_and_reads_copies():
+    assert parse_book({"name": " Dune ", "author": "Frank Herbert", "number": "3"}) == ("Dune", "Frank Herbert", 3)
+    assert parse_book({"name": "Dune", "author": "Frank Herbert", "copies": 2}) == ("Dune", "Frank Herbert", 2)
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"name": "", "author": "Frank Herbert", "number": 1}, "required"),
+    ({"name": "Dune", "number": 1}, "required"),
+    ({"name": "Dune", "author": "Frank Herbert", "number": "many"}, "whole number"),
+    ({"name": "Dune", "author": "Frank Herbert"}, "whole number"),
+    ({"name": "Dune", "author": "Frank Herbert", "number": -1}, "negative"),
+    ({"name": "Du\ufffdne", "author": "Frank Herbert", "number": 1}, "UTF-8"),
+])
+def test_parse_book_rejects_bad_rows(row, message):
+    with pytest.raises(ValueError, match=message):
+        parse_book(row)
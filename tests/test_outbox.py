@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure
+
+import circulation
+import outbox
+from models import Loan
+
+
+def replay(queue, *ops):
+    async def scenario():
+        for kind, payload in ops:
+            await queue.enqueue(kind, payload)
+        await queue.flush()
+        await queue.refresh()
+
+    asyncio.run(scenario())
+    assert queue.stats()["depth"] == 0
+
+
+def test_add_replayed_twice_is_applied_once(database, tmp_path):
+    queue = outbox.Outbox(str(tmp_path / "outbox.sqlite3"))
+    add = {"name": "Dune", "author": "Frank Herbert", "number": 3, "token": ObjectId()}
+    #As after a crash between applying the op and deleting it from the queue
+    replay(queue, (outbox.ADD, add), (outbox.ADD, add))
+    replay(queue, (outbox.ADD, add), (outbox.ADD, dict(add, number=2, token=ObjectId())))
+    assert database.books.find_one({"name": "Dune"})["number"] == 5
+
+
+def test_return_replayed_twice_restocks_once(database, tmp_path):
+    queue = outbox.Outbox(str(tmp_path / "outbox.sqlite3"))
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 1})
+    assert asyncio.run(circulation.borrow_book("ann", "Dune", "Frank Herbert")) == circulation.BORROWED
+    loan = Loan.from_doc(database.borrows.find_one()).to_doc()
+    ret = {"username": "ann", "loans": [loan]}
+    replay(queue, (outbox.RETURN, ret))
+    replay(queue, (outbox.RETURN, ret))
+    assert database.books.find_one()["number"] == 1
+    assert database.borrows.count_documents({}) == 0
+    assert database.borrow_history.count_documents({}) == 1
+
+
+def test_online_operations_skip_the_queue(database, tmp_path, monkeypatch):
+    queue = outbox.Outbox(str(tmp_path / "outbox.sqlite3"))
+    database.books.insert_one({"name": "Dune", "author": "Frank Herbert", "number": 3})
+    borrow = {"username": "ann", "name": "Dune", "author": "Frank Herbert", "date": datetime.now()}
+
+    async def scenario():
+        queue.start()
+        await queue.refresh()
+        try:
+            results = await asyncio.gather(*(
+                queue.submit(outbox.BORROW, dict(borrow, loan_id=ObjectId())) for _ in range(4)
+            ))
+            assert sorted(results) == sorted([circulation.BORROWED] * 3 + [circulation.OUT_OF_STOCK])
+            assert queue.stats()["depth"] == 0
+
+            async def unreachable(*args, **kwargs):
+                raise ConnectionFailure("no server")
+            monkeypatch.setattr(circulation, "return_all", unreachable)
+            assert await queue.submit(outbox.RETURN_ALL, {"username": "ann", "date": datetime.now()}) == outbox.QUEUED
+            assert queue.stats()["depth"] == 1 and not queue.online
+        finally:
+            queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Book
+from search import SearchIndex, within_one_edit
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.load([
+        Book(1, "The Hobbit", "J. R. R. Tolkien", 2),
+        Book(2, "The Silmarillion", "J. R. R. Tolkien", 0),
+        Book(3, "Dune", "Frank Herbert", 4),
+    ])
+    return index
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("hobbit", "hobbit", True),
+    ("hobbit", "hobit", True),
+    ("hobbit", "hobbits", True),
+    ("hobbit", "hobbjt", True),
+    ("hobbit", "hobibt", True),
+    ("hobbit", "hbobti", False),
+    ("hobbit", "hob", False),
+    ("dune", "dnue", True),
+    ("dune", "deun", False),
+])
+def test_within_one_edit(a, b, expected):
+    assert within_one_edit(a, b) is expected
+    assert within_one_edit(b, a) is expected
+
+
+def test_search_matches_title_author_and_typos(index):
+    assert index.search("hobbit")[0].name == "The Hobbit"
+    assert {hit.name for hit in index.search("tolkien")} == {"The Hobbit", "The Silmarillion"}
+    assert index.search("hobit")[0].name == "The Hobbit"
+    assert index.search("nothing like it") == []
+
+
+def test_set_stock_ignores_older_counts(index):
+    now = datetime(2026, 1, 1, 12)
+    changes = []
+    index.on_stock_change = lambda name, author, number: changes.append(number)
+    index.set_stock("Dune", "Frank Herbert", 3, now)
+    index.set_stock("Dune", "Frank Herbert", 5, now - timedelta(seconds=1))
+    assert index.stock_of("Dune", "Frank Herbert") == 3
+    index.set_stock("Dune", "Frank Herbert", 2, now + timedelta(seconds=1))
+    assert index.stock_of("Dune", "Frank Herbert") == 2
+    assert changes == [3, 2]
+
+
+def test_add_and_remove(index):
+    index.add({"_id": 4, "name": "Children of Dune", "author": "Frank Herbert", "number": 1})
+    assert {hit.name for hit in index.search("dune")} == {"Dune", "Children of Dune"}
+    assert index.key_of(4) == ("Children of Dune", "Frank Herbert")
+    assert index.remove_by_id(4)
+    assert [hit.name for hit in index.search("children")] == []